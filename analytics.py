@@ -0,0 +1,459 @@
+"""
+file: analytics.py
+description: match analytics over replay logs. Logs are re-simulated
+headlessly, one at a time, and every shot, hit, barrel chain and portal
+crossing becomes a row in a columnar store: one .npy file per column
+(readable with numpy.load, mmap_mode works too), appended in chunks, so
+memory stays flat no matter how many matches are ingested. Reports are
+computed by streaming over the column files a chunk at a time.
+
+store layout:
+    <column>.npy    one per column of COLUMNS
+    matches.txt     "match id<TAB>map id<TAB>replay path" per ingested match
+    maps.txt        map file names, line n is map id n
+
+usage:
+    python analytics.py ingest STORE LOG_OR_DIR...
+    python analytics.py report STORE [--top N]
+"""
+
+import argparse
+import ast
+import os
+import sys
+from array import array
+from collections import Counter
+from replay import readReplay
+from tanks import Board
+from renderers import NullRenderer
+
+SHOT, HIT, EXPLOSION, PORTAL = 1, 2, 3, 4 # event kinds
+# name, array typecode, numpy dtype (byte order added at runtime)
+COLUMNS = (("match", "I", "u4"), ("map", "H", "u2"), ("time", "f", "f4"), \
+    ("kind", "B", "u1"), ("player", "B", "u1"), ("row", "h", "i2"), \
+    ("col", "h", "i2"), ("value", "i", "i4"))
+CHUNK = 1 << 16 # rows buffered per column before writing, and read at once
+HEADER_SIZE = 128 # fixed .npy header size, so the row count can be patched
+NATIVE = "<" if sys.byteorder == "little" else ">"
+P1_KEYS = "wasdfr"
+P2_KEYS = "okl;'["
+
+class EventBoard(Board):
+    """
+    Board that reports what happens during play as event rows.
+        events: rows of the current move, see COLUMNS (without match, map
+            and time) <- list of tuples
+        actor: player whose key is being applied, 0 for fire <- int
+        shooting: outcome of the shot in flight (0 miss, 1 barrel,
+            2 player), None if no shot is in flight <- int
+        flames: explosions in the current barrel chain <- int
+    """
+    __slots__ = ("events", "actor", "shooting", "flames")
+
+    def __init__(self, filename, seed):
+        """
+            filename -> string -> map file or builtin map letter
+            seed -> int -> RNG seed of the match
+        """
+        self.events = []
+        self.actor = 0
+        self.shooting = None
+        self.flames = 0
+        Board.__init__(self, filename, NullRenderer(), seed)
+
+    def turn(self, char):
+        self.actor = 1 if char in P1_KEYS else 2 if char in P2_KEYS else 0
+        Board.turn(self, char)
+
+    def shoot(self, start, direction, owner=0):
+        self.shooting = 0
+        Board.shoot(self, start, direction, owner)
+        self.events.append((SHOT, self.actor) + self.coords(start) + \
+            (self.shooting,))
+        self.shooting = None
+
+    def bulletHits(self, space):
+        if self.isPortal(space):
+            self.events.append((PORTAL, self.actor) + self.coords(space) + (1,))
+        return Board.bulletHits(self, space)
+
+    def teleport(self, start):
+        if self.shooting is None: # bullets are counted by bulletHits
+            self.events.append((PORTAL, self.actor) + self.coords(start) + (0,))
+        return Board.teleport(self, start)
+
+    def explode(self, start):
+        if self.shooting is not None:
+            self.shooting = max(self.shooting, 1)
+        self.flames = 0
+        Board.explode(self, start)
+        self.events.append((EXPLOSION, self.actor) + self.coords(start) + \
+            (self.flames,))
+
+    def flameOut(self, start):
+        self.flames += 1
+        return Board.flameOut(self, start)
+
+    def hit(self, player):
+        self.recordHit(player, 1)
+        Board.hit(self, player)
+
+    def hitBothPlayers(self):
+        self.recordHit(1, 1)
+        self.recordHit(2, 1)
+        Board.hitBothPlayers(self)
+
+    def recordHit(self, player, damage):
+        """
+        Adds a hit event at the player's location; the value is the health
+        the player has left.
+
+            player -> int -> number of player who was hit (1 or 2)
+            damage -> int -> health lost
+        """
+        if self.shooting is not None:
+            self.shooting = 2
+        space = self.p1 if player == 1 else self.p2
+        health = (self.p1h if player == 1 else self.p2h) - damage
+        self.events.append((HIT, player) + self.coords(space) + (health,))
+
+def replays(paths):
+    """
+    Yields replay log paths: files as given, directories walked for *.log.
+
+        paths -> iterable of strings -> files and directories
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(".log"):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+def matchEvents(filename, seed, moves):
+    """
+    Re-simulates a match and yields its events as (time, kind, player, row,
+    col, value) tuples. Raises ValueError if the board's hash differs from
+    one in the log.
+
+        filename, seed, moves -> as returned by replay.readReplay()
+    """
+    board = EventBoard(filename, seed)
+    for t, key, stateHash in moves:
+        if stateHash is not None and stateHash != board.hash():
+            raise ValueError("board differs from the log at %.3f s" % t)
+        board.turn(key)
+        for event in board.events:
+            yield (t,) + event
+        board.events = []
+
+class ColumnStore():
+    """
+    Columnar event table on disk.
+        directory: where the column files live <- string
+        buffers: rows not written yet, per column <- list of arrays
+        rows: rows written to the column files <- int
+        matches: matches ingested so far <- int
+        pending: matches.txt lines of matches whose rows aren't written yet
+            <- list of strings
+        maps: map file name -> map id <- dict
+    """
+    __slots__ = ("directory", "buffers", "rows", "matches", "pending", \
+        "maps")
+
+    def __init__(self, directory):
+        """
+        Opens a store, creating it if needed. New rows are appended.
+
+            directory -> string -> store directory
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.buffers = [array(code) for name, code, dtype in COLUMNS]
+        self.rows = None
+        for name, code, dtype in COLUMNS:
+            path = self.column(name)
+            if not os.path.exists(path):
+                writeHeader(path, dtype, 0)
+            rows = readHeader(path)[1]
+            if self.rows is not None and rows != self.rows:
+                raise ValueError(directory + ": columns have different lengths")
+            self.rows = rows
+        self.maps = {}
+        if os.path.exists(os.path.join(directory, "maps.txt")):
+            with open(os.path.join(directory, "maps.txt")) as maps:
+                for line in maps:
+                    self.maps[line.rstrip("\n")] = len(self.maps)
+        self.matches = 0
+        self.pending = []
+        if os.path.exists(os.path.join(directory, "matches.txt")):
+            with open(os.path.join(directory, "matches.txt")) as matches:
+                self.matches = sum(1 for line in matches)
+
+    def column(self, name):
+        """
+        Returns the path of a column file.
+
+            name -> string -> column name
+        """
+        return os.path.join(self.directory, name + ".npy")
+
+    def ingest(self, path):
+        """
+        Re-simulates a replay log and appends its events. Returns the number
+        of events added.
+
+            path -> string -> replay log
+        """
+        filename, seed, moves = readReplay(path)
+        # a match is simulated in full before any of it is stored, so a
+        # broken log leaves no rows behind
+        events = list(matchEvents(filename, seed, moves))
+        match = self.matches
+        mapId = self.mapId(filename)
+        for event in events:
+            self.append((match, mapId) + event)
+        self.pending.append("%d\t%d\t%s\n" % (match, mapId, path)) # listed
+            # once its rows are written, see flush()
+        self.matches += 1
+        return len(events)
+
+    def mapId(self, filename):
+        """
+        Returns the id of a map, adding it to maps.txt if it's new.
+
+            filename -> string -> map file name
+        """
+        if filename not in self.maps:
+            self.maps[filename] = len(self.maps)
+            with open(os.path.join(self.directory, "maps.txt"), "a") as maps:
+                maps.write(filename + "\n")
+        return self.maps[filename]
+
+    def append(self, row):
+        """
+        Buffers one row, writing the buffers out once they're full.
+
+            row -> tuple -> one value per column of COLUMNS
+        """
+        for buffer, value in zip(self.buffers, row):
+            buffer.append(value)
+        if len(self.buffers[0]) >= CHUNK:
+            self.flush()
+
+    def flush(self):
+        """
+        Appends the buffered rows to the column files, then lists their
+        matches in matches.txt. Rows go right after the rows the headers
+        count, not at the end of the files: rows a crash left behind
+        without their header update are written over.
+        """
+        if self.buffers[0]:
+            rows = self.rows + len(self.buffers[0])
+            for (name, code, dtype), buffer in zip(COLUMNS, self.buffers):
+                with open(self.column(name), "r+b") as column:
+                    column.seek(HEADER_SIZE + self.rows * buffer.itemsize)
+                    buffer.tofile(column)
+                    column.truncate()
+            for (name, code, dtype), buffer in zip(COLUMNS, self.buffers):
+                writeHeader(self.column(name), dtype, rows)
+                del buffer[:]
+            self.rows = rows
+        if self.pending:
+            with open(os.path.join(self.directory, "matches.txt"), "a") as \
+                    matches:
+                matches.writelines(self.pending)
+            self.pending = []
+
+    def close(self):
+        self.flush()
+
+def writeHeader(path, dtype, rows):
+    """
+    Writes (or rewrites in place) the .npy header of a 1-d column file.
+
+        path -> string -> column file
+        dtype -> string -> numpy type without byte order, e.g. "u4"
+        rows -> int -> length of the column
+    """
+    descr = ("|" if dtype[1:] == "1" else NATIVE) + dtype
+    text = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % \
+        (descr, rows)
+    text = text.ljust(HEADER_SIZE - 10 - 1) + "\n"
+    header = b"\x93NUMPY\x01\x00" + len(text).to_bytes(2, "little") + \
+        text.encode("latin-1")
+    mode = "r+b" if os.path.exists(path) else "wb"
+    with open(path, mode) as column:
+        column.write(header)
+
+def readHeader(path):
+    """
+    Returns (header size, rows, byte order) of a 1-d .npy column file.
+
+        path -> string -> column file
+    """
+    with open(path, "rb") as column:
+        start = column.read(10)
+        if start[:6] != b"\x93NUMPY" or start[6] != 1:
+            raise ValueError(path + " is not a version 1 .npy file")
+        length = int.from_bytes(start[8:10], "little")
+        header = ast.literal_eval(column.read(length).decode("latin-1"))
+    return 10 + length, header["shape"][0], header["descr"][0]
+
+def scan(directory, names):
+    """
+    Yields the given columns of a store a chunk at a time, as tuples of
+    arrays of the same length.
+
+        directory -> string -> store directory
+        names -> tuple of strings -> columns to read
+    """
+    codes = dict((name, code) for name, code, dtype in COLUMNS)
+    files = []
+    try:
+        for name in names:
+            path = os.path.join(directory, name + ".npy")
+            start, rows, order = readHeader(path)
+            column = open(path, "rb")
+            files.append((column, array(codes[name]), order))
+            column.seek(start)
+        left = rows
+        while left > 0:
+            count = min(CHUNK, left)
+            chunk = []
+            for column, empty, order in files:
+                values = array(empty.typecode)
+                values.fromfile(column, count)
+                if order not in ("|", NATIVE):
+                    values.byteswap()
+                chunk.append(values)
+            left -= count
+            yield tuple(chunk)
+    finally:
+        for column, empty, order in files:
+            column.close()
+
+def shotEfficiency(directory):
+    """
+    Returns {player: (shots, barrels hit, players hit)}.
+
+        directory -> string -> store directory
+    """
+    totals = {1: [0, 0, 0], 2: [0, 0, 0]}
+    for kinds, players, values in scan(directory, ("kind", "player", "value")):
+        for kind, player, value in zip(kinds, players, values):
+            if kind == SHOT and player in totals:
+                totals[player][0] += 1
+                if value:
+                    totals[player][value] += 1
+    return dict((player, tuple(counts)) for player, counts in totals.items())
+
+def killLocations(directory):
+    """
+    Returns a Counter of (map id, row, col) where players lost their last
+    health, and one of every hit.
+
+        directory -> string -> store directory
+    """
+    kills = Counter()
+    hits = Counter()
+    for maps, kinds, rows, cols, values in scan(directory, \
+            ("map", "kind", "row", "col", "value")):
+        for mapId, kind, row, col, value in zip(maps, kinds, rows, cols, values):
+            if kind == HIT:
+                hits[mapId, row, col] += 1
+                if value <= 0:
+                    kills[mapId, row, col] += 1
+    return kills, hits
+
+def chainLengths(directory):
+    """
+    Returns a Counter of barrel chain lengths (barrels per explosion).
+
+        directory -> string -> store directory
+    """
+    lengths = Counter()
+    for kinds, values in scan(directory, ("kind", "value")):
+        for kind, value in zip(kinds, values):
+            if kind == EXPLOSION:
+                lengths[value] += 1
+    return lengths
+
+def portalUsage(directory):
+    """
+    Returns a Counter of (map id, row, col, by bullet) portal crossings.
+
+        directory -> string -> store directory
+    """
+    usage = Counter()
+    for maps, kinds, rows, cols, values in scan(directory, \
+            ("map", "kind", "row", "col", "value")):
+        for mapId, kind, row, col, value in zip(maps, kinds, rows, cols, values):
+            if kind == PORTAL:
+                usage[mapId, row, col, value] += 1
+    return usage
+
+def report(directory, top=5):
+    """
+    Returns a printable summary of a store.
+
+        directory -> string -> store directory
+        top -> int -> entries shown per ranking
+    """
+    store = ColumnStore(directory)
+    names = dict((mapId, name) for name, mapId in store.maps.items())
+    result = "%d matches, %d events\n" % (store.matches, store.rows)
+
+    result += "\nShot efficiency:\n"
+    for player, (shots, barrels, players) in sorted(shotEfficiency(directory).items()):
+        rate = players / shots * 100 if shots else 0.0
+        result += "  player %d: %d shots, %d barrels, %d players hit (%.1f%%)\n" \
+            % (player, shots, barrels, players, rate)
+
+    kills, hits = killLocations(directory)
+    result += "\nDeadliest spaces (kills / hits):\n"
+    for (mapId, row, col), count in kills.most_common(top):
+        result += "  %s (%d,%d): %d / %d\n" % (names.get(mapId, "?"), row, col, \
+            count, hits[mapId, row, col])
+
+    result += "\nBarrel chain lengths:\n"
+    for length, count in sorted(chainLengths(directory).items()):
+        result += "  %3d: %d\n" % (length, count)
+
+    result += "\nBusiest portals:\n"
+    for (mapId, row, col, bullet), count in portalUsage(directory).most_common(top):
+        result += "  %s (%d,%d) %s: %d\n" % (names.get(mapId, "?"), row, col, \
+            "bullets" if bullet else "tanks", count)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Match analytics.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest = commands.add_parser("ingest", help="add replay logs to a store")
+    ingest.add_argument("store")
+    ingest.add_argument("logs", nargs="+", help="replay logs or directories")
+    summary = commands.add_parser("report", help="summarize a store")
+    summary.add_argument("store")
+    summary.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        store = ColumnStore(args.store)
+        try:
+            for path in replays(args.logs):
+                try:
+                    count = store.ingest(path)
+                except (OSError, ValueError) as e:
+                    print("skipped " + path + ": " + str(e))
+                    continue
+                print("%s: %d events" % (path, count))
+        finally:
+            store.close()
+    else:
+        sys.stdout.write(report(args.store, args.top))
+
+if __name__ == "__main__":
+    main()
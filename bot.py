@@ -0,0 +1,560 @@
+"""
+file: bot.py
+description: Monte Carlo tree search bot. Each move, the bot searches from a
+snapshot of the board for a fixed wall-clock budget on its own headless
+board: it walks down the tree by UCB1, lets the opponent answer with a
+random key, and plays the rest of the way out with a quick rollout policy
+(shoot when the enemy is in the line of fire, otherwise a random key).
+Tree nodes are keyed by the board's Zobrist hash, so positions reached in
+different orders share statistics. With workers, every process searches
+the same position independently and the root statistics are added up.
+
+BotScheduler is a much cheaper bot for hosting many matches: every tick it
+reads each bot's situation into one byte and looks up every bot's action at
+once in a policy table (TABLE) with a single bytes.translate() call, on a
+worker thread that runs between ticks.
+
+usage:
+    python tanks.py --bot 2 [--bot-time S] [--bot-workers N]
+    python bot.py [MAP] [--time S] [--workers N] [--moves N]
+        benchmark: prints rollouts per second
+    python bot.py [MAP] --batch N
+        benchmark: batched decisions for N bots, per bot and one at a time
+"""
+
+import argparse
+import math
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from renderers import NullRenderer
+from entities import BARREL, TANK1, TANK2
+
+BUDGET = 0.25 # default seconds of search per move
+EXPLORATION = 1.4 # UCB1 exploration constant
+DEPTH = 40 # moves per side looked ahead (tree plus rollout)
+AIM = 0.9 # chance the rollout policy shoots when it has a clear shot
+KEYS = (None, "wasdfr", "okl;'[") # per player; None in ACTIONS = no key
+ACTIONS = (None, (None,) + tuple(KEYS[1]), (None,) + tuple(KEYS[2]))
+FIRE, BOMB = 5, 6 # indexes into ACTIONS[player]; 1-4 move N-W-S-E
+
+def search(board, snapshot, player, budget, rng):
+    """
+    Runs MCTS from a snapshot until the budget runs out (at least one
+    rollout). Returns (visits, values, rollouts): per action of ACTIONS,
+    how often it was tried from the root and the reward it collected.
+
+        board -> Board -> headless board of the same map to search on
+        snapshot -> tuple -> position to search from (Board.snapshot())
+        player -> int -> number of the player to move (1 or 2)
+        budget -> float -> seconds to search
+        rng -> random.Random -> source of randomness
+    """
+    actions = ACTIONS[player]
+    replies = ACTIONS[3 - player]
+    table = {} # board hash -> [visits, visits per action, reward per action]
+    root = table[board.snapshotHash(snapshot)] = \
+        [0, [0] * len(actions), [0.0] * len(actions)]
+    board.restore(snapshot)
+    health = (board.p1h, board.p2h)
+    rollouts = 0
+    deadline = time.perf_counter() + budget
+    while rollouts == 0 or time.perf_counter() < deadline:
+        board.restore(snapshot)
+        path = []
+        node = root
+        depth = 0
+        while node is not None and depth < DEPTH and not board.gameOver():
+            action = select(node, rng)
+            path.append((node, action))
+            play(board, actions[action])
+            play(board, rng.choice(replies))
+            depth += 1
+            key = board.hash()
+            if key in table:
+                node = table[key]
+            else:
+                table[key] = [0, [0] * len(actions), [0.0] * len(actions)]
+                node = None
+        reward = rollout(board, player, DEPTH - depth, health, rng)
+        for node, action in path:
+            node[0] += 1
+            node[1][action] += 1
+            node[2][action] += reward
+        rollouts += 1
+    return root[1], root[2], rollouts
+
+def select(node, rng):
+    """
+    Returns the index of the action to try at a node: an untried one if
+    there is one, otherwise the best by UCB1.
+
+        node -> list -> table entry, see search()
+        rng -> random.Random -> source of randomness
+    """
+    visits, counts, rewards = node
+    untried = [i for i, count in enumerate(counts) if count == 0]
+    if untried:
+        return rng.choice(untried)
+    scale = EXPLORATION * math.sqrt(math.log(visits))
+    return max(range(len(counts)), key=lambda i: rewards[i] / counts[i] + \
+        scale / math.sqrt(counts[i]))
+
+def play(board, key):
+    """
+    Applies a key to the board (None = no key).
+    """
+    if key is not None:
+        board.turn(key)
+
+def aimed(board, player):
+    """
+    Returns true if the player's tank would hit the enemy by shooting now.
+
+        board -> Board -> board to look at
+        player -> int -> number of the player (1 or 2)
+    """
+    if player == 1:
+        cells, direction, portal = board.ray(board.p1, board.p1d)
+        return board.p2 in cells
+    cells, direction, portal = board.ray(board.p2, board.p2d)
+    return board.p1 in cells
+
+def rollout(board, player, moves, health, rng):
+    """
+    Plays both sides with the rollout policy and returns the reward for
+    player: 1 for a win or for losing less health than the enemy since
+    health was measured, 0 for the opposite, 0.5 for even.
+
+        board -> Board -> board to play on
+        player -> int -> number of the player searching (1 or 2)
+        moves -> int -> moves per side to play at most
+        health -> (int, int) -> players' health at the root
+        rng -> random.Random -> source of randomness
+    """
+    for _ in range(moves):
+        if board.gameOver():
+            break
+        for side in (player, 3 - player):
+            if aimed(board, side) and rng.random() < AIM:
+                board.turn(KEYS[side][4]) # fire
+            else:
+                play(board, rng.choice(ACTIONS[side]))
+    if board.gameOver():
+        winner = board.winner()
+        return 1.0 if winner == player else 0.0 if winner else 0.5
+    lead = (board.p1h - health[0]) - (board.p2h - health[1])
+    if player == 2:
+        lead = -lead
+    return 1.0 if lead > 0 else 0.0 if lead < 0 else 0.5
+
+_board = None # each worker process's search board, see startWorker()
+
+def startWorker(filename, lines):
+    """
+    Builds the search board of a worker process.
+
+        filename, lines -> as for Board()
+    """
+    global _board
+    from tanks import Board
+    _board = Board(filename, NullRenderer(), 0, lines)
+
+def searchWorker(snapshot, player, budget, seed):
+    """
+    search() on the worker's board. Arguments are as for search(), with a
+    seed instead of an RNG.
+    """
+    return search(_board, snapshot, player, budget, random.Random(seed))
+
+class BotPlayer():
+    """
+    A bot controlling one tank.
+        player: number of the player it controls <- int
+        budget: seconds of search per move <- float
+        board: search board, used without workers <- Board
+        pool: worker processes, None for searching in this process
+            <- ProcessPoolExecutor
+        workers: number of worker processes <- int
+        rng: source of randomness and worker seeds <- random.Random
+        thread: background search started by poll() <- threading.Thread
+        result: key chosen by the background search (a list so that "no
+            key" can be told from "not done") <- list
+        moves, rollouts, thinking: totals for rate() <- int, int, float
+    """
+    __slots__ = ("player", "budget", "board", "pool", "workers", "rng", \
+        "thread", "result", "moves", "rollouts", "thinking")
+
+    def __init__(self, player, filename, lines=None, seed=None, \
+            budget=BUDGET, workers=0):
+        """
+            player -> int -> number of the player to control (1 or 2)
+            filename, lines -> as for Board(), the map being played
+            seed -> int -> seed of the bot's randomness (random if None)
+            budget -> float -> seconds of search per move
+            workers -> int -> processes to search with (0 = this process)
+        """
+        from tanks import Board
+        self.player = player
+        self.budget = budget
+        self.board = Board(filename, NullRenderer(), 0, lines)
+        self.workers = workers
+        self.pool = None
+        if workers > 0:
+            self.pool = ProcessPoolExecutor(workers, initializer=startWorker, \
+                initargs=(filename, lines))
+        self.rng = random.Random(seed)
+        self.thread = None
+        self.result = None
+        self.moves = 0
+        self.rollouts = 0
+        self.thinking = 0.0
+
+    def choose(self, snapshot):
+        """
+        Searches a position and returns the key to press (None = no key).
+
+            snapshot -> tuple -> position to move from (Board.snapshot())
+        """
+        start = time.perf_counter()
+        if self.pool is None:
+            visits, rewards, rollouts = search(self.board, snapshot, \
+                self.player, self.budget, self.rng)
+        else:
+            jobs = [self.pool.submit(searchWorker, snapshot, self.player, \
+                self.budget, self.rng.getrandbits(64)) \
+                for _ in range(self.workers)]
+            visits = [0] * len(ACTIONS[self.player])
+            rewards = [0.0] * len(visits)
+            rollouts = 0
+            for job in jobs:
+                jobVisits, jobRewards, jobRollouts = job.result()
+                for i in range(len(visits)):
+                    visits[i] += jobVisits[i]
+                    rewards[i] += jobRewards[i]
+                rollouts += jobRollouts
+        self.moves += 1
+        self.rollouts += rollouts
+        self.thinking += time.perf_counter() - start
+        best = max(range(len(visits)), key=lambda i: (visits[i], rewards[i]))
+        return ACTIONS[self.player][best]
+
+    def poll(self, board):
+        """
+        Call this often during a match. Starts searching the current
+        position when the bot is idle, and returns the chosen key once the
+        search is done (None while it's thinking or if it chose no key).
+
+            board -> Board -> board being played
+        """
+        if self.thread is None:
+            snapshot = board.snapshot()
+            self.result = None
+            self.thread = threading.Thread(target=lambda: \
+                setattr(self, "result", [self.choose(snapshot)]))
+            self.thread.daemon = True
+            self.thread.start()
+            return None
+        if self.thread.is_alive():
+            return None
+        self.thread = None
+        return self.result[0] if self.result else None
+
+    def patch(self, changes):
+        """
+        Patches the search board when the map is edited (see Board.patch()),
+        once the search running now, if any, is done.
+
+            changes -> {int: char} dict -> as for Board.patch()
+        """
+        if self.thread is not None:
+            self.thread.join()
+        self.board.patch(changes)
+
+    def rate(self):
+        """
+        Returns the rollouts per second of search so far.
+        """
+        return self.rollouts / self.thinking if self.thinking else 0.0
+
+    def report(self):
+        """
+        Returns a one-line summary for after the match.
+        """
+        return "Bot (player %d): %d moves, %d rollouts, %.0f rollouts/s" % \
+            (self.player, self.moves, self.rollouts, self.rate()) + \
+            (" on %d processes" % self.workers if self.pool else "")
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+def policyTable():
+    """
+    Returns the policy of BotScheduler as a translate table: the index into
+    ACTIONS[player] to play, by situation code. A code's bits are
+        0-3: the enemy is on the bullet path leaving the tank N, W, S, E
+        4-5: direction the tank faces (N-W-S-E = 0-1-2-3)
+        6-7: random, to pick a move when there's nothing to aim at
+    """
+    table = bytearray(256)
+    for code in range(256):
+        aims = code & 15
+        facing = code >> 4 & 3
+        if aims >> facing & 1:
+            table[code] = FIRE
+        elif aims:
+            table[code] = (aims & -aims).bit_length() # move to face it
+        else:
+            table[code] = 1 + (code >> 6) # wander
+    return bytes(table)
+
+TABLE = policyTable()
+
+class BotScheduler():
+    """
+    Decides the keys of many bots at once, e.g. every bot of every match a
+    server hosts, for the price of a table lookup each. All boards must be
+    of one map (bullet paths are shared). With start(), a worker thread
+    decides the next tick's keys while the caller waits for that tick.
+        bots: (board, player) of every bot <- list of tuples
+        seats: what gather() reads of each bot: (board, positions,
+            directions, own row, enemy's row), see entities.py
+            <- list of tuples
+        rng: random bits of the situation codes <- random.Random
+        sight: for a cell, the directions (a bit each) in which a bullet
+            shot from it reaches each cell, barrels aside, shared by every
+            board <- {int: {int: int}} dict
+        codes: situation code of each bot, see policyTable() <- bytearray
+        noise: mask of the random bits of every code <- int
+        decisions: bots decided so far <- int
+        worker: thread deciding between ticks, None for none
+            <- threading.Thread
+        requests: True asks the worker for decisions, False stops it
+            <- queue.Queue
+        done: set when the worker's decisions are ready <- threading.Event
+        pending: whether decisions were requested and not yet taken <- bool
+        actions: the worker's decisions, as decide() returns them <- bytes
+    """
+    __slots__ = ("bots", "seats", "rng", "sight", "codes", "noise", \
+        "decisions", "worker", "requests", "done", "pending", "actions")
+
+    def __init__(self, seed=None):
+        """
+            seed -> int -> seed of the randomness (random if None)
+        """
+        self.bots = []
+        self.seats = []
+        self.rng = random.Random(seed)
+        self.sight = {}
+        self.codes = bytearray()
+        self.noise = 0
+        self.decisions = 0
+        self.worker = None
+        self.requests = queue.Queue()
+        self.done = threading.Event()
+        self.pending = False
+        self.actions = b""
+
+    def add(self, board, player):
+        """
+        Lets a bot play a player of a board. Call it before start().
+
+            board -> Board -> board being played
+            player -> int -> number of the player (1 or 2)
+        """
+        self.bots.append((board, player))
+        entities = board.entities
+        me, enemy = (TANK1, TANK2) if player == 1 else (TANK2, TANK1)
+        self.seats.append((board, entities.position, entities.direction, me, \
+            enemy))
+        self.codes.append(0)
+        self.noise = int.from_bytes(b"\xc0" * len(self.bots), "little")
+
+    def start(self):
+        """
+        Starts the worker thread. Call request() once the boards have been
+        stepped: the worker decides while the caller waits for the next
+        tick, and keys() returns what it decided.
+        """
+        self.worker = threading.Thread(target=self.work)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def work(self):
+        """
+        Worker thread: decides whenever asked, until asked to stop.
+        """
+        while self.requests.get():
+            self.gather()
+            self.actions = self.decide()
+            self.done.set()
+
+    def request(self):
+        """
+        Asks the worker to decide the next keys from the boards as they are
+        now. The boards mustn't change until keys() is called.
+        """
+        if self.worker is not None and not self.pending:
+            self.pending = True
+            self.requests.put(True)
+
+    def gather(self):
+        """
+        Writes every bot's situation code, without the random bits: one
+        lookup per bot in the sight of its cell. A barrel between a bot and
+        the enemy hides the enemy.
+        """
+        sight = self.sight
+        codes = self.codes
+        for i, (board, position, direction, me, enemy) in \
+                enumerate(self.seats):
+            cell = position[me]
+            seen = sight.get(cell)
+            if seen is None:
+                seen = sight[cell] = self.look(board, cell)
+            bits = seen.get(position[enemy], 0)
+            if bits:
+                bits = self.unblocked(board, cell, position[enemy], bits)
+            codes[i] = direction[me] << 4 | bits
+
+    def look(self, board, cell):
+        """
+        Returns the sight of a cell: {cell: direction bits} of every cell a
+        bullet shot from it reaches.
+
+            board -> Board -> any board of the map
+            cell -> int -> cell shot from
+        """
+        seen = {}
+        for direction in range(4):
+            for space in board.ray(cell, direction)[0]:
+                seen[space] = seen.get(space, 0) | 1 << direction
+        return seen
+
+    def unblocked(self, board, cell, enemy, bits):
+        """
+        Returns the direction bits of the bullets that reach the enemy
+        before a barrel, out of some that reach its cell.
+
+            board -> Board -> board of the bot
+            cell -> int -> bot's cell
+            enemy -> int -> enemy's cell
+            bits -> int -> directions to check
+        """
+        barrels = board.entities.places[BARREL]
+        for direction in range(4):
+            if bits >> direction & 1:
+                for space in board.ray(cell, direction)[0]:
+                    if space == enemy:
+                        break
+                    if space in barrels: # the barrel takes the bullet
+                        bits &= ~(1 << direction)
+                        break
+        return bits
+
+    def decide(self):
+        """
+        Returns the index into ACTIONS[player] chosen for every bot, as
+        bytes: the codes gather() wrote, with random bits, translated
+        through TABLE all at once.
+        """
+        count = len(self.bots)
+        self.decisions += count
+        codes = int.from_bytes(self.codes, "little") | \
+            self.rng.getrandbits(8 * count) & self.noise
+        return codes.to_bytes(count, "little").translate(TABLE)
+
+    def keys(self):
+        """
+        Yields (board, player, key) for every bot this tick (key None = no
+        key): the worker's decisions if they were requested, otherwise
+        decided now.
+        """
+        if self.pending:
+            self.done.wait()
+            self.done.clear()
+            self.pending = False
+            actions = self.actions
+        else:
+            self.gather()
+            actions = self.decide()
+        for (board, player), action in zip(self.bots, actions):
+            yield board, player, ACTIONS[player][action]
+
+    def close(self):
+        """
+        Stops the worker, if any.
+        """
+        if self.worker is not None:
+            self.requests.put(False)
+            self.worker.join()
+            self.worker = None
+
+def benchmark(filename, count, ticks, seed):
+    """
+    Returns the seconds per bot decision of a BotScheduler with count bots
+    (one per board, each board playing its bot's keys), over some ticks.
+
+        filename -> string -> map, as for Board()
+        count -> int -> number of bots
+        ticks -> int -> ticks to decide
+        seed -> int -> seed of the boards and bots
+    """
+    from tanks import Board
+    scheduler = BotScheduler(seed)
+    for n in range(count):
+        scheduler.add(Board(filename, NullRenderer(), seed + n), 1 + n % 2)
+    thinking = 0.0
+    for _ in range(ticks):
+        start = time.perf_counter()
+        moves = list(scheduler.keys())
+        thinking += time.perf_counter() - start
+        for board, player, key in moves:
+            play(board, key)
+            if board.gameOver():
+                board.newMatch()
+    return thinking / scheduler.decisions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the tanks bot.")
+    parser.add_argument("map", nargs="?", default="", \
+        help="map file or builtin letter (default map)")
+    parser.add_argument("--time", type=float, default=1.0, \
+        help="seconds of search per move (default: 1)")
+    parser.add_argument("--workers", type=int, default=0, \
+        help="worker processes (default: 0, search in this process)")
+    parser.add_argument("--moves", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--batch", type=int, default=0, metavar="N", \
+        help="benchmark BotScheduler with N bots instead")
+    args = parser.parse_args()
+
+    if args.batch:
+        for count in sorted(set((1, 10, 100, args.batch))):
+            if count <= args.batch:
+                # as many ticks for every count, so that sight is as warm
+                seconds = benchmark(args.map, count, 100, args.seed)
+                print("%5d bots: %.1f us per decision" % (count, \
+                    seconds * 1e6))
+        return
+
+    from tanks import Board
+    board = Board(args.map, NullRenderer(), args.seed)
+    bot = BotPlayer(2, args.map, None, args.seed, args.time, args.workers)
+    rng = random.Random(args.seed)
+    try:
+        for _ in range(args.moves):
+            key = bot.choose(board.snapshot())
+            print("bot plays %-4s  %.0f rollouts/s so far" % (repr(key), \
+                bot.rate()))
+            play(board, key)
+            play(board, rng.choice(ACTIONS[1]))
+    finally:
+        bot.close()
+    print(bot.report())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+"""
+file: danger.py
+description: danger maps: which cells a tank could hurt right now. Walls,
+mirrors, portals, barrels and tanks are bitboards (see bitboard.py), and a
+danger map is computed with shifts and masks over whole boards instead of
+loops over cells:
+    line of fire: cells a bullet can enter, swept along each direction with
+        occluded (Kogge-Stone) fills, log2(size) shifts per sweep. Mirrors it
+        reaches start new sweeps in the reflected direction, portals start
+        sweeps from every portal they lead to.
+    blast: the cross of length two an exploding barrel burns (walls stop
+        it), one shift per cell of reach.
+    chain: barrels in a blast explode too, blasts grow until no more
+        barrels are reached.
+    fire: cells burning now.
+Board.resetPlayers() uses safe() so that tanks don't spawn in each other's
+danger maps. Bots can use dangerMap() to stay out of danger.
+
+usage:
+    python danger.py [MAP] [--seed N]    (shows danger maps of both tanks)
+"""
+
+import argparse
+import time
+import bitboard
+
+DIRECTIONS = range(4) # N-W-S-E
+TOP_LEFT_TURNS = (3, 2, 1, 0) # direction after a "/" mirror, by direction
+TOP_RIGHT_TURNS = (1, 0, 3, 2) # after a "\\" mirror
+
+class Layers():
+    """
+    Bitboards of a board's map, which never change.
+        size: length of rows/columns <- int
+        full: every cell <- bitboard
+        walls, topLeftMirrors, topRightMirrors, portals: where they are
+            <- bitboards
+        channels: portals of each channel ("?" for unnumbered portals), a
+            portal leads to the others on its channel <- {char: bitboard}
+            dict
+        portalChannels: channel of numbered portals, the board's
+            <- {int: char} dict
+        fixed: cells bullets don't fly straight through, barrels and tanks
+            aside <- bitboard
+        chained: (barrels, chains()) last made, every reset puts the same
+            barrels back <- tuple
+    """
+    __slots__ = ("size", "full", "walls", "topLeftMirrors", \
+        "topRightMirrors", "portals", "channels", "portalChannels", "fixed", \
+        "chained")
+
+    def __init__(self, board):
+        """
+            board -> Board -> board whose map to use
+        """
+        size = self.size = board.size
+        self.full = bitboard.full(size)
+        self.walls = bitboard.fromCells(board.walls, size)
+        self.topLeftMirrors = bitboard.fromCells(board.topLeftMirrors, size)
+        self.topRightMirrors = bitboard.fromCells(board.topRightMirrors, size)
+        self.portals = bitboard.fromCells(board.portals, size)
+        self.linkChannels(board)
+        self.fixed = self.walls | self.topLeftMirrors | \
+            self.topRightMirrors | self.portals
+        self.chained = (None, None)
+
+    def linkChannels(self, board):
+        """
+        Makes the bitboard of each portal channel, one per channel rather
+        than one per portal.
+
+            board -> Board -> board whose portals to use
+        """
+        self.portalChannels = board.portalChannels
+        channels = {}
+        for portal in board.portals:
+            channels.setdefault(board.portalChannels.get(portal, "?"), \
+                []).append(portal)
+        self.channels = {channel: bitboard.fromCells(portals, self.size) \
+            for channel, portals in channels.items()}
+
+    def exits(self, portal):
+        """
+        Returns a bitboard of where a portal leads, 0 for nowhere.
+
+            portal -> int -> cell of the portal
+        """
+        channel = self.channels[self.portalChannels.get(portal, "?")]
+        return channel & ~bitboard.fewCells((portal,), self.size)
+
+    def patch(self, board, cells, portals=True):
+        """
+        Updates the bitboards after Board.patch() changed some cells.
+
+            board -> Board -> the patched board
+            cells -> collection of ints -> cells that changed
+            portals -> bool -> whether portals were among them (channels
+                are only updated then)
+        """
+        size = self.size
+        keep = ~bitboard.fewCells(cells, size)
+        self.walls = self.walls & keep | bitboard.fewCells( \
+            [cell for cell in cells if cell in board.walls], size)
+        self.topLeftMirrors = self.topLeftMirrors & keep | bitboard.fewCells( \
+            [cell for cell in cells if cell in board.topLeftMirrors], size)
+        self.topRightMirrors = self.topRightMirrors & keep | \
+            bitboard.fewCells([cell for cell in cells \
+            if cell in board.topRightMirrors], size)
+        self.portals = self.portals & keep | bitboard.fewCells( \
+            [cell for cell in cells if cell in board.portals], size)
+        if portals:
+            for channel in self.channels:
+                self.channels[channel] &= keep
+            for cell in cells:
+                if cell in board.portals:
+                    channel = board.portalChannels.get(cell, "?")
+                    self.channels[channel] = self.channels.get(channel, 0) | \
+                        bitboard.fewCells((cell,), size)
+        self.fixed = self.walls | self.topLeftMirrors | \
+            self.topRightMirrors | self.portals
+        self.chained = (None, None) # walls stop blasts
+
+def layers(board):
+    """
+    Returns the Layers of a board, made the first time they're needed.
+
+        board -> Board -> board to look at
+    """
+    if board.layers is None:
+        board.layers = Layers(board)
+    return board.layers
+
+def shift(bits, direction, size, steps=1):
+    """
+    Returns a bitboard moved some cells in a direction. Bits leave through
+    the board's edges and the empty column (mask with bitboard.full()).
+
+        bits -> int -> bitboard
+        direction -> int -> N-W-S-E = 0-1-2-3
+        size -> int -> length of rows/columns
+        steps -> int -> cells to move
+    """
+    if direction == 0:
+        return bits >> steps * (size + 1)
+    if direction == 1:
+        return bits >> steps
+    if direction == 2:
+        return bits << steps * (size + 1)
+    return bits << steps
+
+def sweep(starts, direction, empty, size):
+    """
+    Returns the cells entered moving from some cells in a direction: the
+    empty cells on the way and the first cell that isn't empty.
+
+        starts -> int -> bitboard of cells to leave from
+        direction -> int -> N-W-S-E = 0-1-2-3
+        empty -> int -> bitboard of cells to move through
+        size -> int -> length of rows/columns
+    """
+    reached = starts
+    steps = 1
+    while steps < size: # doubling: runs of 1, 2, 4... empty cells
+        reached |= empty & shift(reached, direction, size, steps)
+        empty &= shift(empty, direction, size, steps)
+        steps *= 2
+    return shift(reached, direction, size) & bitboard.full(size)
+
+def lineOfFire(board, cell, directions=DIRECTIONS, barrels=None, tanks=None):
+    """
+    Returns (cells, struck): the cells a bullet shot from a cell can enter,
+    and the barrels it can hit, as bitboards.
+
+        board -> Board -> board to look at
+        cell -> int -> cell the bullet leaves from
+        directions -> iterable of ints -> directions it may be shot in
+        barrels -> int -> bitboard of barrels (default: the live ones)
+        tanks -> int -> bitboard of cells where bullets stop on a tank
+            (default: both tanks)
+    """
+    static = layers(board)
+    size = static.size
+    if barrels is None:
+        barrels = bitboard.fromCells(board.curBarrels, size)
+    if tanks is None:
+        tanks = bitboard.fewCells((board.p1, board.p2), size)
+    empty = static.full & ~(static.fixed | barrels | tanks)
+    through = ~(barrels | tanks) # mirrors and portals under a barrel or a
+        # tank stop the bullet there (see Board.bulletHits())
+    start = bitboard.fewCells((cell,), size)
+    pending = [start if d in directions else 0 for d in DIRECTIONS]
+    done = [0] * 4
+    cells = 0
+    while any(pending):
+        starts = pending
+        pending = [0] * 4
+        for d in DIRECTIONS:
+            if not starts[d]:
+                continue
+            done[d] |= starts[d]
+            reached = sweep(starts[d], d, empty, size)
+            cells |= reached
+            reached &= through
+            pending[TOP_LEFT_TURNS[d]] |= reached & static.topLeftMirrors
+            pending[TOP_RIGHT_TURNS[d]] |= reached & static.topRightMirrors
+            for portal in bitboard.toCells(reached & static.portals, size):
+                # a portal leading nowhere lets the bullet fly on
+                pending[d] |= static.exits(portal) or \
+                    bitboard.fewCells((portal,), size)
+        pending = [bits & ~done[d] for d, bits in enumerate(pending)]
+    return cells, cells & barrels
+
+def blast(board, exploding):
+    """
+    Returns the cells the flames of some exploding barrels reach.
+
+        board -> Board -> board to look at
+        exploding -> int -> bitboard of the barrels
+    """
+    static = layers(board)
+    passable = static.full & ~static.walls
+    cells = exploding
+    for d in DIRECTIONS:
+        one = shift(exploding, d, static.size) & passable
+        cells |= one | shift(one, d, static.size) & passable
+    return cells
+
+def chain(board, exploding, barrels=None, chains=None):
+    """
+    Returns (cells, exploded): the cells burnt when some barrels explode,
+    and every barrel that explodes with them, as bitboards.
+
+        board -> Board -> board to look at
+        exploding -> int -> bitboard of the barrels set off
+        barrels -> int -> bitboard of barrels (default: the live ones)
+        chains -> list of tuples -> chains() of those barrels, to look
+            groups up rather than grow the blasts again (optional)
+    """
+    if barrels is None:
+        barrels = bitboard.fromCells(board.curBarrels, board.size)
+    if chains is not None:
+        cells = exploded = 0
+        for together, burnt in chains:
+            if exploding & together:
+                cells |= burnt
+                exploded |= together
+        exploding &= ~exploded
+        while exploding: # groups not met yet
+            burnt, together = chain(board, exploding & -exploding, barrels)
+            chains.append((together, burnt))
+            cells |= burnt
+            exploded |= together
+            exploding &= ~together
+        return cells, exploded
+    cells = exploded = 0
+    while exploding:
+        exploded |= exploding
+        cells |= blast(board, exploding)
+        exploding = cells & barrels & ~exploded
+    return cells, exploded
+
+def chains(board, barrels=None):
+    """
+    Returns the groups of barrels that set each other off met so far, as
+    (barrels, cells burnt) bitboards, for chain() to add to: whichever
+    barrel of a group explodes, all of it does (a blast reaching a barrel is
+    reached back by that barrel's). Worth it when many chains are looked up
+    on the same barrels. The last groups made are kept.
+
+        board -> Board -> board to look at
+        barrels -> int -> bitboard of barrels (default: the live ones)
+    """
+    if barrels is None:
+        barrels = bitboard.fromCells(board.curBarrels, board.size)
+    static = layers(board)
+    if static.chained[0] != barrels:
+        static.chained = (barrels, [])
+    return static.chained[1]
+
+def dangerMap(board, cell, directions=DIRECTIONS, barrels=None, tanks=None, \
+        chains=None):
+    """
+    Returns the cells a tank on a cell could hurt with its next shot, as a
+    bitboard: its line of fire, the chains of barrels it can set off, and
+    fire.
+
+        board -> Board -> board to look at
+        cell -> int -> cell of the tank
+        directions -> iterable of ints -> directions it may shoot in (all
+            four by default: a tank turns with one key)
+        barrels, tanks -> int -> as for lineOfFire()
+        chains -> list of tuples -> as for chain()
+    """
+    if barrels is None:
+        barrels = bitboard.fromCells(board.curBarrels, board.size)
+    cells, struck = lineOfFire(board, cell, directions, barrels, tanks)
+    burnt = chain(board, struck, barrels, chains)[0]
+    fire = 0
+    for layer in board.fire:
+        fire |= layer
+    return cells | burnt | fire
+
+def threat(board, p1, barrels=None, chains=None):
+    """
+    Returns the danger map of a tank on a cell with no other tank around,
+    for safe(). Another tank only shades the cells behind it, so whether it
+    is in there doesn't depend on where it is: one map does for every cell
+    tried.
+
+        board -> Board -> board to look at
+        p1 -> int -> cell of the tank
+        barrels -> int -> as for lineOfFire()
+        chains -> list of tuples -> as for chain()
+    """
+    return dangerMap(board, p1, DIRECTIONS, barrels, \
+        bitboard.fewCells((p1,), board.size), chains)
+
+def safe(board, p1, p2, barrels=None, chains=None, p1Threat=None):
+    """
+    Returns true if tanks on two cells are out of each other's danger maps.
+    When trying many cells for p2, pass the arguments made for the first
+    try to the others.
+
+        board -> Board -> board to look at
+        p1, p2 -> int -> cells of the tanks
+        barrels -> int -> as for lineOfFire()
+        chains -> list of tuples -> as for chain()
+        p1Threat -> int -> threat() of p1 (made if None)
+    """
+    size = board.size
+    if barrels is None:
+        barrels = bitboard.fromCells(board.curBarrels, size)
+    if p1Threat is None:
+        p1Threat = threat(board, p1, barrels, chains)
+    one, two = bitboard.fewCells((p1,), size), bitboard.fewCells((p2,), size)
+    return not (p1Threat & two or dangerMap(board, p2, DIRECTIONS, barrels, \
+        one | two, chains) & one)
+
+def show(board, bits):
+    """
+    Returns the board as text with danger cells as "x" (tanks, walls,
+    barrels and mirrors are drawn over them).
+
+        board -> Board -> board to draw
+        bits -> int -> bitboard of danger cells
+    """
+    danger = set(bitboard.toCells(bits, board.size))
+    rows = []
+    for r in range(board.size):
+        row = ""
+        for c in range(board.size):
+            space = r * board.size + c
+            char = board.glyph(space)[0]
+            row += "x" if char == " " and space in danger else char
+        rows.append(row)
+    return "\n".join(rows)
+
+def main():
+    from tanks import Board
+    from renderers import NullRenderer
+    parser = argparse.ArgumentParser(description="Shows danger maps.")
+    parser.add_argument("map", nargs="?", default="", \
+        help="map file or builtin letter (default map)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    board = Board(args.map, NullRenderer(), args.seed)
+    for player, cell in ((1, board.p1), (2, board.p2)):
+        start = time.perf_counter()
+        bits = dangerMap(board, cell)
+        seconds = time.perf_counter() - start
+        print("Player %d's danger map (%.2f ms):" % (player, seconds * 1000))
+        print(show(board, bits))
+        print()
+
+if __name__ == "__main__":
+    main()
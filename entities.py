@@ -0,0 +1,161 @@
+"""
+file: entities.py
+description: entity-component storage for the things that move or disappear
+on a board: tanks, barrels and bullets. Components are stored
+struct-of-arrays, one dense typed array per component with a row per live
+entity, so an entity costs a few bytes instead of a Python object and a
+system is a loop over flat arrays. Removing an entity moves the last row
+into its place: rows stay dense, and entity ids (not rows) are what stays
+the same. Board's per-tick systems (fire, see Board.burn()) go over these
+columns in one pass.
+
+components (one entry per row):
+    kind: TANK, BARREL or BULLET
+    position: cell id (see tanks.Board), NONE for nowhere
+    direction: N-W-S-E = 0-1-2-3
+    health: hits left (tanks)
+    owner: number of the player who made it, 0 for the map
+    lifetime: what's left of a limited life (a bullet's range), -1 for none
+"""
+
+from array import array
+
+TANK, BARREL, BULLET = range(3) # kinds
+TANK1, TANK2, SHOT = 0, 1, 2 # ids and rows of a board's tanks and bullet
+    # (added first and never removed, so their rows never move)
+NONE = -1 # no entity, or a position nowhere
+
+class Components():
+    """
+    Dense component arrays of a board's entities.
+        kind, position, direction, health, owner, lifetime: components, see
+            above <- arrays
+        ids: entity id of each row <- array
+        rows: row of each entity id <- dict
+        places: for indexed kinds, entity id by position (one per cell)
+            <- {kind: {int: int}} dict
+        owners: for indexed kinds, owner by position of the entities that
+            have one (few: most come with the map) <- {kind: {int: int}} dict
+        nextId: id of the next entity added <- int
+        table: every per-row array <- tuple of arrays
+    """
+    __slots__ = ("kind", "position", "direction", "health", "owner", \
+        "lifetime", "ids", "rows", "places", "owners", "nextId", "table")
+
+    def __init__(self, indexed=()):
+        """
+            indexed -> iterable of ints -> kinds to index by position (at
+                most one per cell)
+        """
+        self.kind = array("b")
+        self.position = array("i")
+        self.direction = array("b")
+        self.health = array("i")
+        self.owner = array("b")
+        self.lifetime = array("i")
+        self.ids = array("i")
+        self.rows = {}
+        self.places = {kind: {} for kind in indexed}
+        self.owners = {kind: {} for kind in indexed}
+        self.nextId = 0
+        self.table = (self.kind, self.position, self.direction, self.health, \
+            self.owner, self.lifetime, self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, kind, position, direction=0, health=0, owner=0, \
+            lifetime=-1):
+        """
+        Adds an entity. Returns its id. Arguments are its components.
+        """
+        entity = self.nextId
+        self.nextId += 1
+        self.rows[entity] = len(self.ids)
+        self.kind.append(kind)
+        self.position.append(position)
+        self.direction.append(direction)
+        self.health.append(health)
+        self.owner.append(owner)
+        self.lifetime.append(lifetime)
+        self.ids.append(entity)
+        if kind in self.places:
+            self.places[kind][position] = entity
+            if owner:
+                self.owners[kind][position] = owner
+        return entity
+
+    def remove(self, entity):
+        """
+        Removes an entity. The last row moves into its row.
+
+            entity -> int -> id of the entity
+        """
+        row = self.rows.pop(entity)
+        kind = self.kind[row]
+        if kind in self.places:
+            del self.places[kind][self.position[row]]
+            self.owners[kind].pop(self.position[row], None)
+        if row == len(self.ids) - 1:
+            for column in self.table:
+                column.pop()
+        else:
+            self.rows[self.ids[-1]] = row
+            for column in self.table:
+                column[row] = column.pop()
+
+    def extend(self, kind, positions, owner=0):
+        """
+        Adds an entity of a kind on each of some cells, with default
+        components. Faster than add() one by one.
+
+            kind -> int -> kind of the entities
+            positions -> iterable of ints -> their cells
+            owner -> int -> who made them
+        """
+        positions = array("i", positions)
+        count = len(positions)
+        first = self.nextId
+        self.nextId += count
+        self.rows.update(zip(range(first, first + count), \
+            range(len(self.ids), len(self.ids) + count)))
+        self.kind.extend(array("b", [kind]) * count)
+        self.position.extend(positions)
+        self.direction.extend(array("b", [0]) * count)
+        self.health.extend(array("i", [0]) * count)
+        self.owner.extend(array("b", [owner]) * count)
+        self.lifetime.extend(array("i", [-1]) * count)
+        self.ids.extend(array("i", range(first, first + count)))
+        if kind in self.places:
+            self.places[kind].update(zip(positions, range(first, first + \
+                count)))
+            if owner:
+                self.owners[kind].update(dict.fromkeys(positions, owner))
+
+    # systems: passes over the dense columns, rather than per-entity lookups
+
+    def within(self, cells):
+        """
+        Returns the rows of the entities on some cells, in row order.
+
+            cells -> set of ints -> cells to look at (e.g. burning ones)
+        """
+        return [row for row, position in enumerate(self.position) \
+            if position in cells]
+
+    def setOwners(self, kind, owners):
+        """
+        Sets the owners of the entities of an indexed kind: those listed get
+        theirs, the others get 0.
+
+            kind -> int -> indexed kind
+            owners -> iterable of (int, int) -> (position, owner) pairs, as
+                owners[kind].items()
+        """
+        owners = dict(owners)
+        owner, rows, places = self.owner, self.rows, self.places[kind]
+        for position in self.owners[kind].keys() - owners.keys():
+            owner[rows[places[position]]] = 0
+        for position, player in owners.items():
+            owner[rows[places[position]]] = player
+        self.owners[kind] = owners
@@ -0,0 +1,247 @@
+"""
+file: env.py
+description: vectorized reinforcement learning environment. VectorEnv steps
+many headless boards together behind a gym-style reset() / step(actions)
+API. The agent plays one tank of every board, a random opponent the other.
+
+Observations are byte planes written in place into one buffer that is
+allocated once: nothing is allocated per step. With NumPy installed, obs,
+rewards and dones are NumPy arrays viewing those buffers (no copies are
+made, so read them before the next step); without it they're memoryviews
+of the same shapes.
+
+observation planes (envs x PLANES x size x size, uint8):
+    WALLS, PORTALS      1 where there is one
+    MIRRORS             1 for "/", 2 for "\\"
+    BARRELS             1 where a barrel is
+    PLAYER1, PLAYER2    direction the tank faces + 1 (N-W-S-E = 1-2-3-4)
+    BULLETS, FLAMES     cells a bullet crossed / flames reached this step
+    FIRE                1 where it's burning
+actions (per env, int): index into ACTIONS, 0 = no key
+rewards (float32): +1 per hit on the opponent, -1 per hit taken
+dones (bool): the match ended or hit the step limit; the board has already
+    been reset to a new match, and obs shows that one
+
+usage:
+    python env.py [MAP] [--envs N] [--steps N]    (benchmark, steps/s)
+"""
+
+import argparse
+import random
+import time
+from array import array
+from netplay import BURN_TICKS
+from tanks import Board, SplitMix64, NONE
+from renderers import NullRenderer
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+WALLS, PORTALS, MIRRORS, BARRELS, PLAYER1, PLAYER2, BULLETS, FLAMES, FIRE = \
+    range(9)
+PLANES = 9
+ACTIONS = ((None, "w", "a", "s", "d", "f", "r"), \
+    (None, "o", "k", "l", ";", "'", "[")) # indexed by player - 1
+LIMIT = 1000 # steps before a match is cut short
+
+class TrailBoard(Board):
+    """
+    Board that remembers where bullets and flames went during a step.
+        bullets, flames: cells reached since the last clear <- lists of ints
+    """
+    __slots__ = ("bullets", "flames")
+
+    def __init__(self, filename, seed, lines=None):
+        """
+            filename, seed, lines -> as for Board()
+        """
+        self.bullets = []
+        self.flames = []
+        Board.__init__(self, filename, NullRenderer(), seed, lines)
+
+    def bulletHits(self, space):
+        self.bullets.append(space)
+        return Board.bulletHits(self, space)
+
+    def flameOut(self, start):
+        flames = Board.flameOut(self, start)
+        self.flames.extend(flames)
+        return flames
+
+class VectorEnv():
+    """
+    Many boards of one map, stepped together.
+        boards: one per environment <- list of TrailBoards
+        player: number of the agent's tank (1 or 2) <- int
+        limit: steps before a match is cut short <- int
+        rng: opponents' keys and new matches' seeds <- random.Random
+        cells: cells per plane <- int
+        stride: bytes of observation per environment <- int
+        buffer: every observation, see the planes above <- bytearray
+        written: per environment, buffer indexes of the dynamic planes set
+            last step, cleared before the next <- list of lists
+        steps: steps into the current match, per environment <- list of ints
+        rewardBuffer, doneBuffer: rewards and done flags <- array, bytearray
+        obs, rewards, dones: views of the buffers, returned by step()
+            <- numpy.ndarray or memoryview
+    """
+    __slots__ = ("boards", "player", "limit", "rng", "cells", "stride", \
+        "buffer", "written", "steps", "rewardBuffer", "doneBuffer", "obs", \
+        "rewards", "dones")
+
+    def __init__(self, count, filename="", seed=None, player=1, limit=LIMIT, \
+            lines=None):
+        """
+            count -> int -> number of environments
+            filename, lines -> as for Board(), the map of every environment
+            seed -> int -> seed of the boards and opponents (random if None)
+            player -> int -> tank the agent controls (1 or 2)
+            limit -> int -> steps before a match is cut short
+        """
+        self.rng = random.Random(seed)
+        self.boards = [TrailBoard(filename, self.rng.getrandbits(64), lines) \
+            for _ in range(count)]
+        self.player = player
+        self.limit = limit
+        size = self.boards[0].size
+        self.cells = size * size
+        self.stride = PLANES * self.cells
+        self.buffer = bytearray(count * self.stride)
+        self.written = [[] for _ in range(count)]
+        self.steps = [0] * count
+        self.rewardBuffer = array("f", bytes(4 * count))
+        self.doneBuffer = bytearray(count)
+
+        board = self.boards[0] # terrain is the same everywhere
+        static = bytearray(self.stride)
+        for plane, cells, value in ((WALLS, board.walls, 1), \
+                (PORTALS, board.portals, 1), (MIRRORS, board.topLeftMirrors, 1), \
+                (MIRRORS, board.topRightMirrors, 2)):
+            for cell in cells:
+                static[plane * self.cells + cell] = value
+        for i in range(count):
+            self.buffer[i * self.stride:(i + 1) * self.stride] = static
+
+        if numpy is not None:
+            self.obs = numpy.frombuffer(self.buffer, numpy.uint8).reshape( \
+                (count, PLANES, size, size))
+            self.rewards = numpy.frombuffer(self.rewardBuffer, numpy.float32)
+            self.dones = numpy.frombuffer(self.doneBuffer, numpy.bool_)
+        else:
+            self.obs = memoryview(self.buffer).cast("B", \
+                (count, PLANES, size, size))
+            self.rewards = memoryview(self.rewardBuffer)
+            self.dones = memoryview(self.doneBuffer).cast("?")
+
+    def reset(self):
+        """
+        Starts a new match on every board. Returns obs.
+        """
+        for i, board in enumerate(self.boards):
+            self.newMatch(i)
+            self.draw(i)
+        return self.obs
+
+    def step(self, actions):
+        """
+        Applies the agent's actions, then a random opponent key, on every
+        board. Returns (obs, rewards, dones), the same objects every step.
+
+            actions -> sequence of ints -> index into ACTIONS per environment
+        """
+        keys = ACTIONS[self.player - 1]
+        opponent = ACTIONS[2 - self.player]
+        rewards = self.rewardBuffer
+        dones = self.doneBuffer
+        sign = 1 if self.player == 1 else -1
+        for i, board in enumerate(self.boards):
+            del board.bullets[:]
+            del board.flames[:]
+            health = board.p1h - board.p2h
+            key = keys[actions[i]]
+            if key is not None:
+                board.turn(key)
+            key = opponent[int(self.rng.random() * len(opponent))]
+            if key is not None:
+                board.turn(key)
+            if board.burning and self.steps[i] % BURN_TICKS == BURN_TICKS - 1:
+                board.burn()
+            self.steps[i] += 1
+            rewards[i] = sign * ((board.p1h - board.p2h) - health)
+            dones[i] = board.gameOver() or self.steps[i] >= self.limit
+            if dones[i]:
+                self.newMatch(i)
+            self.draw(i)
+        return self.obs, self.rewards, self.dones
+
+    def newMatch(self, i):
+        """
+        Starts a new match on a board, with a new seed.
+
+            i -> int -> number of the environment
+        """
+        board = self.boards[i]
+        board.rng = SplitMix64(self.rng.getrandbits(64))
+        board.newMatch()
+        del board.bullets[:]
+        del board.flames[:]
+        self.steps[i] = 0
+
+    def draw(self, i):
+        """
+        Writes the dynamic planes of a board into the buffer, clearing what
+        was written there last time.
+
+            i -> int -> number of the environment
+        """
+        board = self.boards[i]
+        buffer = self.buffer
+        written = self.written[i]
+        for index in written:
+            buffer[index] = 0
+        del written[:]
+        base = i * self.stride
+        cells = self.cells
+        for plane, spaces in ((BARRELS, board.curBarrels), \
+                (BULLETS, board.bullets), (FLAMES, board.flames), \
+                (FIRE, board.burning)):
+            offset = base + plane * cells
+            for cell in spaces:
+                if cell != NONE:
+                    buffer[offset + cell] = 1
+                    written.append(offset + cell)
+        for plane, cell, direction in ((PLAYER1, board.p1, board.p1d), \
+                (PLAYER2, board.p2, board.p2d)):
+            index = base + plane * cells + cell
+            buffer[index] = direction + 1
+            written.append(index)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks VectorEnv.")
+    parser.add_argument("map", nargs="?", default="", \
+        help="map file or builtin letter (default map)")
+    parser.add_argument("--envs", type=int, default=64)
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    env = VectorEnv(args.envs, args.map, args.seed)
+    rng = random.Random(args.seed)
+    env.reset()
+    actions = [0] * args.envs
+    matches = 0
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        for i in range(args.envs):
+            actions[i] = rng.randrange(len(ACTIONS[0]))
+        obs, rewards, dones = env.step(actions)
+        matches += sum(dones)
+    seconds = time.perf_counter() - start
+    print("%d envs x %d steps: %.0f env steps/s, %d matches ended " \
+        "(observations as %s)" % (args.envs, args.steps, args.envs * \
+        args.steps / seconds, matches, "numpy arrays" if numpy else \
+        "memoryviews"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+file: fov.py
+description: line-of-sight for fog of war. A tank sees the 90 degree cone in
+front of it, computed with symmetric shadowcasting: walls and mirrors block
+sight, and a mirror shows what it reflects (cast again from the eye mirrored
+across it, through the mirror's square only). Terrain rarely changes during
+a match (only when the map is edited, see Board.patch()), so each
+(position, direction) view is computed once and cached, least recently used
+views dropped first (cones on big maps are big).
+"""
+
+from collections import OrderedDict
+
+MIRROR_DEPTH = 4 # reflections followed (mirrors seen in mirrors, ...)
+VIEW_CELLS = 1 << 19 # most cells kept in cached views, all views together
+
+def toQuadrant(quadrant, eye, depth, col):
+    """
+    Returns the board space at (depth, col) in a quadrant around eye.
+
+        quadrant -> int -> direction the quadrant faces (N-W-S-E) = (0-1-2-3)
+        eye -> (r,c) tuple -> center of the quadrant
+        depth -> int -> distance along the quadrant's direction
+        col -> int -> distance across it
+    """
+    if quadrant == 0:
+        return (eye[0] - depth, eye[1] + col)
+    elif quadrant == 1:
+        return (eye[0] + col, eye[1] - depth)
+    elif quadrant == 2:
+        return (eye[0] + depth, eye[1] + col)
+    return (eye[0] + col, eye[1] + depth)
+
+def fromQuadrant(eye, space):
+    """
+    Returns the (quadrant, depth, col) tuples of a space seen from eye: one,
+    or two if the space is on a diagonal. Inverse of toQuadrant.
+
+        eye -> (r,c) tuple -> center of the quadrants
+        space -> (r,c) tuple -> location to convert
+    """
+    dr = space[0] - eye[0]
+    dc = space[1] - eye[1]
+    result = []
+    if -dr >= abs(dc):
+        result.append((0, -dr, dc))
+    if -dc >= abs(dr):
+        result.append((1, -dc, dr))
+    if dr >= abs(dc):
+        result.append((2, dr, dc))
+    if dc >= abs(dr):
+        result.append((3, dc, dr))
+    return result
+
+class FieldOfView():
+    """
+    Cached views of a board's terrain.
+        size: length of rows/columns <- int
+        opaque: cells that block sight <- set of ints
+        mirrors: mirror cell -> is a topLeftMirror ("/") <- dict
+        cache: (position, direction) -> visible cells, least recently used
+            first <- OrderedDict of frozensets
+        cells: cells in the cached views, at most VIEW_CELLS (the last
+            view is kept even if it's bigger) <- int
+
+    Positions and results are cell ids (see tanks.Board); the geometry
+    works on (r,c) tuples.
+    """
+    __slots__ = ("size", "opaque", "mirrors", "cache", "cells")
+
+    def __init__(self, board):
+        """
+            board -> Board -> board whose terrain to look at
+        """
+        self.size = board.size
+        self.mirrors = dict.fromkeys(board.topLeftMirrors, True)
+        self.mirrors.update(dict.fromkeys(board.topRightMirrors, False))
+        self.opaque = set(board.walls) | set(self.mirrors)
+        self.cache = OrderedDict()
+        self.cells = 0
+
+    def patch(self, board, cells):
+        """
+        Updates what blocks sight after Board.patch() changed some cells,
+        and forgets every view (any of them may have looked past the cells).
+
+            board -> Board -> the patched board
+            cells -> collection of ints -> cells that changed
+        """
+        for cell in cells:
+            self.mirrors.pop(cell, None)
+            self.opaque.discard(cell)
+            if cell in board.topLeftMirrors or cell in board.topRightMirrors:
+                self.mirrors[cell] = cell in board.topLeftMirrors
+            if cell in board.walls or cell in self.mirrors:
+                self.opaque.add(cell)
+        self.cache.clear()
+        self.cells = 0
+
+    def view(self, position, direction):
+        """
+        Returns the cells a tank sees, as a frozenset of cell ids.
+
+            position -> int -> cell of the tank
+            direction -> int -> direction it faces (N-W-S-E) = (0-1-2-3)
+        """
+        key = (position, direction)
+        cache = self.cache
+        seen = cache.get(key)
+        if seen is not None:
+            cache.move_to_end(key)
+            return seen
+        found = {position}
+        self.cast(found, divmod(position, self.size), direction, 1, \
+            (-1, 1), (1, 1), MIRROR_DEPTH)
+        seen = cache[key] = frozenset(found)
+        self.cells += len(seen)
+        while self.cells > VIEW_CELLS and len(cache) > 1:
+            self.cells -= len(cache.popitem(last=False)[1])
+        return seen
+
+    def cast(self, found, eye, quadrant, depth, start, end, reflections):
+        """
+        Adds the cells visible from eye in a quadrant, between two slopes
+        (col / depth), from a row on, to found. Slopes are kept as exact
+        (numerator, denominator) tuples, denominator > 0.
+
+            found -> set -> visible cells so far
+            eye -> (r,c) tuple -> where the sight comes from
+            quadrant -> int -> direction to look (N-W-S-E) = (0-1-2-3)
+            depth -> int -> first row to scan
+            start, end -> (int, int) tuple -> slopes bounding the view
+            reflections -> int -> mirrors that may still be followed
+        """
+        rows = [(depth, start, end)]
+        while rows:
+            depth, start, end = rows.pop()
+            # columns from depth * start to depth * end, rounding ties inward
+            low = (2 * depth * start[0] + start[1]) // (2 * start[1])
+            high = -((end[1] - 2 * depth * end[0]) // (2 * end[1]))
+            wasOpaque = None
+            for col in range(low, high + 1):
+                space = toQuadrant(quadrant, eye, depth, col)
+                inside = 0 <= space[0] < self.size and 0 <= space[1] < self.size
+                cell = space[0] * self.size + space[1]
+                opaque = not inside or cell in self.opaque
+                if inside and (opaque or (depth * start[0] <= col * start[1] \
+                        and col * end[1] <= depth * end[0])):
+                    if cell not in found:
+                        found.add(cell)
+                        if reflections and cell in self.mirrors:
+                            self.mirror(found, eye, space, reflections - 1)
+                if wasOpaque and not opaque:
+                    start = (2 * col - 1, 2 * depth)
+                if wasOpaque is False and opaque:
+                    rows.append((depth + 1, start, (2 * col - 1, 2 * depth)))
+                wasOpaque = opaque
+            if wasOpaque is False:
+                rows.append((depth + 1, start, end))
+
+    def mirror(self, found, eye, space, reflections):
+        """
+        Adds the spaces seen in a mirror to found: what a second eye, at eye
+        mirrored across the mirror, sees beyond it through its square.
+
+            found -> set -> visible cells so far
+            eye -> (r,c) tuple -> where the sight comes from
+            space -> (r,c) tuple -> location of the mirror
+            reflections -> int -> further mirrors that may be followed
+        """
+        dr = eye[0] - space[0]
+        dc = eye[1] - space[1]
+        if self.mirrors[space[0] * self.size + space[1]]: # "/"
+            image = (space[0] - dc, space[1] - dr)
+        else: # "\"
+            image = (space[0] + dc, space[1] + dr)
+        for quadrant, depth, col in fromQuadrant(image, space):
+            start = (max(2 * col - 1, -2 * depth), 2 * depth)
+            end = (min(2 * col + 1, 2 * depth), 2 * depth)
+            self.cast(found, image, quadrant, depth + 1, start, end, \
+                reflections)
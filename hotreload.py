@@ -0,0 +1,260 @@
+"""
+file: hotreload.py
+description: live map editing. MapWatcher notices when a map file is saved
+(inotify on Linux, its modification time elsewhere), and MapText diffs the
+saved map against the last one read, row by row, so that only the cells that
+changed are handed to Board.patch(). A match keeps running while its map is
+edited: saving a big map costs milliseconds instead of a full reload.
+
+Changes to the lines before MAP (SIZE, MAXHEALTH, FIRE) can't be patched in;
+they need a new match.
+
+usage:
+    python tanks.py --watch    (plays, patching the map whenever it's saved)
+    python hotreload.py [--size N] [--edits N] [--portal]
+        (benchmark: patching an edited mapgen.py map vs reading it again)
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import random
+import struct
+import tempfile
+import time
+
+POLL = 0.25 # seconds between modification time checks, without inotify
+IN_CLOSE_WRITE, IN_MOVED_TO = 0x8, 0x80 # see inotify(7)
+IN_NONBLOCK = os.O_NONBLOCK
+EVENT = struct.Struct("iIII") # wd, mask, cookie, length of the name after it
+
+def inotify():
+    """
+    Returns libc if it has inotify (Linux), None otherwise.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError, TypeError):
+        return None
+    return libc
+
+class MapWatcher():
+    """
+    Tells when a file has been saved.
+        path: the file <- string
+        fd: inotify descriptor watching its directory, None when polling
+            <- int
+        stamp: (modification time, size) last seen, when polling <- tuple
+        due: perf_counter() of the next modification time check <- float
+    Editors often save by writing another file and renaming it over the
+    old one, so the directory is watched rather than the file. Only finished
+    saves count (closed after writing, or renamed in), not files still
+    being written.
+    """
+    __slots__ = ("path", "fd", "stamp", "due")
+
+    def __init__(self, path, poll=False):
+        """
+            path -> string -> file to watch
+            poll -> bool -> check the modification time even if inotify is
+                there
+        """
+        self.path = os.path.abspath(path)
+        self.fd = None
+        libc = None if poll else inotify()
+        if libc is not None:
+            fd = libc.inotify_init1(IN_NONBLOCK)
+            if fd >= 0 and libc.inotify_add_watch(fd, \
+                    os.path.dirname(self.path).encode(), \
+                    IN_CLOSE_WRITE | IN_MOVED_TO) >= 0:
+                self.fd = fd
+            elif fd >= 0:
+                os.close(fd)
+        self.stamp = self.modified()
+        self.due = 0.0
+
+    def modified(self):
+        """
+        Returns the file's (modification time, size), None if it's gone.
+        """
+        try:
+            info = os.stat(self.path)
+        except OSError:
+            return None
+        return info.st_mtime_ns, info.st_size
+
+    def changed(self):
+        """
+        Returns true if the file has been saved since the last call. Cheap
+        enough to call every frame.
+        """
+        if self.fd is not None:
+            saved = False
+            name = os.path.basename(self.path).encode()
+            while True:
+                try:
+                    events = os.read(self.fd, 4096)
+                except BlockingIOError:
+                    return saved
+                at = 0
+                while at < len(events):
+                    wd, mask, cookie, length = EVENT.unpack_from(events, at)
+                    at += EVENT.size
+                    if events[at:at + length].rstrip(b"\0") == name:
+                        saved = True
+                    at += length
+        now = time.perf_counter()
+        if now < self.due:
+            return False
+        self.due = now + POLL
+        stamp = self.modified()
+        if stamp == self.stamp or stamp is None:
+            return False
+        self.stamp = stamp
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class MapText():
+    """
+    The text of a map file as last read, to diff saves against.
+        path: the map file <- string
+        header: the lines before MAP, stripped <- list of strings
+        size: length of rows/columns <- int
+        rows: map rows, without line ends <- list of strings
+    """
+    __slots__ = ("path", "header", "size", "rows")
+
+    def __init__(self, path):
+        """
+            path -> string -> map file, read now
+        """
+        self.path = path
+        self.header, self.size, self.rows = self.read()
+
+    def read(self):
+        """
+        Returns (header, size, rows) of the file as it is now.
+        """
+        header = []
+        rows = []
+        size = 15
+        isMap = False
+        with open(self.path) as text:
+            for line in text:
+                if isMap:
+                    rows.append(line.rstrip("\r\n"))
+                elif line.split():
+                    if line.split()[0] == "MAP":
+                        isMap = True
+                    else:
+                        header.append(line.strip())
+                        if line.split()[0] == "SIZE":
+                            size = int(line.split()[1])
+        return header, size, rows
+
+    def diff(self):
+        """
+        Reads the file again. Returns the cells that changed as a
+        {cell: char} dict for Board.patch() (" " for empty), or None if the
+        lines before MAP changed (the map is then left as last read).
+        """
+        header, size, rows = self.read()
+        if header != self.header:
+            return None
+        changes = {}
+        old = self.rows
+        for r in range(min(size, max(len(old), len(rows)))):
+            before = old[r] if r < len(old) else ""
+            after = rows[r] if r < len(rows) else ""
+            if before == after:
+                continue
+            for c in range(min(size, max(len(before), len(after)))):
+                a = tile(before, c)
+                b = tile(after, c)
+                if a != b:
+                    changes[r * size + c] = b
+        self.rows = rows
+        return changes
+
+def tile(row, c):
+    """
+    Returns the map character at a column of a row as Board reads it: " "
+    for anything that isn't a tile.
+
+        row -> string -> map row
+        c -> int -> column
+    """
+    char = row[c] if c < len(row) else " "
+    return char if char in "O#?/\\S" or char.isdigit() else " "
+
+def main():
+    from tanks import Board
+    from renderers import NullRenderer
+    import mapgen
+    parser = argparse.ArgumentParser(description="Benchmarks map patching.")
+    parser.add_argument("--size", type=int, default=1024, \
+        help="length of rows/columns (default: %(default)s)")
+    parser.add_argument("--edits", type=int, default=10, \
+        help="cells changed per save (default: %(default)s)")
+    parser.add_argument("--portal", action="store_true", \
+        help="also add a portal (every path through a portal is forgotten)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    handle, path = tempfile.mkstemp(suffix=".txt")
+    os.close(handle)
+    try:
+        mapgen.write(path, mapgen.generate(args.size, args.seed))
+        start = time.perf_counter()
+        board = Board(path, NullRenderer(), args.seed)
+        loaded = time.perf_counter() - start
+        text = MapText(path)
+        watcher = MapWatcher(path)
+        board.setFog((1, 2))
+        board.visibleSpaces()
+        for _ in range(1000):
+            board.turn(rng.choice("wasdfokl;'"))
+
+        lines = open(path).read().split("\n")
+        first = lines.index("MAP") + 1
+        for _ in range(args.edits):
+            r = first + rng.randrange(args.size)
+            row = lines[r].ljust(args.size)
+            c = rng.randrange(args.size)
+            lines[r] = row[:c] + rng.choice(" #/\\O") + row[c + 1:]
+        if args.portal:
+            lines[first] = "?" + lines[first][1:]
+        with open(path, "w") as out:
+            out.write("\n".join(lines))
+        saved = watcher.changed()
+        start = time.perf_counter()
+        changes = text.diff()
+        board.patch(changes)
+        patched = time.perf_counter() - start
+        start = time.perf_counter()
+        fresh = Board(path, NullRenderer(), args.seed)
+        reloaded = time.perf_counter() - start
+        print("%dx%d map, read in %.0f ms; %d cells changed (%s): patched " \
+            "in %.2f ms, read again in %.0f ms" % (args.size, args.size, \
+            loaded * 1000, len(changes), "noticed by inotify" if \
+            watcher.fd is not None and saved else "noticed" if saved else \
+            "not noticed yet", patched * 1000, reloaded * 1000))
+        same = all(getattr(board, name) == getattr(fresh, name) for name in \
+            ("walls", "barrels", "portals", "topLeftMirrors", \
+            "topRightMirrors", "allOccupiedSpaces", "spawns"))
+        print("patched map %s the map read again" % \
+            ("matches" if same else "DIFFERS FROM"))
+        watcher.close()
+    finally:
+        os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+file: latency.py
+description: input-to-photon latency instrumentation. InputThread stamps each
+key when it arrives, LatencyProbe notes when the frame showing it is written.
+Per player, this keeps histograms of:
+    input-to-photon: key arrival -> first frame drawn after the move
+    queue wait: key arrival -> move taken off the input queue
+and counts keys dropped because the player's queue was full.
+"""
+
+import sys
+import time
+from renderers import Renderer
+
+class Histogram():
+    """
+    Log-bucketed histogram of durations with ~6% precision (4 significant
+    bits) from 1 microsecond up, in constant memory.
+    """
+    __slots__ = ("counts", "total", "worst")
+
+    def __init__(self):
+        self.counts = [0] * 8 * 40 # up to ~2^39 microseconds
+        self.total = 0
+        self.worst = 0.0
+
+    def record(self, seconds):
+        """
+            seconds -> float -> duration to add
+        """
+        us = int(seconds * 1000000)
+        if us < 16:
+            index = max(us, 0)
+        else:
+            shift = us.bit_length() - 4
+            index = shift * 8 + (us >> shift)
+        self.counts[min(index, len(self.counts) - 1)] += 1
+        self.total += 1
+        self.worst = max(self.worst, seconds)
+
+    def percentile(self, p):
+        """
+        Returns the duration (seconds) below which p percent of samples fall.
+
+            p -> float -> percentile (0-100)
+        """
+        if self.total == 0:
+            return 0.0
+        target = self.total * p / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                if index < 16:
+                    return index / 1000000
+                shift = index // 8 - 1
+                low = (index % 8 + 8) << shift
+                return min((low + (1 << shift) / 2) / 1000000, self.worst)
+        return self.worst
+
+    def summary(self):
+        """
+        Returns "p50 .. p95 .. p99 .. max .." in milliseconds.
+        """
+        return "p50 %7.2f  p95 %7.2f  p99 %7.2f  max %7.2f ms" % \
+            (self.percentile(50) * 1000, self.percentile(95) * 1000, \
+            self.percentile(99) * 1000, self.worst * 1000)
+
+class LatencyStats():
+    """
+    Latency statistics for both players.
+        photon: input-to-photon histograms <- [Histogram * 2]
+        wait: queue wait histograms <- [Histogram * 2]
+        dropped: keys dropped because the queue was full <- [int * 2]
+        waiting: (player, arrival time) of moves not drawn yet <- list
+    """
+    __slots__ = ("photon", "wait", "dropped", "waiting")
+
+    def __init__(self):
+        self.photon = [Histogram(), Histogram()]
+        self.wait = [Histogram(), Histogram()]
+        self.dropped = [0, 0]
+        self.waiting = []
+
+    def keyDropped(self, player):
+        """
+        Called by the input thread when a key doesn't fit the queue.
+
+            player -> int -> player who pressed the key (1 or 2)
+        """
+        self.dropped[player - 1] += 1
+
+    def keyTaken(self, player, arrived):
+        """
+        Called when a move is taken off the input queue to be applied.
+
+            player -> int -> player who pressed the key (1 or 2)
+            arrived -> float -> time.perf_counter() when the key arrived
+        """
+        self.wait[player - 1].record(time.perf_counter() - arrived)
+        self.waiting.append((player, arrived))
+
+    def frameWritten(self):
+        """
+        Called after a frame has been written to the terminal.
+        """
+        if self.waiting:
+            now = time.perf_counter()
+            for player, arrived in self.waiting:
+                self.photon[player - 1].record(now - arrived)
+            self.waiting = []
+
+    def report(self):
+        """
+        Returns a printable summary.
+        """
+        result = ""
+        for i in range(2):
+            result += "Player %d: %d keys, %d dropped\n" % (i + 1, \
+                self.wait[i].total, self.dropped[i])
+            result += "  input-to-photon " + self.photon[i].summary() + "\n"
+            result += "  queue wait      " + self.wait[i].summary() + "\n"
+        return result
+
+    def dump(self, path):
+        """
+        Appends a timestamped report to a file ("-" for stderr).
+
+            path -> string -> file to append to
+        """
+        text = time.strftime("--- %Y-%m-%d %H:%M:%S ---\n") + self.report()
+        if path == "-":
+            sys.stderr.write(text)
+        else:
+            with open(path, "a") as out:
+                out.write(text)
+
+class LatencyProbe(Renderer):
+    """
+    Renderer wrapper that tells LatencyStats when each frame is written.
+    """
+    __slots__ = ("renderer", "stats")
+
+    def __init__(self, renderer, stats):
+        """
+            renderer -> Renderer -> renderer to wrap
+            stats -> LatencyStats -> statistics to update
+        """
+        self.renderer = renderer
+        self.stats = stats
+
+    @property
+    def animate(self):
+        return self.renderer.animate
+
+    def start(self):
+        self.renderer.start()
+
+    def stop(self):
+        self.renderer.stop()
+
+    def draw(self, board):
+        self.renderer.draw(board)
+        self.stats.frameWritten()
+
+    def backlog(self):
+        return self.renderer.backlog()
+
+    def clock(self):
+        return self.renderer.clock()
+
+    def sleep(self, seconds):
+        self.renderer.sleep(seconds)
+
+    def title(self, text):
+        self.renderer.title(text)
+
+    def listen(self, keys):
+        self.renderer.listen(keys)
+
+    def pause(self, message):
+        self.renderer.pause(message)
@@ -0,0 +1,282 @@
+"""
+file: loadtest.py
+description: load test for server.py. For each concurrency level it starts a
+MatchServer hosting that many matches in its own process, and swarm
+processes that play two simulated clients per match over loopback UDP,
+pressing random keys of their player's keyset ("wasdfr" or "okl;'[") at a
+given rate. Each level reports:
+    tick: seconds of server work per tick (p50, p99, max) and the share of
+        ticks that took longer than netplay.TICK_TIME
+    input: key sent -> first frame that shows it applied (p50, p99)
+    frame: frame sent -> received (p50, p99)
+    keys sent, applied, dropped (the player's queue was full) and lost
+        (never reached the server)
+    memory per match
+The rows form a capacity curve; append them to a CSV file (--out) with a
+label per engine version to compare versions.
+
+usage:
+    python loadtest.py [--levels 1,10,100,500] [--rate KEYS/S] [--burst N]
+        [--duration S] [--swarms N] [--map MAP] [--label NAME] [--out FILE]
+"""
+
+import argparse
+import csv
+import heapq
+import multiprocessing
+import os
+import random
+import select
+import socket
+import time
+from collections import deque
+from netplay import TICK_TIME, P1_KEYS, P2_KEYS
+from server import MatchServer, KEY, FRAME, BUFFER, memoryKB
+
+WARMUP = 1.0 # seconds run before measuring, per level
+GRACE = 0.5 # seconds the server keeps running after the clients stop
+HELLO_TIME = 0.25 # seconds between hellos until a client's first frame
+FRAME_SAMPLE = 8 # one frame in this many is timed
+COLUMNS = ("label", "matches", "clients", "rate", "tick_p50_ms", \
+    "tick_p99_ms", "tick_max_ms", "late_ticks", "input_p50_ms", \
+    "input_p99_ms", "frame_p50_ms", "frame_p99_ms", "keys_sent", \
+    "keys_applied", "keys_dropped", "keys_lost", "kb_per_match")
+
+def percentile(values, p):
+    """
+    Returns the p-th percentile of some values (nearest rank), 0 if empty.
+
+        values -> sorted list of numbers -> values to look at
+        p -> float -> percentile (0-100)
+    """
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def serve(sock, matches, filename, seed, start, end, results):
+    """
+    Server process of a level: hosts matches from start until GRACE after
+    end, measuring ticks between start + WARMUP and end.
+
+        sock -> socket.socket -> bound UDP socket
+        matches -> int -> number of matches
+        filename, seed -> as for MatchServer()
+        start, end -> float -> time.time()s the clients start and stop
+        results -> multiprocessing.Queue -> where to put the results
+    """
+    import tanks # loaded before measuring, so that only the matches count
+    before = memoryKB()
+    server = MatchServer(sock, matches, filename, seed)
+    time.sleep(max(0.0, start - time.time()))
+    server.run(end + GRACE, (start + WARMUP, end))
+    server.close()
+    results.put(("server", {"tickTimes": server.tickTimes, \
+        "received": server.received, "applied": server.applied, \
+        "dropped": server.dropped, \
+        "kbPerMatch": (memoryKB() - before) / max(matches, 1)}))
+
+def swarm(address, clients, rate, burst, start, end, seed, results):
+    """
+    Swarm process of a level: plays some clients from start to end on one
+    socket. A client presses keys as a Poisson process, burst keys at a time.
+
+        address -> (host, port) tuple -> the server
+        clients -> list of (match, player) tuples -> clients to play
+        rate -> float -> key presses per second per client
+        burst -> int -> keys sent per press
+        start, end -> float -> time.time()s to start and stop
+        seed -> int -> seed for the keys
+        results -> multiprocessing.Queue -> where to put the results
+    """
+    rng = random.Random(seed)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, BUFFER)
+    except OSError:
+        pass # keep the system's buffer size
+    sock.setblocking(False)
+    index = {client: i for i, client in enumerate(clients)}
+    seqs = [0] * len(clients)
+    unacked = [deque() for _ in clients] # (seq, time sent) per client
+    greeted = [False] * len(clients)
+    keysets = (None, P1_KEYS, P2_KEYS)
+    events = [] # heap of (time of next press, client)
+    sent = frames = 0
+    inputLatency = []
+    frameLatency = []
+
+    time.sleep(max(0.0, start - time.time()))
+    measure = start + WARMUP
+    nextHello = time.time()
+    for i in range(len(clients)):
+        heapq.heappush(events, (start + rng.expovariate(rate), i))
+    while True:
+        now = time.time()
+        if now >= end:
+            break
+        if now >= nextHello: # until the server knows where we are
+            for i, (number, player) in enumerate(clients):
+                if not greeted[i]:
+                    sock.sendto(KEY.pack(number, player, 0, 0), address)
+            nextHello = now + HELLO_TIME
+        while events and events[0][0] <= now:
+            due, i = heapq.heappop(events)
+            number, player = clients[i]
+            for _ in range(burst):
+                seqs[i] += 1
+                key = rng.choice(keysets[player])
+                try:
+                    sock.sendto(KEY.pack(number, player, seqs[i], ord(key)), \
+                        address)
+                except OSError:
+                    pass # counts as lost
+                unacked[i].append((seqs[i], now))
+                sent += 1
+            heapq.heappush(events, (due + rng.expovariate(rate), i))
+
+        while True:
+            try:
+                packet = sock.recv(64)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                continue
+            if len(packet) < FRAME.size:
+                continue
+            number, player, tick, applied, stateHash, stamp = \
+                FRAME.unpack_from(packet)
+            i = index.get((number, player))
+            if i is None:
+                continue
+            received = time.time()
+            greeted[i] = True
+            frames += 1
+            waiting = unacked[i]
+            while waiting and waiting[0][0] <= applied:
+                seq, pressed = waiting.popleft()
+                if seq == applied and pressed >= measure:
+                    inputLatency.append(received - pressed)
+            if stamp >= measure and frames % FRAME_SAMPLE == 0:
+                frameLatency.append(received - stamp)
+
+        wake = min(events[0][0] if events else end, end, nextHello)
+        select.select([sock], [], [], max(0.0, wake - time.time()))
+    sock.close()
+    results.put(("swarm", {"sent": sent, "frames": frames, \
+        "inputLatency": inputLatency, "frameLatency": frameLatency}))
+
+def level(matches, args):
+    """
+    Runs one concurrency level and returns its row (see COLUMNS).
+
+        matches -> int -> number of matches to host
+        args -> argparse.Namespace -> options from main()
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    address = sock.getsockname()
+    start = time.time() + args.startup
+    end = start + WARMUP + args.duration
+    results = multiprocessing.Queue()
+    clients = [(number, player) for number in range(matches) \
+        for player in (1, 2)]
+    processes = [multiprocessing.Process(target=serve, args=(sock, matches, \
+        args.map, args.seed, start, end, results))]
+    swarms = min(args.swarms, len(clients))
+    for n in range(swarms):
+        processes.append(multiprocessing.Process(target=swarm, args=(address, \
+            clients[n::swarms], args.rate, args.burst, start, end, \
+            args.seed * 1000 + n, results)))
+    for process in processes:
+        process.start()
+    sock.close() # the server process has its own copy
+
+    server = None
+    sent = frames = 0
+    inputLatency = []
+    frameLatency = []
+    for _ in processes:
+        kind, result = results.get()
+        if kind == "server":
+            server = result
+        else:
+            sent += result["sent"]
+            frames += result["frames"]
+            inputLatency += result["inputLatency"]
+            frameLatency += result["frameLatency"]
+    for process in processes:
+        process.join()
+
+    ticks = sorted(server["tickTimes"])
+    inputLatency.sort()
+    frameLatency.sort()
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {"label": args.label, "matches": matches, "clients": len(clients), \
+        "rate": args.rate * args.burst, \
+        "tick_p50_ms": ms(percentile(ticks, 50)), \
+        "tick_p99_ms": ms(percentile(ticks, 99)), \
+        "tick_max_ms": ms(ticks[-1] if ticks else 0), \
+        "late_ticks": round(sum(1 for t in ticks if t > TICK_TIME) / \
+            max(len(ticks), 1), 4), \
+        "input_p50_ms": ms(percentile(inputLatency, 50)), \
+        "input_p99_ms": ms(percentile(inputLatency, 99)), \
+        "frame_p50_ms": ms(percentile(frameLatency, 50)), \
+        "frame_p99_ms": ms(percentile(frameLatency, 99)), \
+        "keys_sent": sent, "keys_applied": server["applied"], \
+        "keys_dropped": server["dropped"], \
+        "keys_lost": max(0, sent - server["received"]), \
+        "kb_per_match": round(server["kbPerMatch"], 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Load tests server.py.")
+    parser.add_argument("--levels", default="1,10,100,250,500,1000", \
+        help="comma-separated numbers of matches (default: %(default)s)")
+    parser.add_argument("--rate", type=float, default=4.0, \
+        help="key presses per second per client (default: 4)")
+    parser.add_argument("--burst", type=int, default=1, \
+        help="keys sent per press (default: 1)")
+    parser.add_argument("--duration", type=float, default=5.0, \
+        help="seconds measured per level (default: 5)")
+    parser.add_argument("--startup", type=float, default=1.0, \
+        help="seconds allowed to start the processes (default: 1)")
+    parser.add_argument("--swarms", type=int, \
+        default=max(1, (os.cpu_count() or 2) - 1), \
+        help="client processes (default: one per spare CPU)")
+    parser.add_argument("--map", default="", help="map (default map)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", default="", \
+        help="name of this run in the output, e.g. an engine version")
+    parser.add_argument("--out", metavar="FILE", \
+        help="append the rows to a CSV file")
+    args = parser.parse_args()
+
+    print("%8s %8s %28s %8s %20s %20s %24s %8s" % ("matches", "clients", \
+        "tick ms p50/p99/max", "late", "input ms p50/p99", \
+        "frame ms p50/p99", "keys sent/drop/lost", "KB/match"))
+    rows = []
+    for matches in (int(n) for n in args.levels.split(",")):
+        row = level(matches, args)
+        rows.append(row)
+        print("%8d %8d %28s %7.1f%% %20s %20s %24s %8.1f" % (row["matches"], \
+            row["clients"], "%.2f/%.2f/%.2f" % (row["tick_p50_ms"], \
+            row["tick_p99_ms"], row["tick_max_ms"]), row["late_ticks"] * 100, \
+            "%.2f/%.2f" % (row["input_p50_ms"], row["input_p99_ms"]), \
+            "%.2f/%.2f" % (row["frame_p50_ms"], row["frame_p99_ms"]), \
+            "%d/%d/%d" % (row["keys_sent"], row["keys_dropped"], \
+            row["keys_lost"]), row["kb_per_match"]))
+
+    capacity = [row["matches"] for row in rows \
+        if row["tick_p99_ms"] <= TICK_TIME * 1000]
+    print("Capacity: %s matches with p99 tick under %.1f ms" % \
+        (max(capacity) if capacity else "under " + str(rows[0]["matches"]), \
+        TICK_TIME * 1000))
+    if args.out:
+        new = not os.path.exists(args.out) or os.path.getsize(args.out) == 0
+        with open(args.out, "a", newline="") as out:
+            writer = csv.DictWriter(out, COLUMNS)
+            if new:
+                writer.writeheader()
+            writer.writerows(rows)
+
+if __name__ == "__main__":
+    main()
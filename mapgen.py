@@ -0,0 +1,193 @@
+"""
+file: mapgen.py
+description: seeded procedural map generator. Same seed and parameters give
+the same map. The grid is built with whole-array byte operations (random
+bytes translated into tiles, corridors cleared with slice assignment) and
+spawn connectivity is checked with a bitboard flood fill, so even maps of a
+few thousand cells per side generate quickly.
+
+usage: python mapgen.py SIZE [--seed N] [--walls D] [--clusters N]
+           [--mirrors N] [--portals N] [--spawns N] [--health N] [-o FILE]
+"""
+
+import argparse
+import random
+import sys
+import time
+
+CLEAR_WALLS = bytes.maketrans(b"#", b" ")
+OPEN_BITS = bytes.maketrans(b"# O?/\\S", b"0111111") # for reachability
+
+def wallTable(density):
+    """
+    Returns a translation table that turns random bytes into walls ("#")
+    with the given probability and empty space otherwise.
+
+        density -> float -> chance that a cell is a wall (0-1)
+    """
+    cutoff = int(density * 256)
+    return bytes(35 if value < cutoff else 32 for value in range(256))
+
+def reachable(grid, size, start):
+    """
+    Returns the cells reachable from start as a bitboard (bit r*(size+1)+c).
+    Walls block movement; entering a portal reaches every portal.
+    Each step fills whole open runs to the east at once with a carry
+    (adding the frontier to the open mask ripples through each run), then
+    spreads one cell west, north and south.
+
+        grid -> bytearray -> map tiles, row by row
+        size -> int -> length of rows/columns
+        start -> int -> index of the starting cell in grid
+    """
+    width = size + 1 # extra blocked column stops carries between rows
+    rows = b"0".join(bytes(grid[r * size:(r + 1) * size]).translate(OPEN_BITS) \
+        for r in range(size)) + b"0"
+    passable = int(rows[::-1], 2) # reversed so that bit 0 is cell (0,0)
+    portals = portalBits(grid, size)
+
+    start = (start // size) * width + start % size
+    filled = 1 << start
+    while True:
+        east = ((passable + filled) ^ passable) & passable | filled
+        grown = (east | (east >> 1) | (east << width) | (east >> width)) & passable
+        if grown & portals:
+            grown |= portals
+        if grown == filled:
+            return filled
+        filled = grown
+
+def portalBits(grid, size):
+    """
+    Returns the portals of a grid as a bitboard (bit r*(size+1)+c).
+
+        grid -> bytearray -> map tiles, row by row
+        size -> int -> length of rows/columns
+    """
+    bits = 0
+    width = size + 1
+    index = grid.find(b"?")
+    while index != -1:
+        bits |= 1 << (index // size * width + index % size)
+        index = grid.find(b"?", index + 1)
+    return bits
+
+def carve(grid, size, start, end):
+    """
+    Clears walls along an L-shaped corridor between two cells: along the
+    start row to the end column, then along that column to the end.
+
+        grid -> bytearray -> map tiles, row by row
+        size -> int -> length of rows/columns
+        start, end -> int -> indexes of the cells in grid
+    """
+    r1, c1 = divmod(start, size)
+    r2, c2 = divmod(end, size)
+    low, high = min(c1, c2), max(c1, c2)
+    row = slice(r1 * size + low, r1 * size + high + 1)
+    grid[row] = grid[row].translate(CLEAR_WALLS)
+    low, high = min(r1, r2), max(r1, r2)
+    column = slice(low * size + c2, high * size + c2 + 1, size)
+    grid[column] = grid[column].translate(CLEAR_WALLS)
+
+def generate(size, seed=None, walls=0.25, clusters=None, mirrors=None, \
+        portals=None, spawns=4, maxHealth=10):
+    """
+    Generates a map. Returns it as a list of lines in the map file format.
+    Counts left as None scale with the area of the map.
+
+        size -> int -> length of rows/columns
+        seed -> int -> RNG seed
+        walls -> float -> wall density (0-1)
+        clusters -> int -> number of barrel clusters (of up to 5 barrels)
+        mirrors -> int -> number of mirrors
+        portals -> int -> number of portals
+        spawns -> int -> number of spawn points (at least 2)
+        maxHealth -> int -> health players start with
+    """
+    area = size * size
+    if clusters is None:
+        clusters = max(1, area // 150)
+    if mirrors is None:
+        mirrors = max(2, area // 100)
+    if portals is None:
+        portals = max(2, area // 400)
+    spawns = max(2, spawns)
+    if mirrors + portals + spawns > area:
+        raise ValueError("map too small for that many features")
+
+    rng = random.Random(seed)
+    grid = bytearray(rng.randbytes(area).translate(wallTable(walls)))
+
+    for center in rng.sample(range(area), min(clusters, area)):
+        r, c = divmod(center, size)
+        for _ in range(rng.randint(1, 5)):
+            br = r + rng.randint(-1, 1)
+            bc = c + rng.randint(-1, 1)
+            if 0 <= br < size and 0 <= bc < size:
+                grid[br * size + bc] = ord("O")
+
+    cells = rng.sample(range(area), mirrors + portals + spawns)
+    for cell in cells[:mirrors]:
+        grid[cell] = ord(rng.choice("/\\"))
+    for cell in cells[mirrors:mirrors + portals]:
+        grid[cell] = ord("?")
+    spawnCells = cells[mirrors + portals:]
+    for cell in spawnCells:
+        grid[cell] = ord("S")
+
+    region = reachable(grid, size, spawnCells[0])
+    for cell in spawnCells[1:]:
+        if not region >> (cell // size * (size + 1) + cell % size) & 1:
+            carve(grid, size, cell, spawnCells[0])
+
+    lines = ["SIZE " + str(size), "MAXHEALTH " + str(maxHealth), "MAP"]
+    text = grid.decode("latin-1")
+    lines.extend(text[r * size:(r + 1) * size] for r in range(size))
+    return lines
+
+def generateBoard(size, seed=None, renderer=None, **options):
+    """
+    Generates a map straight into a Board, without a map file.
+    Arguments are as for generate(); seed also seeds the board's RNG.
+    """
+    from tanks import Board
+    return Board("generated", renderer, seed, generate(size, seed, **options))
+
+def write(path, lines):
+    """
+    Writes a generated map to a file.
+
+        path -> string -> map file to write
+        lines -> list of strings -> map from generate()
+    """
+    with open(path, "w") as out:
+        out.write("\n".join(lines) + "\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates a tanks map.")
+    parser.add_argument("size", type=int, help="length of rows/columns")
+    parser.add_argument("--seed", type=int, help="RNG seed (default: random)")
+    parser.add_argument("--walls", type=float, default=0.25, \
+        help="wall density, 0-1 (default: 0.25)")
+    parser.add_argument("--clusters", type=int, help="barrel clusters")
+    parser.add_argument("--mirrors", type=int, help="mirrors")
+    parser.add_argument("--portals", type=int, help="portals")
+    parser.add_argument("--spawns", type=int, default=4, help="spawn points")
+    parser.add_argument("--health", type=int, default=10, help="max health")
+    parser.add_argument("-o", "--output", help="map file (default: stdout)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    lines = generate(args.size, args.seed, args.walls, args.clusters, \
+        args.mirrors, args.portals, args.spawns, args.health)
+    elapsed = time.perf_counter() - start
+    if args.output:
+        write(args.output, lines)
+        print("Generated %s (%dx%d) in %.3f s" % (args.output, args.size, \
+            args.size, elapsed))
+    else:
+        sys.stdout.write("\n".join(lines) + "\n")
+
+if __name__ == "__main__":
+    main()
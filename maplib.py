@@ -0,0 +1,170 @@
+"""
+file: maplib.py
+description: map library for the splash menu. Scans a maps directory and
+keeps a persistent index (.mapindex.json) of each map's name, size, max
+health, feature counts and content hash. Only files whose modification time
+or length changed since the last scan are read again, and full map bodies
+are only parsed (by Board) once a map is chosen.
+
+usage: python maplib.py [DIR]    (prints the index)
+"""
+
+import hashlib
+import json
+import os
+import sys
+
+INDEX_FILE = ".mapindex.json"
+INDEX_VERSION = 2
+
+def summarize(text):
+    """
+    Returns the index entry fields of a map file's text, or None if the
+    text isn't a map (has no MAP line).
+
+        text -> string -> contents of the file
+    """
+    lines = text.split("\n")
+    size = 15 # same defaults as Board
+    maxHealth = 10
+    for i, line in enumerate(lines):
+        words = line.split()
+        if len(words) == 0:
+            continue
+        if words == ["MAP"]:
+            break
+        elif words[0] == "SIZE" and len(words) > 1 and words[1].isdigit():
+            size = int(words[1])
+        elif words[0] == "MAXHEALTH" and len(words) > 1 and words[1].isdigit():
+            maxHealth = int(words[1])
+    else:
+        return None
+
+    body = "\n".join(lines[i + 1:])
+    return {"size": size, "maxHealth": maxHealth, "spawns": body.count("S"), \
+        "portals": sum(body.count(c) for c in "?0123456789"), \
+        "barrels": body.count("O"), \
+        "mirrors": body.count("/") + body.count("\\")}
+
+class MapLibrary():
+    """
+    Index of the maps in a directory.
+        directory: where the maps live <- string
+        entries: file name -> index entry <- dict of dicts
+            (entries of files that aren't maps have "map": False, so they
+            aren't read again either)
+    """
+    __slots__ = ("directory", "entries")
+
+    def __init__(self, directory):
+        """
+            directory -> string -> directory to scan
+        """
+        self.directory = directory
+        self.entries = {}
+        try:
+            with open(os.path.join(directory, INDEX_FILE)) as index:
+                saved = json.load(index)
+            if saved.get("version") == INDEX_VERSION:
+                self.entries = saved["entries"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass # missing or damaged index, rebuild it
+        self.refresh()
+
+    def refresh(self):
+        """
+        Brings the index up to date with the directory, reading only new or
+        changed files. Returns the number of entries that changed.
+        """
+        changed = 0
+        seen = set()
+        try:
+            files = [entry for entry in os.scandir(self.directory) \
+                if entry.name.endswith(".txt") and entry.is_file()]
+        except OSError:
+            files = []
+        for entry in files:
+            seen.add(entry.name)
+            stat = entry.stat()
+            old = self.entries.get(entry.name)
+            if old and old["mtime"] == stat.st_mtime_ns and \
+                    old["bytes"] == stat.st_size:
+                continue
+            with open(entry.path, "rb") as f:
+                data = f.read()
+            new = {"mtime": stat.st_mtime_ns, "bytes": stat.st_size}
+            fields = summarize(data.decode("utf-8", "replace"))
+            if fields is None:
+                new["map"] = False
+            else:
+                new["map"] = True
+                new["name"] = entry.name[:-len(".txt")]
+                new["hash"] = hashlib.sha1(data).hexdigest()
+                new.update(fields)
+            self.entries[entry.name] = new
+            changed += 1
+
+        for name in list(self.entries):
+            if name not in seen:
+                del self.entries[name]
+                changed += 1
+        if changed:
+            self.save()
+        return changed
+
+    def save(self):
+        """
+        Writes the index next to the maps (skipped if the directory is
+        read-only).
+        """
+        path = os.path.join(self.directory, INDEX_FILE)
+        try:
+            with open(path + ".tmp", "w") as index:
+                json.dump({"version": INDEX_VERSION, "entries": self.entries}, \
+                    index, sort_keys=True)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+    def maps(self):
+        """
+        Returns (file name, entry) tuples of every map, sorted by name.
+        """
+        return sorted((name, entry) for name, entry in self.entries.items() \
+            if entry["map"])
+
+    def path(self, filename):
+        """
+        Returns the path of a map in the library.
+
+            filename -> string -> file name of the map
+        """
+        return os.path.join(self.directory, filename)
+
+    def find(self, filename):
+        """
+        Returns the index entry of a map file, or None if it isn't indexed.
+
+            filename -> string -> path or file name of the map
+        """
+        if os.path.dirname(os.path.abspath(filename)) != \
+                os.path.abspath(self.directory):
+            return None
+        entry = self.entries.get(os.path.basename(filename))
+        return entry if entry and entry["map"] else None
+
+def describe(entry):
+    """
+    Returns a one-line description of a map for menus.
+
+        entry -> dict -> index entry
+    """
+    return "%s (%dx%d, %d health, %d spawns, %d portals, %d barrels)" % \
+        (entry["name"], entry["size"], entry["size"], entry["maxHealth"], \
+        entry["spawns"], entry["portals"], entry["barrels"])
+
+if __name__ == "__main__":
+    library = MapLibrary(sys.argv[1] if len(sys.argv) > 1 else \
+        os.path.dirname(os.path.abspath(__file__)))
+    for number, (name, entry) in enumerate(library.maps(), 1):
+        print("%3d: %s  %s" % (number, describe(entry), entry["hash"][:12]))
@@ -0,0 +1,489 @@
+"""
+file: netplay.py
+description: rollback netcode for playing tanks over a network.
+
+Both peers simulate the same board from the same map and seed. The game runs
+in fixed ticks; on each tick a player presses at most one key, and keys are
+applied player 1 first. Local keys take effect immediately. The remote key
+for a tick is predicted to be "nothing" until it arrives; if the prediction
+was wrong, the board is restored to the snapshot taken before that tick and
+re-simulated up to the present. Peers exchange the board's Zobrist hash for
+every confirmed tick, so a desync is detected right away.
+
+usage:
+    python netplay.py --host PORT [--map MAP]    (plays player 1)
+    python netplay.py --join HOST:PORT           (plays player 2)
+    python netplay.py --loopback [--latency MS] [--jitter MS] [--loss P]
+        runs two peers in one process with random keys on a simulated
+        link and reports rollback statistics
+"""
+
+import argparse
+import heapq
+import random
+import socket
+import struct
+import time
+from collections import deque
+from itertools import islice
+from renderers import NullRenderer
+
+TICK_TIME = 1 / 30 # seconds per tick
+MAX_ROLLBACK = 12 # ticks of history kept (how far ahead of the remote we run)
+CHECK_INTERVAL = 1 # ticks between hash exchanges
+SUMS_KEPT = 64 # unmatched hashes kept per side (older ones were lost)
+BURN_TICKS = 8 # ticks between fire updates (tanks.FIRE_TICK / TICK_TIME)
+INPUT, SUM = 1, 2 # packet types
+HEADER = struct.Struct("!BII") # type, tick, ack
+SUM_BODY = struct.Struct("!Q") # board hash, after a SUM header
+P1_KEYS = "wasdfr"
+P2_KEYS = "okl;'["
+
+class DesyncError(Exception):
+    """
+    Raised when the peers' boards no longer match.
+    """
+    pass
+
+class RollbackSession():
+    """
+    One peer of a networked match.
+        board: board being simulated, always headless <- Board
+        player: number of the local player <- int (1 or 2)
+        link: transport to the remote peer <- LoopbackLink or UdpLink
+        tick: next tick to simulate <- int
+        remoteTick: first tick whose remote key hasn't arrived <- int
+        history: [tick, snapshot before tick, p1 key, p2 key] for the last
+            maxRollback + 1 ticks <- deque of lists
+        pending: local keys the remote hasn't acknowledged <- deque
+        pendingStart: tick of pending[0] <- int
+        early: remote keys for ticks not simulated yet <- {tick: key} dict
+        localSums, remoteSums: board hashes waiting to be compared <- dicts
+        checkTick: next tick to hash <- int
+
+        rollbacks, resimulated, stalls: counters for tuning <- int
+        worstRollback: longest re-simulation, in seconds <- float
+    """
+    __slots__ = ("board", "player", "link", "maxRollback", "tick", "remoteTick", \
+        "history", "pending", "pendingStart", "early", "localSums", "remoteSums", \
+        "checkTick", "rollbacks", "resimulated", "stalls", "worstRollback")
+
+    def __init__(self, board, player, link, maxRollback=MAX_ROLLBACK):
+        """
+            board -> Board -> freshly loaded board, same map and seed as remote
+            player -> int -> number of the local player (1 or 2)
+            link -> LoopbackLink or UdpLink -> transport to the remote peer
+            maxRollback -> int -> ticks of history to keep
+        """
+        board.renderer = NullRenderer() # draw board yourself after advance()
+        self.board = board
+        self.player = player
+        self.link = link
+        self.maxRollback = maxRollback
+        self.tick = 0
+        self.remoteTick = 0
+        self.history = deque()
+        self.pending = deque()
+        self.pendingStart = 0
+        self.early = {}
+        self.localSums = {}
+        self.remoteSums = {}
+        self.checkTick = CHECK_INTERVAL
+        self.rollbacks = 0
+        self.resimulated = 0
+        self.stalls = 0
+        self.worstRollback = 0.0
+
+    def advance(self, key):
+        """
+        Simulates the next tick with the local player's key. Returns False
+        (and does nothing) if we're too far ahead of the remote; keep the
+        key and try again next tick.
+
+            key -> string of length 1 -> local player's key, or None
+        """
+        self.poll()
+        if self.tick - self.remoteTick >= self.maxRollback:
+            self.stalls += 1
+            self.send()
+            return False
+
+        entry = [self.tick, self.board.snapshot(), None, None]
+        entry[1 + self.player] = key
+        entry[4 - self.player] = self.early.pop(self.tick, None) #or predict
+        self.history.append(entry)
+        if len(self.history) > self.maxRollback + 1:
+            self.history.popleft()
+        self.step(entry)
+        self.tick += 1
+
+        self.pending.append(key)
+        self.check()
+        self.send()
+        return True
+
+    def step(self, entry):
+        """
+        Applies one tick of keys to the board. Fire burns on every
+        BURN_TICKS-th tick.
+
+            entry -> list -> history entry of the tick
+        """
+        if entry[2]:
+            self.board.turn(entry[2])
+        if entry[3]:
+            self.board.turn(entry[3])
+        if self.board.burning and entry[0] % BURN_TICKS == BURN_TICKS - 1:
+            self.board.burn()
+
+    def poll(self):
+        """
+        Handles every packet that has arrived from the remote.
+        """
+        for packet in self.link.recv():
+            if len(packet) < HEADER.size:
+                continue
+            kind, tick, ack = HEADER.unpack_from(packet)
+            if kind == INPUT:
+                while self.pendingStart < ack and self.pending:
+                    self.pending.popleft()
+                    self.pendingStart += 1
+                self.receive(tick, packet[HEADER.size:])
+            elif kind == SUM and len(packet) >= HEADER.size + SUM_BODY.size:
+                self.remoteSums[tick] = SUM_BODY.unpack_from(packet, \
+                    HEADER.size)[0]
+                self.compare(tick)
+        self.check()
+
+    def receive(self, start, keys):
+        """
+        Takes in remote keys, rolling back if a prediction was wrong.
+
+            start -> int -> tick of the first key
+            keys -> bytes -> one key per tick (0 = no key)
+        """
+        rollback = None
+        remote = 4 - self.player
+        for t in range(max(start, self.remoteTick), start + len(keys)):
+            if t != self.remoteTick:
+                break # gap, wait for the resend
+            key = chr(keys[t - start]) if keys[t - start] else None
+            if t < self.tick:
+                entry = self.history[t - self.history[0][0]]
+                if entry[remote] != key:
+                    entry[remote] = key
+                    if rollback is None:
+                        rollback = t
+            else:
+                self.early[t] = key
+            self.remoteTick += 1
+
+        if rollback is not None:
+            self.resimulate(rollback)
+
+    def resimulate(self, tick):
+        """
+        Restores the board to the start of a tick and replays up to now.
+
+            tick -> int -> first tick with a corrected key
+        """
+        start = time.perf_counter()
+        first = tick - self.history[0][0]
+        self.board.restore(self.history[first][1])
+        for entry in islice(self.history, first, None):
+            entry[1] = self.board.snapshot()
+            self.step(entry)
+        self.rollbacks += 1
+        self.resimulated += self.tick - tick
+        self.worstRollback = max(self.worstRollback, time.perf_counter() - start)
+
+    def check(self):
+        """
+        Hashes the state at every CHECK_INTERVAL-th tick once all keys
+        before it are confirmed, and sends the hash to the remote.
+        """
+        while self.checkTick <= min(self.tick, self.remoteTick):
+            if self.checkTick == self.tick:
+                stateHash = self.board.hash()
+            else:
+                stateHash = self.board.snapshotHash( \
+                    self.history[self.checkTick - self.history[0][0]][1])
+            self.localSums[self.checkTick] = stateHash
+            self.link.send(HEADER.pack(SUM, self.checkTick, 0) + \
+                SUM_BODY.pack(stateHash))
+            self.compare(self.checkTick)
+            self.checkTick += CHECK_INTERVAL
+
+    def compare(self, tick):
+        """
+        Compares local and remote hashes of a tick once both are known.
+
+            tick -> int -> tick to compare
+        """
+        if tick in self.localSums and tick in self.remoteSums:
+            if self.localSums.pop(tick) != self.remoteSums.pop(tick):
+                raise DesyncError("boards differ at tick " + str(tick))
+        for sums in (self.localSums, self.remoteSums): # lost packets
+            while len(sums) > SUMS_KEPT:
+                del sums[min(sums)]
+
+    def send(self):
+        """
+        Sends every unacknowledged local key and acknowledges remote keys.
+        """
+        keys = bytes(ord(key) if key else 0 for key in self.pending)
+        self.link.send(HEADER.pack(INPUT, self.pendingStart, self.remoteTick) \
+            + keys)
+
+class LoopbackLink():
+    """
+    One end of an in-memory link. Packets are delivered after latency plus
+    or minus jitter (so they can arrive out of order), and some are lost.
+    """
+    __slots__ = ("peer", "queue", "latency", "jitter", "loss", "rng", "clock", \
+        "sent")
+
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0, seed=None, \
+            clock=time.perf_counter):
+        """
+            latency -> float -> one-way delay in seconds
+            jitter -> float -> maximum random change to the delay, in seconds
+            loss -> float -> chance that a packet is dropped (0-1)
+            seed -> int -> seed for jitter and loss
+            clock -> function -> returns the current time in seconds
+        """
+        self.peer = None
+        self.queue = [] # heap of (delivery time, order, packet)
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.clock = clock
+        self.sent = 0
+
+    def send(self, packet):
+        self.sent += 1
+        if self.rng.random() < self.loss:
+            return
+        delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, \
+            self.jitter))
+        heapq.heappush(self.peer.queue, (self.clock() + delay, self.sent, packet))
+
+    def recv(self):
+        now = self.clock()
+        packets = []
+        while self.queue and self.queue[0][0] <= now:
+            packets.append(heapq.heappop(self.queue)[2])
+        return packets
+
+def loopbackPair(latency=0.0, jitter=0.0, loss=0.0, seed=None, \
+        clock=time.perf_counter):
+    """
+    Returns two connected LoopbackLinks. Arguments are as for LoopbackLink.
+    """
+    a = LoopbackLink(latency, jitter, loss, seed, clock)
+    b = LoopbackLink(latency, jitter, loss, None if seed is None else seed + 1, \
+        clock)
+    a.peer = b
+    b.peer = a
+    return a, b
+
+class UdpLink():
+    """
+    Non-blocking UDP transport to one remote address.
+    """
+    __slots__ = ("sock", "address", "greeting")
+
+    def __init__(self, sock, address, greeting=None):
+        """
+            sock -> socket.socket -> bound UDP socket
+            address -> (host, port) tuple -> remote peer
+            greeting -> bytes -> reply to late HELLOs (host only)
+        """
+        sock.setblocking(False)
+        self.sock = sock
+        self.address = address
+        self.greeting = greeting
+
+    def send(self, packet):
+        try:
+            self.sock.sendto(packet, self.address)
+        except OSError:
+            pass # dropped, the next packet resends everything
+
+    def recv(self):
+        packets = []
+        while True:
+            try:
+                packet, address = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return packets
+            except OSError:
+                continue # e.g. ICMP port unreachable before the peer is up
+            if packet == b"HELLO":
+                if self.greeting:
+                    self.send(self.greeting)
+            elif address == self.address:
+                packets.append(packet)
+
+def host(port, filename):
+    """
+    Waits for a player to join. Returns a session for player 1.
+
+        port -> int -> UDP port to listen on
+        filename -> string -> map to play
+    """
+    from tanks import Board
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("", port))
+    print("Waiting for player 2 on port " + str(port) + "...")
+    while True:
+        packet, address = sock.recvfrom(2048)
+        if packet == b"HELLO":
+            break
+    seed = random.randrange(2 ** 32)
+    greeting = ("START " + str(seed) + " " + filename).encode()
+    link = UdpLink(sock, address, greeting)
+    link.send(greeting)
+    return RollbackSession(Board(filename, None, seed), 1, link)
+
+def join(address):
+    """
+    Joins a hosted match. Returns a session for player 2.
+
+        address -> (host, port) tuple -> where the match is hosted
+    """
+    from tanks import Board
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(0.5)
+    while True:
+        sock.sendto(b"HELLO", address)
+        try:
+            packet, sender = sock.recvfrom(2048)
+        except socket.timeout:
+            continue
+        if packet.startswith(b"START "):
+            break
+    seed, filename = (packet.decode()[len("START "):].split(" ", 1) + [""])[:2]
+    return RollbackSession(Board(filename, None, int(seed)), 2, \
+        UdpLink(sock, address))
+
+def play(session, renderer, fog=False):
+    """
+    Runs a networked match at TICK_TIME per tick until someone wins.
+
+        session -> RollbackSession -> local peer
+        renderer -> Renderer -> started renderer to draw with
+        fog -> bool -> only draw what the local tank can see
+    """
+    from tanks import InputThread
+    charGetter = InputThread()
+    charGetter.daemon = True
+    charGetter.start()
+    charGetter.turn = False
+    renderer.listen(charGetter)
+    keys = P1_KEYS if session.player == 1 else P2_KEYS
+    if fog:
+        session.board.setFog((session.player,))
+
+    held = None # key that couldn't be sent while stalled
+    nextTick = time.perf_counter()
+    while not session.board.gameOver():
+        move = held if held else charGetter.getMove()
+        if move is not None: # either keyset controls the local tank
+            move = keys[(P1_KEYS + P2_KEYS).index(move) % len(keys)]
+        held = None if session.advance(move) else move
+        renderer.draw(session.board)
+
+        nextTick += TICK_TIME
+        time.sleep(max(0.0, nextTick - time.perf_counter()))
+
+    for _ in range(int(0.5 / TICK_TIME)): # let the last keys reach the remote
+        session.advance(None)
+        time.sleep(TICK_TIME)
+    renderer.draw(session.board)
+    winner = session.board.winner()
+    renderer.pause("\n" + ("Nobody wins!" if winner == 0 else \
+        "Player " + str(winner) + " wins!") + "\n\nEnter to close...")
+
+def loopback(latency, jitter, loss, ticks, seed):
+    """
+    Plays two peers against each other over a LoopbackLink on a simulated
+    clock, pressing random keys, and prints how rollback behaved.
+
+        latency, jitter -> float -> link delay and its variation, in seconds
+        loss -> float -> chance that a packet is dropped (0-1)
+        ticks -> int -> ticks to play
+        seed -> int -> seed for the keys, the link and the board
+    """
+    from tanks import Board
+    now = [0.0]
+    a, b = loopbackPair(latency, jitter, loss, seed, lambda: now[0])
+    peers = (RollbackSession(Board("", None, seed), 1, a), \
+        RollbackSession(Board("", None, seed), 2, b))
+    rng = random.Random(seed)
+    keys = {1: P1_KEYS, 2: P2_KEYS}
+
+    for tick in range(ticks):
+        for peer in peers:
+            key = None
+            if rng.random() < 0.3: # a key on 30% of ticks
+                key = rng.choice(keys[peer.player])
+            peer.advance(key)
+        now[0] += TICK_TIME
+    while not all(peer.tick == peer.remoteTick == ticks for peer in peers):
+        for peer in peers: # catch up to the last tick, then wait for its keys
+            if peer.tick < ticks:
+                peer.advance(None)
+            else:
+                peer.poll()
+                peer.send()
+        now[0] += TICK_TIME
+
+    same = peers[0].tick == peers[1].tick and \
+        peers[0].board.hash() == peers[1].board.hash()
+    for peer in peers:
+        print("player %d: %d ticks, %d rollbacks, %d ticks re-simulated, " \
+            "%d stalls, worst rollback %.2f ms" % (peer.player, peer.tick, \
+            peer.rollbacks, peer.resimulated, peer.stalls, \
+            peer.worstRollback * 1000))
+    print("boards match" if same else "BOARDS DIFFER")
+    return same
+
+def main():
+    parser = argparse.ArgumentParser(description="Networked tanks.")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--host", type=int, metavar="PORT", help="host a match")
+    mode.add_argument("--join", metavar="HOST:PORT", help="join a match")
+    mode.add_argument("--loopback", action="store_true", \
+        help="test rollback on a simulated link")
+    parser.add_argument("--map", default="", help="map to host (default map)")
+    parser.add_argument("--renderer", default="ansi", help="output backend")
+    parser.add_argument("--fog", action="store_true", help="fog of war")
+    parser.add_argument("--latency", type=float, default=60, help="ms")
+    parser.add_argument("--jitter", type=float, default=20, help="ms")
+    parser.add_argument("--loss", type=float, default=0.02, help="0-1")
+    parser.add_argument("--ticks", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.loopback:
+        same = loopback(args.latency / 1000, args.jitter / 1000, args.loss, \
+            args.ticks, args.seed)
+        raise SystemExit(0 if same else 1)
+
+    from renderers import RENDERERS
+    if args.host is not None:
+        session = host(args.host, args.map)
+    else:
+        address, port = args.join.rsplit(":", 1)
+        session = join((address, int(port)))
+    renderer = RENDERERS[args.renderer]()
+    renderer.start()
+    try:
+        play(session, renderer, args.fog)
+    finally:
+        renderer.stop()
+
+if __name__ == "__main__":
+    main()
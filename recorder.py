@@ -0,0 +1,137 @@
+"""
+file: recorder.py
+description: streams matches to asciicast v2 files (https://asciinema.org).
+The recorder wraps a renderer, so headless matches pay nothing for it. Each
+frame is written as soon as it's drawn, and only lines that changed since
+the previous frame are sent, so memory stays bounded by one frame.
+
+usage: python recorder.py REPLAY_LOG OUTPUT.cast
+    converts a replay log offline, at full speed and without a terminal
+"""
+
+import json
+import sys
+import time
+from renderers import Renderer
+
+class CastRecorder(Renderer):
+    """
+    Renderer that writes every frame to an asciicast file.
+
+    Live, it passes everything through to the wrapped renderer and stamps
+    frames with the real clock. Offline (no wrapped renderer) time is
+    virtual: animation pauses advance it instead of sleeping, and
+    seek() moves it to the time of the next logged move.
+    """
+    __slots__ = ("renderer", "out", "now", "origin", "previous")
+
+    def __init__(self, path, renderer=None):
+        """
+            path -> string -> asciicast file to write
+            renderer -> Renderer -> renderer to wrap (None = offline)
+        """
+        self.renderer = renderer
+        self.out = open(path, "w")
+        self.now = 0.0 # virtual clock, offline only
+        self.origin = None
+        self.previous = None # lines of the last frame (None = no header yet)
+
+    def start(self):
+        self.origin = self.clock()
+
+    def stop(self):
+        self.out.close()
+        if self.renderer:
+            self.renderer.stop()
+
+    @property
+    def animate(self):
+        return self.renderer is None or self.renderer.animate
+
+    def clock(self):
+        if self.renderer is None:
+            return self.now
+        return self.renderer.clock()
+
+    def sleep(self, seconds):
+        if self.renderer is None:
+            self.now += seconds
+        else:
+            self.renderer.sleep(seconds)
+
+    def seek(self, seconds):
+        """
+        Moves the virtual clock forward (offline only).
+
+            seconds -> float -> time since the start of the match
+        """
+        self.now = max(self.now, seconds)
+
+    def backlog(self):
+        return self.renderer.backlog() if self.renderer else 0
+
+    def title(self, text):
+        if self.renderer:
+            self.renderer.title(text)
+
+    def write(self, data):
+        """
+        Writes an output event stamped with the current time.
+
+            data -> string -> terminal output
+        """
+        if self.origin is None:
+            self.origin = self.clock()
+        event = [round(self.clock() - self.origin, 6), "o", data]
+        self.out.write(json.dumps(event) + "\n")
+
+    def draw(self, board):
+        if self.renderer:
+            self.renderer.draw(board)
+
+        lines = str(board).split("\n")
+        if self.previous is None:
+            header = {"version": 2, "width": board.size * 2 + 2, \
+                "height": len(lines) + 4, "timestamp": int(time.time()), \
+                "env": {"TERM": "xterm-256color"}}
+            self.out.write(json.dumps(header) + "\n")
+        if not self.previous: # first frame, or the screen was written over
+            self.write("\033[H\033[2J" + "\r\n".join(lines))
+        else:
+            delta = ""
+            for r, line in enumerate(lines):
+                if r >= len(self.previous) or line != self.previous[r]:
+                    delta += "\033[%d;1H%s\033[K" % (r + 1, line)
+            if delta:
+                self.write(delta)
+        self.previous = lines
+
+    def listen(self, keys):
+        if self.renderer:
+            self.renderer.listen(keys)
+
+    def pause(self, message):
+        if self.previous is not None:
+            self.write("\033[%d;1H%s" % (len(self.previous) + 1, \
+                message.replace("\n", "\r\n")))
+            self.previous = [] # redraw everything after the message
+        if self.renderer:
+            self.renderer.pause(message)
+
+def main():
+    """
+    Converts a replay log to an asciicast file.
+    """
+    from replay import simulate
+    if len(sys.argv) != 3:
+        print("usage: python recorder.py REPLAY_LOG OUTPUT.cast")
+        sys.exit(2)
+    recorder = CastRecorder(sys.argv[2])
+    recorder.start()
+    try:
+        simulate(sys.argv[1], recorder, lambda t, key: recorder.seek(t))
+    finally:
+        recorder.stop()
+
+if __name__ == "__main__":
+    main()
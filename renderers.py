@@ -0,0 +1,269 @@
+"""
+file: renderers.py
+description: output backends for tanks. Board.refresh() decides when a frame
+is drawn, a renderer decides how.
+
+AnsiRenderer: clears the screen and prints the board (works everywhere)
+CursesRenderer: double-buffered curses windows, only changed cells are sent
+NullRenderer: draws nothing, for headless matches
+"""
+
+from sys import platform as _platform # for determining os
+import os
+import sys
+import time
+try:
+    import fcntl, termios, struct # for measuring the terminal's backlog
+except ImportError:
+    fcntl = None
+
+def outputBacklog():
+    """
+    Returns the number of bytes written to the terminal but not yet sent
+    (0 if unknown, e.g. on Windows or when output isn't a terminal).
+    """
+    if fcntl is None:
+        return 0
+    try:
+        queued = fcntl.ioctl(sys.stdout.fileno(), termios.TIOCOUTQ, b"\0" * 4)
+        return struct.unpack("i", queued)[0]
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+class Renderer():
+    """
+    Interface shared by all output backends.
+        animate: whether intermediate animation frames are worth drawing
+        keys: thread already reading the keyboard, if any <- InputThread
+    """
+    animate = True
+    keys = None
+
+    def start(self):
+        """
+        Prepares the terminal. Called once before the first frame.
+        """
+        pass
+
+    def stop(self):
+        """
+        Gives the terminal back. Called once when the game ends.
+        """
+        pass
+
+    def draw(self, board):
+        """
+        Draws a frame of the board.
+
+            board -> Board -> board to draw
+        """
+        raise NotImplementedError
+
+    def backlog(self):
+        """
+        Returns how many bytes of earlier frames are still waiting to be sent.
+        """
+        return 0
+
+    def clock(self):
+        """
+        Returns the current time in seconds, used to pace animation frames.
+        """
+        return time.perf_counter()
+
+    def sleep(self, seconds):
+        """
+        Waits until the next animation frame is due.
+
+            seconds -> float -> time to wait
+        """
+        time.sleep(seconds)
+
+    def title(self, text):
+        """
+        Sets the window title.
+
+            text -> string -> new title
+        """
+        pass
+
+    def listen(self, keys):
+        """
+        Waits for enter through a thread that already reads the keyboard,
+        so that pause() doesn't race it for keystrokes.
+
+            keys -> InputThread -> started input thread
+        """
+        self.keys = keys
+
+    def pause(self, message):
+        """
+        Shows a message and waits for enter.
+
+            message -> string -> message to show
+        """
+        pass
+
+    def wait(self):
+        """
+        Blocks until enter is pressed.
+        """
+        if self.keys:
+            self.keys.waitEnter()
+        else:
+            input()
+
+class AnsiRenderer(Renderer):
+    """
+    Prints the board as ANSI colored text after clearing the screen.
+    """
+    def draw(self, board):
+        if _platform == "linux" or _platform == "linux2":
+            # linux
+            os.system('clear')
+        elif _platform == "darwin":
+            # OS X
+            pass
+        elif _platform == "win32":
+            os.system('cls')
+
+        print(board)
+
+    def backlog(self):
+        return outputBacklog()
+
+    def title(self, text):
+        if _platform == "win32":
+            os.system("title " + text)
+        else:
+            sys.stdout.write("\033]0;" + text + "\007")
+
+    def pause(self, message):
+        print(message)
+        self.wait()
+
+class CursesRenderer(Renderer):
+    """
+    Draws the board into a curses pad and the health bars into a window
+    below it. Curses keeps both screens and only sends the cells that
+    changed between frames. The layout is rebuilt when the terminal resizes.
+    """
+    __slots__ = ("screen", "pad", "status", "colors", "lines", "cols", "keys")
+
+    def __init__(self):
+        self.keys = None
+        self.screen = None # until start() has set up curses
+        self.pad = None
+        self.status = None
+
+    def start(self):
+        import curses
+        self.screen = curses.initscr()
+        curses.noecho()
+        curses.cbreak()
+        try:
+            curses.curs_set(0)
+        except curses.error:
+            pass # terminal can't hide the cursor
+
+        self.colors = {}
+        if curses.has_colors():
+            curses.start_color()
+            curses.use_default_colors()
+            # keys are the ANSI color codes used by Board.glyph()
+            for pair, (code, color) in enumerate(((31, curses.COLOR_RED), \
+                    (32, curses.COLOR_GREEN), (33, curses.COLOR_YELLOW), \
+                    (35, curses.COLOR_MAGENTA), (36, curses.COLOR_CYAN)), 1):
+                curses.init_pair(pair, color, -1)
+                self.colors[code] = curses.color_pair(pair) | curses.A_BOLD
+        self.pad = None
+        self.status = None
+        self.lines, self.cols = self.screen.getmaxyx()
+
+    def stop(self):
+        if self.screen is None:
+            return # never started, e.g. no curses on this platform
+        import curses
+        if not curses.isendwin():
+            curses.endwin()
+
+    def layout(self, board):
+        """
+        (Re)creates the board pad and the status window for the current
+        board and terminal size.
+
+            board -> Board -> board to draw
+        """
+        import curses
+        try:
+            rows, cols = os.get_terminal_size(sys.__stdout__.fileno())
+        except OSError:
+            rows, cols = self.screen.getmaxyx() # output isn't a terminal
+        if curses.is_term_resized(rows, cols):
+            curses.resizeterm(rows, cols)
+            self.screen.clear()
+            self.screen.noutrefresh()
+            self.pad = None
+        self.lines, self.cols = self.screen.getmaxyx()
+
+        if self.pad is None or self.pad.getmaxyx() != (board.size + 2, \
+                board.size * 2 + 3):
+            self.pad = curses.newpad(board.size + 2, board.size * 2 + 3)
+            top = min(board.size + 2, self.lines - 1)
+            self.status = curses.newwin(max(self.lines - top, 1), self.cols, \
+                top, 0)
+
+    def draw(self, board):
+        import curses
+        self.layout(board)
+        pad = self.pad
+        border = "#" * (board.size * 2 + 2)
+        pad.addstr(0, 0, border)
+        for r in range(board.size):
+            pad.addstr(r + 1, 0, "#")
+            for c in range(board.size):
+                char, color = board.glyph(r * board.size + c)
+                pad.addstr(r + 1, c * 2 + 1, char + " ", self.colors.get(color, 0))
+            pad.addstr(r + 1, board.size * 2 + 1, "#")
+        pad.addstr(board.size + 1, 0, border)
+
+        status = self.status
+        status.erase()
+        try:
+            status.addstr(1, 0, "Player 1: ", self.colors.get(32, 0))
+            status.addstr("[]" * board.p1h, self.colors.get(31, 0))
+            status.addstr(3, 0, "Player 2: ", self.colors.get(36, 0))
+            status.addstr("[]" * board.p2h, self.colors.get(31, 0))
+        except curses.error:
+            pass # status bar doesn't fit the terminal
+
+        pad.noutrefresh(0, 0, 0, 0, min(board.size + 2, self.lines) - 1, \
+            min(board.size * 2 + 3, self.cols) - 1)
+        status.noutrefresh()
+        curses.doupdate()
+
+    def backlog(self):
+        return outputBacklog()
+
+    def title(self, text):
+        sys.__stdout__.write("\033]0;" + text + "\007")
+
+    def pause(self, message):
+        import curses
+        try:
+            self.status.addstr(5, 0, message.strip())
+        except curses.error:
+            pass # message doesn't fit the terminal
+        self.status.refresh()
+        self.wait()
+
+class NullRenderer(Renderer):
+    """
+    Draws nothing. Used for headless matches (bots, replays, analysis).
+    """
+    animate = False
+
+    def draw(self, board):
+        pass
+
+RENDERERS = {"ansi": AnsiRenderer, "curses": CursesRenderer}
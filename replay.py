@@ -0,0 +1,346 @@
+"""
+file: replay.py
+description: replay logs. A log holds the map, the RNG seed and every move in
+the order the board applied it, which is enough to re-simulate a match.
+Every KEYFRAME_INTERVAL moves the log also holds a keyframe (the board's
+snapshot), and it ends with an index of the keyframes, so ReplayReader can
+jump to any move by restoring the nearest keyframe before it and simulating
+only the moves after that.
+
+format (text, one entry per line):
+    TANKS REPLAY 3
+    MAP <map file or builtin letter, may be empty for the default map>
+    SEED <int>
+    <seconds since start> <key> [<board hash before the move, hex>]
+    ...
+    K <moves applied so far> <Board.snapshot() as JSON, sets as {"set": []}>
+    ...
+    INDEX <moves> <keyframe interval> <move>:<byte offset of its K line>...
+    END <byte offset of the INDEX line>
+
+The hash (see Board.hash()) is optional. When it's there, simulate() and
+ReplayReader check it before every move, so a replay that no longer matches
+the engine fails on the first move that differs. The INDEX and END lines are
+written when the log is closed; logs without them (version 1 logs, or games
+that crashed) are indexed by reading through them once. Version 2 keyframes
+are snapshots from before barrel owners were kept.
+
+usage:
+    python replay.py seek LOG MOVE    (prints the board after MOVE moves)
+    python replay.py index LOG [--keyframes N] [-o OUT]
+                                      (rewrites a log with keyframes)
+"""
+
+import argparse
+import bisect
+import json
+import os
+import time
+
+KEYFRAME_INTERVAL = 500 # moves between keyframes, trades size for seek time
+VERSIONS = ("TANKS REPLAY 1", "TANKS REPLAY 2", "TANKS REPLAY 3")
+SKIPPED = ("K", "INDEX", "END") # entries that aren't moves
+
+def packSnapshot(snapshot):
+    """
+    Returns a board snapshot as one line of JSON.
+
+        snapshot -> tuple -> value returned by Board.snapshot()
+    """
+    return json.dumps([{"set": sorted(value)} if isinstance(value, \
+        frozenset) else value for value in snapshot], separators=(",", ":"))
+
+def unpackSnapshot(text, version=len(VERSIONS)):
+    """
+    Returns the board snapshot packed by packSnapshot().
+
+        text -> string -> packed snapshot
+        version -> int -> version of the log it comes from (1 = VERSIONS[0])
+    """
+    snapshot = tuple(frozenset(tuple(item) if isinstance(item, list) else \
+        item for item in value["set"]) if isinstance(value, dict) else \
+        tuple(value) if isinstance(value, list) else value \
+        for value in json.loads(text))
+    if version < 3:
+        snapshot = snapshot[:9] + (frozenset(),) + snapshot[9:] # no owners
+    return snapshot
+
+class ReplayWriter():
+    """
+    Appends moves to a replay log as they happen.
+        out: the log <- file
+        start: perf_counter() when the match started <- float
+        interval: moves between keyframes, 0 for none <- int
+        moves: moves logged so far <- int
+        offset: bytes written so far <- int
+        index: (move, byte offset) of each keyframe <- list of tuples
+    """
+    __slots__ = ("out", "start", "interval", "moves", "offset", "index")
+
+    def __init__(self, path, filename, seed, interval=KEYFRAME_INTERVAL):
+        """
+            path -> string -> replay log to write
+            filename -> string -> map the match is played on
+            seed -> int -> seed of the board's RNG
+            interval -> int -> moves between keyframes (0 = no keyframes)
+        """
+        self.out = open(path, "w", encoding="utf-8", newline="\n")
+        self.interval = interval
+        self.moves = 0
+        self.offset = 0
+        self.index = []
+        self.write(VERSIONS[-1] + "\nMAP " + filename + "\nSEED " + \
+            str(seed) + "\n")
+        self.start = time.perf_counter()
+
+    def write(self, text):
+        self.out.write(text)
+        self.offset += len(text.encode("utf-8"))
+
+    def record(self, key, stateHash=None, board=None, seconds=None):
+        """
+        Logs a move, call this right before board.turn(key).
+
+            key -> string of length 1 -> move applied to the board
+            stateHash -> int -> board.hash() before the move (optional)
+            board -> Board -> the board, keyframes are taken from it
+                (optional, no keyframes without it)
+            seconds -> float -> time of the move (default: now)
+        """
+        if board is not None and self.interval and self.moves and \
+                self.moves % self.interval == 0:
+            self.index.append((self.moves, self.offset))
+            self.write("K %d %s\n" % (self.moves, \
+                packSnapshot(board.snapshot())))
+        if seconds is None:
+            seconds = time.perf_counter() - self.start
+        if stateHash is None:
+            self.write("%.3f %s\n" % (seconds, key))
+        else:
+            self.write("%.3f %s %016x\n" % (seconds, key, stateHash))
+        self.moves += 1
+        self.out.flush()
+
+    def close(self):
+        """
+        Writes the keyframe index and closes the log.
+        """
+        start = self.offset
+        self.write("INDEX %d %d%s\n" % (self.moves, self.interval, \
+            "".join(" %d:%d" % keyframe for keyframe in self.index)))
+        self.write("END %d\n" % start)
+        self.out.close()
+
+def readReplay(path):
+    """
+    Opens a replay log. Returns (filename, seed, moves), where moves is a
+    generator of (seconds, key, hash) tuples read lazily from the file
+    (hash is None if the log doesn't have one).
+
+        path -> string -> replay log to read
+    """
+    log = open(path, encoding="utf-8")
+    if log.readline().strip() not in VERSIONS:
+        log.close()
+        raise ValueError(path + " is not a replay log")
+    filename = log.readline().rstrip("\n")[len("MAP "):]
+    seed = int(log.readline().split()[1])
+
+    def moves():
+        with log:
+            for line in log:
+                fields = line.split()
+                if fields and fields[0] not in SKIPPED:
+                    yield float(fields[0]), fields[1], \
+                        int(fields[2], 16) if len(fields) > 2 else None
+
+    return filename, seed, moves()
+
+def simulate(path, renderer=None, onMove=None):
+    """
+    Re-plays a match from its log and returns the final board. Raises
+    ValueError if the board's hash differs from one in the log.
+
+        path -> string -> replay log to play
+        renderer -> Renderer -> output backend (NullRenderer if None)
+        onMove -> function(seconds, key) -> called before each move
+    """
+    from tanks import Board
+    from renderers import NullRenderer
+    filename, seed, moves = readReplay(path)
+    board = Board(filename, renderer if renderer else NullRenderer(), seed)
+    board.refresh()
+    for n, (t, key, stateHash) in enumerate(moves):
+        if stateHash is not None and stateHash != board.hash():
+            raise ValueError("%s: board differs from the log before move %d" \
+                % (path, n + 1))
+        if onMove:
+            onMove(t, key)
+        board.turn(key)
+        board.refresh()
+    return board
+
+class ReplayReader():
+    """
+    Seeks in a replay log: seek(move) restores the keyframe nearest before
+    the move and simulates the rest, so any move is at most one keyframe
+    interval of simulation away.
+        path, filename, seed: the log, its map and seed <- strings, int
+        log: the log, read as bytes <- file
+        board: the board seek() sets up, reused by every seek <- Board
+        version: version of the log (1 = VERSIONS[0]) <- int
+        initial: snapshot of the board before the first move <- tuple
+        first: byte offset of the first move <- int
+        moves: number of moves in the log <- int
+        keyframes: moves with a keyframe, ascending <- list of ints
+        offsets: byte offsets of those keyframes <- list of ints
+    """
+    __slots__ = ("path", "filename", "seed", "log", "board", "version", \
+        "initial", "first", "moves", "keyframes", "offsets")
+
+    def __init__(self, path):
+        """
+            path -> string -> replay log to read
+        """
+        from tanks import Board
+        from renderers import NullRenderer
+        self.path = path
+        self.log = open(path, "rb")
+        version = self.log.readline().decode("utf-8").strip()
+        if version not in VERSIONS:
+            self.log.close()
+            raise ValueError(path + " is not a replay log")
+        self.version = VERSIONS.index(version) + 1
+        self.filename = self.log.readline().decode("utf-8").rstrip("\n")[ \
+            len("MAP "):]
+        self.seed = int(self.log.readline().split()[1])
+        self.first = self.log.tell()
+        self.board = Board(self.filename, NullRenderer(), self.seed)
+        self.initial = self.board.snapshot()
+        self.keyframes = []
+        self.offsets = []
+        if not self.readIndex():
+            self.scan()
+
+    def readIndex(self):
+        """
+        Loads the index at the end of the log. Returns false if there is none.
+        """
+        self.log.seek(0, os.SEEK_END)
+        self.log.seek(max(self.first, self.log.tell() - 32))
+        lines = self.log.read().split(b"\n")
+        last = lines[-2].split() if len(lines) > 1 else []
+        if len(last) != 2 or last[0] != b"END":
+            return False
+        self.log.seek(int(last[1]))
+        fields = self.log.readline().split()
+        if not fields or fields[0] != b"INDEX":
+            return False
+        self.moves = int(fields[1])
+        for keyframe in fields[3:]:
+            move, offset = keyframe.split(b":")
+            self.keyframes.append(int(move))
+            self.offsets.append(int(offset))
+        return True
+
+    def scan(self):
+        """
+        Indexes a log that has no index by reading through it.
+        """
+        self.moves = 0
+        self.log.seek(self.first)
+        offset = self.first
+        for line in self.log:
+            if line.startswith(b"K "):
+                self.keyframes.append(int(line.split(None, 2)[1]))
+                self.offsets.append(offset)
+            elif line.strip() and not line.startswith((b"INDEX", b"END")):
+                self.moves += 1
+            offset += len(line)
+
+    def seek(self, move):
+        """
+        Returns the board after a number of moves. It is the same board
+        every call (its renderer can be changed), and the next seek changes
+        it. Raises ValueError if the board's hash differs from one in the log.
+
+            move -> int -> moves to apply (0 to moves)
+        """
+        if not 0 <= move <= self.moves:
+            raise ValueError("%s: move %d is out of range (0-%d)" % \
+                (self.path, move, self.moves))
+        i = bisect.bisect_right(self.keyframes, move) - 1
+        if i >= 0:
+            self.log.seek(self.offsets[i])
+            self.board.restore(unpackSnapshot(self.log.readline().split( \
+                None, 2)[2].decode("utf-8"), self.version))
+            done = self.keyframes[i]
+        else:
+            self.log.seek(self.first)
+            self.board.restore(self.initial)
+            done = 0
+        while done < move:
+            fields = self.log.readline().split()
+            if not fields or fields[0].decode("utf-8") in SKIPPED:
+                continue
+            if len(fields) > 2 and int(fields[2], 16) != self.board.hash():
+                raise ValueError("%s: board differs from the log before " \
+                    "move %d" % (self.path, done + 1))
+            self.board.turn(fields[1].decode("utf-8"))
+            done += 1
+        return self.board
+
+    def close(self):
+        self.log.close()
+
+def index(path, out, interval):
+    """
+    Rewrites a replay log with keyframes (and its index).
+
+        path -> string -> replay log to read
+        out -> string -> where to write it (may be path)
+        interval -> int -> moves between keyframes
+    """
+    from tanks import Board
+    from renderers import NullRenderer
+    filename, seed, moves = readReplay(path)
+    board = Board(filename, NullRenderer(), seed)
+    writer = ReplayWriter(out + ".tmp", filename, seed, interval)
+    try:
+        for t, key, stateHash in moves:
+            writer.record(key, stateHash, board, t)
+            board.turn(key)
+    finally:
+        writer.close()
+    os.replace(out + ".tmp", out)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay logs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    seek = commands.add_parser("seek", help="print the board after a move")
+    seek.add_argument("log")
+    seek.add_argument("move", type=int)
+    reindex = commands.add_parser("index", help="add keyframes to a log")
+    reindex.add_argument("log")
+    reindex.add_argument("--keyframes", type=int, default=KEYFRAME_INTERVAL, \
+        metavar="N", help="moves between keyframes (default: %(default)s)")
+    reindex.add_argument("-o", "--out", help="output log (default: LOG)")
+    args = parser.parse_args()
+
+    if args.command == "index":
+        index(args.log, args.out or args.log, args.keyframes)
+        return
+    reader = ReplayReader(args.log)
+    start = time.perf_counter()
+    try:
+        board = reader.seek(args.move)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    seconds = time.perf_counter() - start
+    print(board)
+    print("move %d of %d, %d keyframes, seek took %.1f ms" % (args.move, \
+        reader.moves, len(reader.keyframes), seconds * 1000))
+    reader.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+file: results.py
+description: persistent match results in a SQLite database. record() only
+queues a result; a writer thread inserts whatever has queued up in one
+transaction, so a match loop (or a tournament running thousands of matches a
+second) never waits for the disk. The database is in WAL mode, so leaderboards
+can be read while results are being written.
+
+schema:
+    maps (id, name, digest)      a map is its file name and a hash of its
+                                 text, so edited maps count as new maps
+    matches (id, finished, map, seed, winner, duration, moves)
+    players (match, player, name, won, health, moves, shots, barrels)
+    indexes cover the leaderboard (players by name) and per-map win rates
+    (matches by map)
+
+usage:
+    python results.py leaderboard DB [--top N]
+    python results.py maps DB
+    python results.py bench DB [--count N]    (times recording N results)
+"""
+
+import argparse
+import hashlib
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+
+BATCH = 4096 # most results inserted per transaction
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS maps (id INTEGER PRIMARY KEY, name TEXT NOT NULL,
+    digest TEXT NOT NULL, UNIQUE (name, digest));
+CREATE TABLE IF NOT EXISTS matches (id INTEGER PRIMARY KEY, finished REAL,
+    map INTEGER REFERENCES maps, seed INTEGER, winner INTEGER, duration REAL,
+    moves INTEGER);
+CREATE TABLE IF NOT EXISTS players (match INTEGER REFERENCES matches,
+    player INTEGER, name TEXT, won INTEGER, health INTEGER, moves INTEGER,
+    shots INTEGER, barrels INTEGER, PRIMARY KEY (match, player))
+    WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS players_by_name ON players (name, won);
+CREATE INDEX IF NOT EXISTS matches_by_map ON matches (map, winner);
+"""
+
+def mapDigest(filename):
+    """
+    Returns a hash of a map's text (of its name for maps that aren't files,
+    like the default map and builtin letters).
+
+        filename -> string -> map file or builtin map letter
+    """
+    try:
+        with open(filename, "rb") as text:
+            return hashlib.sha1(text.read()).hexdigest()
+    except OSError:
+        return hashlib.sha1(filename.encode()).hexdigest()
+
+def connect(path):
+    """
+    Opens a results database, creating it if needed.
+
+        path -> string -> database file
+    """
+    db = sqlite3.connect(path, timeout=30)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL") # a power cut may lose the last commits
+    db.executescript(SCHEMA)
+    return db
+
+class ResultStore():
+    """
+    Records match results in the background.
+        path: database file <- string
+        queue: results waiting to be written, None ends the writer
+            <- queue.Queue
+        writer: thread writing queued results <- threading.Thread
+        error: what stopped the writer, raised by the next call <- Exception
+    """
+    __slots__ = ("path", "queue", "writer", "error")
+
+    def __init__(self, path):
+        """
+            path -> string -> database file (created if needed)
+        """
+        self.path = path
+        connect(path).close() # fail here rather than in the writer
+        self.queue = queue.Queue()
+        self.error = None
+        self.writer = threading.Thread(target=self.write)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def record(self, filename, seed, winner, duration, players):
+        """
+        Queues the result of a match. Returns right away.
+
+            filename -> string -> map the match was played on
+            seed -> int -> seed of the board's RNG
+            winner -> int -> Board.winner() (0 = nobody)
+            duration -> float -> seconds the match took
+            players -> 2 tuples -> (name, health left, keys pressed, shots,
+                barrels laid) of player 1 and 2
+        """
+        if self.error:
+            raise self.error
+        self.queue.put((time.time(), filename, seed, winner, duration, \
+            players))
+
+    def write(self):
+        """
+        Writer thread: inserts queued results, up to BATCH per transaction.
+        """
+        db = None
+        try:
+            db = connect(self.path)
+        except sqlite3.Error as e:
+            self.error = e
+        maps = {} # (filename, digest) -> map id
+        done = False
+        while not done:
+            batch = [self.queue.get()]
+            while len(batch) < BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            if not self.error: # after an error, results are thrown away
+                try:
+                    with db:
+                        db.execute("BEGIN IMMEDIATE") # lock before the ids
+                        self.insert(db, maps, batch)
+                except sqlite3.Error as e:
+                    self.error = e
+            for _ in range(len(batch) + done):
+                self.queue.task_done()
+        if db is not None:
+            db.close()
+
+    def insert(self, db, maps, batch):
+        """
+        Inserts results in the current transaction, which must hold the
+        write lock (BEGIN IMMEDIATE): match ids are taken from MAX(id), so
+        another writer mustn't insert between reading and using them. Maps
+        are hashed again for every batch, so a map edited during a run
+        counts as a new map from the next batch on.
+
+            db -> sqlite3.Connection -> writer's connection
+            maps -> dict -> map ids found so far, by (filename, digest)
+            batch -> list of tuples -> results queued by record()
+        """
+        ids = {} # filename -> map id, in this batch
+        for finished, filename, seed, winner, duration, players in batch:
+            if filename not in ids:
+                key = (filename, mapDigest(filename))
+                if key not in maps:
+                    db.execute("INSERT OR IGNORE INTO maps (name, digest) " \
+                        "VALUES (?, ?)", key)
+                    maps[key] = db.execute("SELECT id FROM maps WHERE " \
+                        "name = ? AND digest = ?", key).fetchone()[0]
+                ids[filename] = maps[key]
+        first = db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM matches" \
+            ).fetchone()[0] # ids are assigned here, so rows can go in bulk
+        db.executemany("INSERT INTO matches VALUES (?, ?, ?, ?, ?, ?, ?)", \
+            ((first + i, finished, ids[filename], seed, winner, duration, \
+            players[0][2] + players[1][2]) for i, (finished, filename, seed, \
+            winner, duration, players) in enumerate(batch)))
+        db.executemany("INSERT INTO players VALUES (?, ?, ?, ?, ?, ?, ?, ?)", \
+            ((first + i, player, name, int(result[3] == player), health, \
+            moves, shots, barrels) for i, result in enumerate(batch) \
+            for player, (name, health, moves, shots, barrels) in \
+            enumerate(result[5], 1)))
+
+    def flush(self):
+        """
+        Waits until every result recorded so far is in the database.
+        """
+        self.queue.join()
+        if self.error:
+            raise self.error
+
+    def close(self):
+        """
+        Writes the remaining results and stops the writer.
+        """
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.queue.join()
+        if self.error:
+            raise self.error
+
+def leaderboard(db, top=10):
+    """
+    Returns the players with the most wins, as (name, wins, matches, win
+    rate) tuples.
+
+        db -> sqlite3.Connection -> results database
+        top -> int -> number of players
+    """
+    return db.execute("SELECT name, SUM(won) AS wins, COUNT(*), " \
+        "AVG(won) FROM players GROUP BY name ORDER BY wins DESC, name " \
+        "LIMIT ?", (top,)).fetchall()
+
+def mapWinRates(db):
+    """
+    Returns how matches ended per map, as (map name, digest, matches, player
+    1 win rate, player 2 win rate) tuples, most played first.
+
+        db -> sqlite3.Connection -> results database
+    """
+    return db.execute("SELECT maps.name, maps.digest, COUNT(*), " \
+        "AVG(winner = 1), AVG(winner = 2) FROM matches JOIN maps " \
+        "ON maps.id = matches.map GROUP BY matches.map " \
+        "ORDER BY COUNT(*) DESC").fetchall()
+
+def bench(path, count):
+    """
+    Records count random results and prints how fast they were queued and
+    written.
+
+        path -> string -> database file
+        count -> int -> results to record
+    """
+    rng = random.Random(1)
+    names = ["player%d" % n for n in range(100)]
+    store = ResultStore(path)
+    start = time.perf_counter()
+    for n in range(count):
+        store.record(rng.choice(("", "fortress.txt", "warzone.txt")), n, \
+            rng.randrange(3), rng.uniform(10, 100), tuple((rng.choice(names), \
+            rng.randrange(11), rng.randrange(500), rng.randrange(100), \
+            rng.randrange(10)) for _ in range(2)))
+    queued = time.perf_counter() - start
+    store.close()
+    written = time.perf_counter() - start
+    print("%d results: queued at %.0f/s, written at %.0f/s" % (count, \
+        count / queued, count / written))
+
+def main():
+    parser = argparse.ArgumentParser(description="Match results.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    board = commands.add_parser("leaderboard", help="players with most wins")
+    board.add_argument("db")
+    board.add_argument("--top", type=int, default=10)
+    maps = commands.add_parser("maps", help="win rates per map")
+    maps.add_argument("db")
+    timing = commands.add_parser("bench", help="time recording results")
+    timing.add_argument("db")
+    timing.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        bench(args.db, args.count)
+        return
+    if not os.path.exists(args.db):
+        raise SystemExit(args.db + ": no such database")
+    db = connect(args.db)
+    if args.command == "leaderboard":
+        print("%-20s %8s %8s %8s" % ("player", "wins", "matches", "win rate"))
+        for name, wins, matches, rate in leaderboard(db, args.top):
+            print("%-20s %8d %8d %7.1f%%" % (name, wins, matches, rate * 100))
+    else:
+        print("%-20s %-12s %8s %8s %8s" % ("map", "version", "matches", \
+            "p1 wins", "p2 wins"))
+        for name, digest, matches, p1, p2 in mapWinRates(db):
+            print("%-20s %-12s %8d %7.1f%% %7.1f%%" % (name or "(default)", \
+                digest[:12], matches, p1 * 100, p2 * 100))
+    db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+file: server.py
+description: authoritative server for hosted tanks matches. One process runs
+any number of matches on one UDP socket, in ticks of netplay.TICK_TIME: each
+tick it applies at most one queued key per player of every match, steps the
+boards and sends every client a frame. Clients are addressed by (match,
+player), so many of them can share a socket (see loadtest.py). Players can
+be bots instead: a bot.BotScheduler decides the keys of every bot of every
+match in one batch, on a worker thread while the server waits for the next
+tick, and they're queued like clients' keys at the start of it.
+
+packets:
+    client -> server: KEY (match, player, key number, key; key 0 = hello)
+    server -> client: FRAME (match, player, tick, number of the player's key
+        last applied, board hash, time sent)
+A frame carries the board's hash rather than the board: the server does the
+same work per client, and clients on this machine don't need more.
+
+usage:
+    python server.py [--port PORT] [--matches N] [--map MAP] [--seed N]
+        [--bots 1,2]
+"""
+
+import argparse
+import os
+import socket
+import struct
+import sys
+import time
+from collections import deque
+from netplay import TICK_TIME, BURN_TICKS, P1_KEYS, P2_KEYS
+from renderers import NullRenderer
+try:
+    import resource # for measuring memory where /proc isn't available
+except ImportError:
+    resource = None
+
+QUEUE_LIMIT = 2 # keys queued per player, more are dropped (as InputThread)
+KEYSETS = (None, frozenset(P1_KEYS), frozenset(P2_KEYS)) # by player
+KEY = struct.Struct("!IBIB") # match, player, key number, key
+FRAME = struct.Struct("!IBIIQd") # match, player, tick, applied, hash, sent
+BUFFER = 1 << 22 # socket buffer size to ask for, in bytes
+
+def memoryKB():
+    """
+    Returns the memory this process uses, in KB (0 if unknown): its resident
+    size on Linux, otherwise the most it has used so far.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") \
+                // 1024
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if resource is None:
+        return 0
+    used = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return used // 1024 if sys.platform == "darwin" else used # bytes there
+
+class Match():
+    """
+    One hosted match.
+        board: the match's board, headless <- Board
+        queues: keys waiting per player, as (number, key) <- list of deques
+        applied: number of the last key applied per player <- list of ints
+        addresses: where each player's frames go <- list of (host, port)
+    Lists are indexed by player number (index 0 is unused).
+    """
+    __slots__ = ("board", "queues", "applied", "addresses")
+
+    def __init__(self, board):
+        """
+            board -> Board -> fresh headless board
+        """
+        self.board = board
+        self.queues = [None, deque(), deque()]
+        self.applied = [0, 0, 0]
+        self.addresses = [None, None, None]
+
+class MatchServer():
+    """
+    Hosts matches.
+        sock: non-blocking UDP socket <- socket.socket
+        matches: hosted matches, by number <- list of Match
+        tick: next tick to simulate <- int
+        tickTimes: seconds of work per tick, while measuring <- list of floats
+        measuring: whether to record tickTimes <- bool
+        received, applied, dropped, rejected, frames: counters (keys that
+            arrived, were applied, didn't fit a queue, weren't the sender's
+            player's keys; frames sent) <- int
+        bots: players bots play in every match <- frozenset of ints
+        scheduler: bots of every match, None if there are none
+            <- bot.BotScheduler
+        botQueues: key queue of each bot, in the scheduler's order
+            <- list of deques
+    """
+    __slots__ = ("sock", "matches", "tick", "tickTimes", "measuring", \
+        "received", "applied", "dropped", "rejected", "frames", "bots", \
+        "scheduler", "botQueues")
+
+    def __init__(self, sock, count, filename="", seed=0, bots=()):
+        """
+            sock -> socket.socket -> bound UDP socket
+            count -> int -> number of matches to host
+            filename -> string -> map of every match (as for Board())
+            seed -> int -> seed of match 0, match n gets seed + n
+            bots -> collection of ints -> players of every match that bots
+                play (their clients' keys are ignored)
+        """
+        from tanks import Board
+        sock.setblocking(False)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, BUFFER)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, BUFFER)
+        except OSError:
+            pass # keep the system's buffer sizes
+        self.sock = sock
+        self.matches = [Match(Board(filename, NullRenderer(), seed + n)) \
+            for n in range(count)]
+        self.tick = 0
+        self.tickTimes = []
+        self.measuring = False
+        self.received = 0
+        self.applied = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.frames = 0
+        self.bots = frozenset(bots)
+        self.scheduler = None
+        self.botQueues = []
+        if bots:
+            from bot import BotScheduler
+            self.scheduler = BotScheduler(seed)
+            for match in self.matches:
+                for player in sorted(self.bots):
+                    self.scheduler.add(match.board, player)
+                    self.botQueues.append(match.queues[player])
+            self.scheduler.start()
+
+    def poll(self):
+        """
+        Queues every key that has arrived. A client only gets to press its
+        own player's keys: others (the other tank's, BURN) are dropped.
+        """
+        while True:
+            try:
+                packet, address = self.sock.recvfrom(64)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                continue # e.g. ICMP port unreachable from a departed client
+            if len(packet) < KEY.size:
+                continue
+            number, player, seq, key = KEY.unpack_from(packet)
+            if number >= len(self.matches) or player not in (1, 2):
+                continue
+            match = self.matches[number]
+            match.addresses[player] = address
+            if key == 0 or player in self.bots:
+                continue # hello, or a key for a bot's tank
+            self.received += 1
+            if chr(key) not in KEYSETS[player]:
+                self.rejected += 1
+            elif len(match.queues[player]) < QUEUE_LIMIT:
+                match.queues[player].append((seq, chr(key)))
+            else:
+                self.dropped += 1
+
+    def queueBots(self):
+        """
+        Queues a key for every bot, decided in one batch. A bot's queue holds
+        only its latest key, numbered by tick.
+        """
+        for queue, (board, player, key) in zip(self.botQueues, \
+                self.scheduler.keys()):
+            queue.clear()
+            if key is not None:
+                queue.append((self.tick, key))
+
+    def step(self):
+        """
+        Runs one tick: takes in keys, steps every match and sends frames.
+        Returns the seconds it took.
+        """
+        start = time.perf_counter()
+        self.poll()
+        if self.scheduler is not None:
+            self.queueBots()
+        sent = time.time()
+        for number, match in enumerate(self.matches):
+            board = match.board
+            for player in (1, 2):
+                if match.queues[player]:
+                    match.applied[player], key = match.queues[player].popleft()
+                    board.turn(key)
+                    self.applied += 1
+            if board.burning and self.tick % BURN_TICKS == BURN_TICKS - 1:
+                board.burn()
+            if board.gameOver():
+                board.newMatch()
+            stateHash = board.hash()
+            for player in (1, 2):
+                if match.addresses[player] is not None:
+                    try:
+                        self.sock.sendto(FRAME.pack(number, player, self.tick, \
+                            match.applied[player], stateHash, sent), \
+                            match.addresses[player])
+                        self.frames += 1
+                    except OSError:
+                        pass # buffer full, the client misses a frame
+        if self.scheduler is not None:
+            self.scheduler.request() # decided while waiting for the next tick
+        self.tick += 1
+        seconds = time.perf_counter() - start
+        if self.measuring:
+            self.tickTimes.append(seconds)
+        return seconds
+
+    def run(self, until, measure=None):
+        """
+        Runs ticks on time until a moment, sleeping between them. Ticks that
+        start late are run right away, not skipped.
+
+            until -> float -> time.time() to stop at
+            measure -> (float, float) -> time.time()s to record tickTimes
+                between (None for never)
+        """
+        nextTick = time.time()
+        while nextTick < until:
+            now = time.time()
+            if nextTick > now:
+                time.sleep(nextTick - now)
+            self.measuring = measure is not None and \
+                measure[0] <= nextTick < measure[1]
+            self.step()
+            nextTick += TICK_TIME
+
+    def close(self):
+        """
+        Stops the bots' worker thread, if any. The socket is the caller's.
+        """
+        if self.scheduler is not None:
+            self.scheduler.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Hosts tanks matches.")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--matches", type=int, default=100)
+    parser.add_argument("--map", default="", help="map (default map)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--bots", default="", metavar="PLAYERS", \
+        help="players bots play in every match, e.g. 2 or 1,2 (default: none)")
+    args = parser.parse_args()
+    bots = {int(player) for player in args.bots.split(",") if player}
+    if not bots <= {1, 2}:
+        parser.error("--bots takes players 1 and 2")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("", args.port))
+    before = memoryKB()
+    server = MatchServer(sock, args.matches, args.map, args.seed, bots)
+    print("Hosting %d matches on port %d (%.1f KB per match)" % (args.matches, \
+        args.port, (memoryKB() - before) / max(args.matches, 1)))
+    try:
+        server.run(float("inf"))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    print("%d ticks, %d keys received, %d applied, %d dropped, %d rejected, " \
+        "%d frames" % (server.tick, server.received, server.applied, \
+        server.dropped, server.rejected, server.frames))
+
+if __name__ == "__main__":
+    main()
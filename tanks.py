@@ -5,17 +5,110 @@ description: console-based tank game. execute to play.
 P1 controls: WASD to move, F to fire
 P2 controls: OKL; to move, ' to fire
 
+usage: python tanks.py [--renderer ansi|curses] [--seed N] [--log FILE]
+                       [--keyframes N]
+                       [--record FILE] [--latency FILE] [--maps DIR]
+                       [--bot 1|2] [--bot-time S] [--bot-workers N]
+                       [--results DB] [--names NAME1,NAME2] [--chunks N]
+
 notes: lists that don't change (e.g. walls) changed to sets for O(1) access
 disabled buffering of output stream to improve performance
+animation frames are paced to FRAME_TIME and skipped when the terminal lags
 """
 
 from colorama import init
-from sys import platform as _platform # for determining os
-init() #allows color printing
 import os
-import sys; sys.stdout = sys.stderr #avoids buffering output
+import sys
 import random
+import bisect
 import threading
+import time
+import signal
+import argparse
+import re
+import bitboard
+import zobrist
+from renderers import AnsiRenderer, RENDERERS
+from replay import ReplayWriter, KEYFRAME_INTERVAL
+from recorder import CastRecorder
+from latency import LatencyStats, LatencyProbe
+from maplib import MapLibrary, describe
+from fov import FieldOfView
+from entities import Components, TANK, BARREL, BULLET, TANK1, TANK2, SHOT
+import terrain
+import danger
+import hotreload
+from bot import BotPlayer, BUDGET, KEYS as PLAYER_KEYS
+from results import ResultStore
+
+FRAME_TIME = 1 / 60 # target time between animation frames (seconds)
+MASK64 = (1 << 64) - 1
+FIRE_TICK = 0.25 # seconds between fire updates (see Board.burn)
+BURN = "*" # pseudo-key for Board.turn() that advances fire by one tick
+NO_OWNERS = frozenset() # barrel owners of most snapshots
+SPAWN_TRIES = 100 # random placements tried before spawning into danger
+TILES = re.compile(r"[O#?/\\S0-9]") # map characters that aren't empty space
+
+class SplitMix64():
+    """
+    Small, fast RNG (splitmix64) whose whole state is one int, so board
+    snapshots stay cheap. Only offers what the board needs.
+    """
+    __slots__ = ("state",)
+
+    def __init__(self, seed=None):
+        """
+            seed -> int -> starting state (random if None)
+        """
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.state = seed & MASK64
+
+    def random(self):
+        """
+        Returns a float in [0, 1).
+        """
+        self.state = z = (self.state + 0x9E3779B97F4A7C15) & MASK64
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+        return ((z ^ (z >> 31)) >> 11) * (1.0 / (1 << 53))
+
+MOVES = {"w": (1, 0), "a": (1, 1), "s": (1, 2), "d": (1, 3), \
+    "o": (2, 0), "k": (2, 1), "l": (2, 2), ";": (2, 3)} # key: (player, direction)
+NONE = -1 # cell id of nowhere: off the board, no bullet, no flame
+
+_neighbors = {} # size -> neighbors(size), cached
+
+def mapFile(filename):
+    """
+    Returns the file of a map: builtin map letters become their file, other
+    names are returned as they are.
+
+        filename -> string -> map file or builtin map letter
+    """
+    return {"w": "warzone.txt", "b": "barricade.txt", "f": "fortress.txt", \
+        "p": "portals.txt"}.get(filename.lower(), filename)
+
+def neighbors(size):
+    """
+    Returns the neighbour tables of a board size: for each direction
+    (N-W-S-E), a tuple of the cell one step away from each cell (NONE if
+    that's off the board). Boards of the same size share them.
+
+        size -> int -> length of rows/columns
+    """
+    if size not in _neighbors:
+        area = size * size
+        cells = list(range(-size, area + size)) # cells[i] is i - size: each
+            # table is a slice of it, sharing its ints
+        edge = [NONE] * size
+        west = cells[size - 1:area + size - 1]
+        west[::size] = edge # first column
+        east = cells[size + 1:area + size + 1]
+        east[size - 1::size] = edge # last column
+        _neighbors[size] = (tuple(edge + cells[size:area]), tuple(west), \
+            tuple(cells[2 * size:area + size] + edge), tuple(east))
+    return _neighbors[size]
 
 class Board():
     """
@@ -23,116 +116,328 @@ class Board():
         size: length of rows/columns <- int
         maxHealth: total health players start with <- int
 
-        p1: player 1's location <- (r,c) tuple
+        entities: tanks, barrels and the bullet, as component arrays (see
+            entities.py) <- Components
+        f: locations of flames <- [int * 9] set of ints
+
+        These are properties over entities:
+        p1: player 1's location <- int (cell id, see below)
         p1d: player 1's direction  <- int (range 0-3)
         p1h: player 1's health <- int
 
         <player 2's stuff is obvious>
 
-        b: location of bullet <- (r,c) tuple
-        f: locations of fire <- [(r,c) * 9] set of tuples
-
-        barrels: locations of barrels <- [(r,c) * any] set of tuples
-        walls: locations of walls <- [(r,c) * any] set of tuples
-        portals: locations of portals <- [(r,c) * any] set of tuples
-        topLeftMirrors: locations of mirrors <- [(r,c) * any] set of tuples
-        topRightMirrors: locations of mirrors <- [(r,c) * any] set of tuples
-
-        curBarrels: locations of live barrels <- [(r,c) * any] set of tuples
-        listOfPortals: locations of portals <- [(r,c) * any] list of tuples
-        spawns: locations of spawn points <- [(r,c) * any] list of tuples
-        (spawns and portals need indexing for randomization, so they're lists)
+        b: location of bullet <- int
+        curBarrels: locations of live barrels <- set-like view of ints
+
+        burnTime: ticks that explosion flames keep burning (0 = none) <- int
+        fire: burning cells by ticks left, fire[k] burns k + 1 more ticks
+            <- [bitboard * burnTime] list of ints (see bitboard.py)
+        burning: all burning cells <- [int * any] set of ints
+        openBits: cells fire can spread to (not walls) <- bitboard int
+
+        barrels: locations of barrels <- [int * any] set of ints
+        walls: locations of walls <- [int * any] set of ints
+        portals: locations of portals <- [int * any] set of ints
+        topLeftMirrors: locations of mirrors <- [int * any] set of ints
+        topRightMirrors: locations of mirrors <- [int * any] set of ints
+
+        portalChannels: channel of each digit portal <- {int: char} dict
+            ("?" portals share one channel, so do portals with the same digit)
+        portalLinks: portals of each channel, sorted: a portal leads to the
+            others on its channel <- {char: tuple of ints} dict
+        spawns: locations of spawn points <- [int * any] list of ints
+        (spawns and portal links need indexing for randomization)
+        rays: cached bullet paths, see ray() <- {(int, int): tuple} dict
+        sight: cached lines of sight (None until needed) <- FieldOfView
+        viewers: players whose sight is drawn, () for no fog <- tuple of ints
+        shown: (players' positions, spaces they see) of the last frame drawn
+            with fog, see visibleSpaces() <- tuple
         self.barrelLimit: limit of barrrel placement (int)
 
-        allOccupiedSpaces: used for printing <- [(r,c) * any] set of tuples
+        allOccupiedSpaces: used for printing <- [int * any] set of ints
+        steps: neighbour tables, see neighbors() <- tuple of 4 tuples
+        keys: Zobrist keys of players and barrels on each cell, see
+            zobrist.cellKeys() <- tuple of 3 tuples
+        layers: bitboards of the map for danger maps, None until needed
+            <- danger.Layers
+        chunks: terrain of a huge map, None if the map is in memory
+            <- terrain.Terrain (walls, mirrors and allOccupiedSpaces are
+            then terrain.TileSets, steps and keys are computed on lookup)
+        zobrist: XOR of the keys of the live barrels and the barrel limit,
+            kept up to date as they change <- 64-bit int
+        fireKey: hash of fire, see zobrist.fireKey() <- 64-bit int
+        frameDue: time the next animation frame is due (0 if idle) <- float
+        renderer: output backend used by refresh() <- Renderer
+        rng: source of all randomness, seeded for replays <- SplitMix64
+
+    Spaces are cell ids, r * size + c, with NONE (-1) for off the board, no
+    bullet or no flame. cell() and coords() convert from and to (r,c).
     """
-    __slots__ = ('size', 'maxHealth', 'p1', 'p1d', 'p1h', 'p2', 'p2d', 'p2h', \
-        'b', 'f', 'barrels', 'curBarrels', 'walls', 'portals', 'topLeftMirrors', 'topRightMirrors', \
-        'listOfPortals', 'spawns', 'barrelLimit', 'allOccupiedSpaces')
+    __slots__ = ('size', 'maxHealth', 'entities', 'f', \
+        'burnTime', 'fire', 'burning', 'openBits', 'barrels', 'walls', 'portals', 'topLeftMirrors', 'topRightMirrors', \
+        'portalChannels', 'portalLinks', 'rays', 'sight', 'viewers', 'shown', 'spawns', 'barrelLimit', 'allOccupiedSpaces', 'steps', 'keys', 'layers', 'chunks', 'zobrist', 'fireKey', 'frameDue', 'renderer', 'rng')
 
-    def __init__(self, filename):
+    def __init__(self, filename, renderer=None, seed=None, lines=None, \
+            chunks=0):
         """
         Initializes the data structure. 
+
+            filename -> string -> map file or builtin map letter ("" = default)
+            renderer -> Renderer -> output backend (AnsiRenderer if None)
+            seed -> int -> RNG seed, same seed and moves = same match
+            lines -> iterable of strings -> map text to use instead of
+                reading filename (e.g. from mapgen)
+            chunks -> int -> read walls and mirrors from the map file in
+                chunks, keeping at most this many in memory (see terrain.py);
+                0 reads the whole map up front
         """
-        if filename == "":
+        self.chunks = None
+        self.layers = None
+        if chunks and (filename == "" or lines is not None):
+            raise ValueError("only map files can be read in chunks")
+        if filename == "" and lines is None:
             #Default map
             self.size = 15
             self.maxHealth = 10
-            self.barrels = set(((5,5),(5,4),(9,5),(3,1),(3,4)))
-            self.walls = set(((3,3),(4,3),(5,3),(3,8),(4,3),(5,7),(8,7),(3,6)))
-            self.portals = set(((1,8),(3,7),(6,3),(5,4)))
-            self.topLeftMirrors = set(((5,2),(1,2)))
-            self.topRightMirrors = set(((4,6),(7,9)))
+            self.burnTime = 0
+            self.barrels = set((80,79,140,46,49))
+            self.walls = set((48,63,78,53,63,82,127,51))
+            self.portals = set((23,52,93,79))
+            self.topLeftMirrors = set((77,17))
+            self.topRightMirrors = set((66,114))
+            self.portalChannels = {}
             self.spawns = []
 
         else:
-            #builtin maps
-            if filename == "w" or filename == "W":
-                filename = "warzone.txt"
-            elif filename == "b" or filename == "B":
-                filename = "barricade.txt"
-            elif filename == "f" or filename == "F":
-                filename = "fortress.txt"
-            elif filename == "p" or filename == "P":
-                filename = "portals.txt"
-
-            self.size = 15 # overwritten if indicated in map file
-            self.maxHealth = 10 # also overwritten
-            self.barrels = set()
-            self.walls = set()
-            self.portals = set()
-            self.topLeftMirrors = set()
-            self.topRightMirrors = set()
-            self.spawns = []
-            isMap = False #flag to determine if reading map
-            r = 0 #current row in map
-            c = 0 #current col in map
-
-            for line in open(filename):
+            filename = mapFile(filename) #builtin maps
+
+            if chunks:
+                self.chunks = terrain.Terrain(filename, chunks, \
+                    lambda: (self.p1, self.p2))
+                settings = self.chunks.settings
+                self.size = self.chunks.size
+                self.maxHealth = settings.get("MAXHEALTH", 10)
+                self.burnTime = settings.get("FIRE", 0)
+                self.barrels = self.chunks.barrels
+                self.walls = terrain.TileSet(self.chunks, (terrain.WALL,))
+                self.portals = self.chunks.portals
+                self.topLeftMirrors = terrain.TileSet(self.chunks, \
+                    (terrain.TOP_LEFT,))
+                self.topRightMirrors = terrain.TileSet(self.chunks, \
+                    (terrain.TOP_RIGHT,))
+                self.portalChannels = self.chunks.portalChannels
+                self.spawns = self.chunks.spawns
+            else:
+                self.size = 15 # overwritten if indicated in map file
+                self.maxHealth = 10 # also overwritten
+                self.burnTime = 0 # also overwritten
+                self.barrels = set()
+                self.walls = set()
+                self.portals = set()
+                self.topLeftMirrors = set()
+                self.topRightMirrors = set()
+                self.portalChannels = {}
+                self.spawns = []
+                isMap = False #flag to determine if reading map
+                r = 0 #current row in map
+
+                if lines is None:
+                    lines = open(filename)
+                for line in lines:
                     
-                if isMap:
-                    if len(line.split()) != 0:
-                        c = 0
-                        for char in line:
-                            if char == "O":
-                                self.barrels.add((r,c))
-                            elif char == "#":
-                                self.walls.add((r,c))
-                            elif char == "?":
-                                self.portals.add((r,c))
-                            elif char == "/":
-                                self.topLeftMirrors.add((r,c))
-                            elif char == "\\":
-                                self.topRightMirrors.add((r,c))
-                            elif char == "S":
-                                self.spawns.append((r,c)) #spawns are a list
-                            c += 1
-                    r += 1
-
-                elif len(line.split()) != 0:
-                    if line.split()[0] == "MAP":
-                        isMap = True
-                    elif line.split()[0] == "SIZE":
-                        self.size = int(line.split()[1])
-                    elif line.split()[0] == "MAXHEALTH":
-                        self.maxHealth = int(line.split()[1])
+                    if isMap:
+                        for tile in TILES.finditer(line): #skips empty space
+                            char = tile.group()
+                            c = tile.start()
+                            if r >= self.size or c >= self.size:
+                                break #off the board
+                            self.addTile(r * self.size + c, char)
+                        r += 1
+
+                    elif len(line.split()) != 0:
+                        if line.split()[0] == "MAP":
+                            isMap = True
+                        elif line.split()[0] == "SIZE":
+                            self.size = int(line.split()[1])
+                        elif line.split()[0] == "MAXHEALTH":
+                            self.maxHealth = int(line.split()[1])
+                        elif line.split()[0] == "FIRE":
+                            self.burnTime = int(line.split()[1])
 
         #applies to all boards     
-        self.p1d = 0
-        self.p2d = 0
-        self.p1h = self.maxHealth
-        self.p2h = self.maxHealth
-        self.allOccupiedSpaces = self.barrels | self.walls | self.portals | self.topLeftMirrors | self.topRightMirrors
-        self.listOfPortals = list(self.portals)
-        self.curBarrels = set()
+        self.entities = Components((BARREL,))
+        self.entities.add(TANK, NONE, 0, self.maxHealth, 1) # TANK1
+        self.entities.add(TANK, NONE, 0, self.maxHealth, 2) # TANK2
+        self.entities.add(BULLET, NONE) # SHOT, off the board between shots
+        if self.chunks:
+            self.allOccupiedSpaces = terrain.TileSet(self.chunks, \
+                (terrain.WALL, terrain.TOP_LEFT, terrain.TOP_RIGHT), \
+                (self.barrels, self.portals))
+            self.steps = terrain.neighbors(self.size)
+            self.keys = zobrist.lazyCellKeys(self.size)
+        else:
+            self.allOccupiedSpaces = self.barrels | self.walls | self.portals | self.topLeftMirrors | self.topRightMirrors
+            self.steps = neighbors(self.size)
+            self.keys = zobrist.cellKeys(self.size)
+        self.linkPortals()
+        self.rays = {}
+        self.sight = None
+        self.viewers = ()
+        self.shown = None
+        self.fire = [0] * self.burnTime
+        self.burning = set()
+        self.openBits = 0
+        if self.burnTime:
+            self.openBits = bitboard.full(self.size) & \
+                ~bitboard.fromCells(self.walls, self.size)
         self.f = set()
-        self.b = (-1,-1)
-        self.p1 = (-1,-1)
-        self.p2 = (-1,-1)
         self.barrelLimit = 0
-        # Above 3 structures are lists because they change during gameplay
+        self.zobrist = 0
+        self.fireKey = 0
+        self.frameDue = 0
+        self.renderer = renderer if renderer is not None else AnsiRenderer()
+        self.rng = SplitMix64(seed)
         self.reset() # Sets f, b, curBarrels, and players to default
 
+    def addTile(self, cell, char):
+        """
+        Puts a map character on a cell of the map being read.
+
+            cell -> int -> cell id
+            char -> string of length 1 -> map character, see TILES
+        """
+        if char == "O":
+            self.barrels.add(cell)
+        elif char == "#":
+            self.walls.add(cell)
+        elif char == "?":
+            self.portals.add(cell)
+        elif char.isdigit(): #portal on a numbered channel
+            self.portals.add(cell)
+            self.portalChannels[cell] = char
+        elif char == "/":
+            self.topLeftMirrors.add(cell)
+        elif char == "\\":
+            self.topRightMirrors.add(cell)
+        elif char == "S":
+            self.spawns.append(cell) #spawns are a list
+
+    def patch(self, changes):
+        """
+        Changes some cells of the map in place, e.g. when the map file is
+        edited during a match (see hotreload.py), and updates only what is
+        derived from them: cached bullet paths through them, portal links,
+        lines of sight and bitboards. Barrels added to or removed from the
+        map are added to or removed from the board; tanks, bullets and fire
+        stay where they are. Raises ValueError on chunked maps.
+
+            changes -> {int: char} dict -> new map character of each cell
+                that changed, " " for empty
+        """
+        if self.chunks is not None:
+            raise ValueError("chunked maps can't be patched")
+        channels = set() # portal channels that changed
+        live = self.entities.places[BARREL]
+        for cell, char in changes.items():
+            if cell in self.portals:
+                channels.add(self.portalChannels.get(cell, "?"))
+            for cells in (self.barrels, self.walls, self.portals, \
+                    self.topLeftMirrors, self.topRightMirrors, \
+                    self.allOccupiedSpaces):
+                cells.discard(cell)
+            self.portalChannels.pop(cell, None)
+            if cell in self.spawns:
+                self.spawns.remove(cell)
+            self.addTile(cell, char)
+            if char in "#?/\\O" or char.isdigit():
+                self.allOccupiedSpaces.add(cell)
+            if cell in self.portals:
+                channels.add(self.portalChannels.get(cell, "?"))
+            if char == "O" and cell not in live:
+                self.entities.add(BARREL, cell)
+                self.zobrist ^= self.keys[2][cell]
+            elif char != "O" and cell in live:
+                self.entities.remove(live[cell])
+                self.zobrist ^= self.keys[2][cell]
+        self.spawns.sort() # as read, row by row
+        if channels:
+            self.linkPortals(channels)
+            self.rays = {} # any path may cross a portal
+        else:
+            changed = set(changes)
+            self.rays = {key: ray for key, ray in self.rays.items() \
+                if changed.isdisjoint(ray[0])}
+        if self.sight is not None:
+            self.sight.patch(self, changes)
+        self.shown = None
+        if self.layers is not None:
+            self.layers.patch(self, changes, bool(channels))
+        if self.burnTime:
+            bits = bitboard.fewCells(changes, self.size)
+            self.openBits = (self.openBits | bits) & \
+                ~bitboard.fewCells(self.walls & changes.keys(), self.size)
+
+    @property
+    def p1(self):
+        return self.entities.position[TANK1]
+
+    @p1.setter
+    def p1(self, space):
+        self.entities.position[TANK1] = space
+
+    @property
+    def p1d(self):
+        return self.entities.direction[TANK1]
+
+    @p1d.setter
+    def p1d(self, direction):
+        self.entities.direction[TANK1] = direction
+
+    @property
+    def p1h(self):
+        return self.entities.health[TANK1]
+
+    @p1h.setter
+    def p1h(self, health):
+        self.entities.health[TANK1] = health
+
+    @property
+    def p2(self):
+        return self.entities.position[TANK2]
+
+    @p2.setter
+    def p2(self, space):
+        self.entities.position[TANK2] = space
+
+    @property
+    def p2d(self):
+        return self.entities.direction[TANK2]
+
+    @p2d.setter
+    def p2d(self, direction):
+        self.entities.direction[TANK2] = direction
+
+    @property
+    def p2h(self):
+        return self.entities.health[TANK2]
+
+    @p2h.setter
+    def p2h(self, health):
+        self.entities.health[TANK2] = health
+
+    @property
+    def b(self):
+        return self.entities.position[SHOT]
+
+    @b.setter
+    def b(self, space):
+        self.entities.position[SHOT] = space
+
+    @property
+    def curBarrels(self):
+        return self.entities.places[BARREL].keys()
+
     def __str__(self):
         """
         Returns a printout of the board. Use board.refresh() for gameplay.
@@ -140,51 +445,12 @@ class Board():
         result = "##" + "##" * self.size  + "\n" #top border
         for r in range(self.size):
             result += "#" #left side border
-            for c in range(self.size):
-
-                if (r,c) == self.b:
-                    result += "\033[1;33m*\033[1;0m"
-                elif (r,c) in self.f:
-                    result += "\033[1;31m%\033[1;0m"
-                    
-                elif (r,c) == self.p1:
-                    if self.p1d == 0:
-                        result += "\033[1;32m^\033[1;0m"
-                    elif self.p1d == 1:
-                        result += "\033[1;32m<\033[1;0m"
-                    elif self.p1d == 2:
-                        result += "\033[1;32mV\033[1;0m"
-                    elif self.p1d == 3:
-                        result += "\033[1;32m>\033[1;0m"
-
-                elif (r,c) == self.p2:
-                    if self.p2d == 0:
-                        result += "\033[1;36m^\033[1;0m"
-                    elif self.p2d == 1:
-                        result += "\033[1;36m<\033[1;0m"
-                    elif self.p2d == 2:
-                        result += "\033[1;36mV\033[1;0m"
-                    elif self.p2d == 3:
-                        result += "\033[1;36m>\033[1;0m"
-
-                elif (r,c) in self.curBarrels:
-                    result += "\033[1;31mO\033[1;0m"
-
-                elif (r,c) in self.allOccupiedSpaces:
-                    if (r,c) in self.walls:
-                        result += "#"
-                    elif (r,c) in self.portals:
-                        result += "\033[1;35m?\033[1;0m"
-                    elif (r,c) in self.topLeftMirrors:
-                        result += "\033[1;35m/\033[1;0m"
-                    elif (r,c) in self.topRightMirrors:
-                        result += "\033[1;35m\\\033[1;0m"
-                    else:
-                        result += " " # Barrel has already exploded
-
+            for cell in range(r * self.size, (r + 1) * self.size):
+                char, color = self.glyph(cell)
+                if color:
+                    result += "\033[1;%dm%s\033[1;0m" % (color, char)
                 else:
-                    result += " "
-
+                    result += char
                 result += " " #widens board
             result += "#\n" #right side border
         result += "##" * self.size + "##" #bottom border
@@ -194,6 +460,79 @@ class Board():
 
         return result
 
+    def glyph(self, space):
+        """
+        Returns what to draw on a space as a (char, color) tuple, where color
+        is an ANSI color code (0 for plain). Shared by all renderers.
+
+            space -> int -> cell to draw
+        """
+        if self.viewers and space not in self.visibleSpaces():
+            char, color = self.terrain(space)
+            return (char, color) if char != " " else (".", 0) # fog
+        elif space == self.b:
+            return "*", 33
+        elif space in self.f or space in self.burning:
+            return "%", 31
+        elif space == self.p1:
+            return "^<V>"[self.p1d], 32
+        elif space == self.p2:
+            return "^<V>"[self.p2d], 36
+        elif space in self.curBarrels:
+            return "O", 31
+        return self.terrain(space)
+
+    def terrain(self, space):
+        """
+        Returns the (char, color) of what never moves on a space, as glyph().
+
+            space -> int -> cell to draw
+        """
+        if space in self.allOccupiedSpaces:
+            if space in self.walls:
+                return "#", 0
+            elif space in self.portals:
+                return self.portalChannels.get(space, "?"), 35
+            elif space in self.topLeftMirrors:
+                return "/", 35
+            elif space in self.topRightMirrors:
+                return "\\", 35
+        return " ", 0 # empty, or barrel has already exploded
+
+    def setFog(self, viewers):
+        """
+        Turns fog of war on or off. With fog, spaces that none of the viewers'
+        tanks can see only show walls, portals and mirrors.
+
+            viewers -> iterable of ints -> players whose sight is drawn
+                (empty for no fog)
+        """
+        self.viewers = tuple(viewers)
+        self.shown = None
+
+    def visibleTo(self, player):
+        """
+        Returns the spaces a player's tank can see, as a frozenset.
+
+            player -> int -> number of the player (1 or 2)
+        """
+        if self.sight is None:
+            self.sight = FieldOfView(self)
+        if player == 1:
+            return self.sight.view(self.p1, self.p1d)
+        return self.sight.view(self.p2, self.p2d)
+
+    def visibleSpaces(self):
+        """
+        Returns the spaces any of the viewers can see, as a frozenset.
+        Only recomputed when a tank has moved or turned.
+        """
+        key = (self.p1, self.p1d, self.p2, self.p2d)
+        if self.shown is None or self.shown[0] != key:
+            self.shown = (key, frozenset().union(*(self.visibleTo(player) \
+                for player in self.viewers)))
+        return self.shown[1]
+
     def turn(self, char):
         """
         Updates the data structure based on the character used.
@@ -202,155 +541,217 @@ class Board():
 
             char -> string of length 1 -> key pressed ('w' moves p1 up, etc.)
         """
-        #PLAYER 1 MOVES
-        if char == "w":#up
-            self.p1d = 0
-            newSpace = self.nextSpace(self.p1, self.p1d)
-            if not self.isCollision(newSpace):
-                self.p1 = newSpace
-                if self.isPortal(self.p1):
-                    self.p1 = self.teleport(self.p1)
-        elif char == "a":#left
-            self.p1d = 1
-            newSpace = self.nextSpace(self.p1, self.p1d)
-            if not self.isCollision(newSpace):
-                self.p1 = newSpace
-                if self.isPortal(self.p1):
-                    self.p1 = self.teleport(self.p1)
-        elif char == "s":#down
-            self.p1d = 2
-            newSpace = self.nextSpace(self.p1, self.p1d)
-            if not self.isCollision(newSpace):
-                self.p1 = newSpace
-                if self.isPortal(self.p1):
-                    self.p1 = self.teleport(self.p1)
-        elif char == "d":#right
-            self.p1d = 3
-            newSpace = self.nextSpace(self.p1, self.p1d)
-            if not self.isCollision(newSpace):
-                self.p1 = newSpace
-                if self.isPortal(self.p1):
-                    self.p1 = self.teleport(self.p1)
-
-        #PLAYER 2 MOVES
-        elif char == "o":#up
-            self.p2d = 0
-            newSpace = self.nextSpace(self.p2, self.p2d)
-            if not self.isCollision(newSpace):
-                self.p2 = newSpace
-                if self.isPortal(self.p2):
-                    self.p2 = self.teleport(self.p2)
-        elif char == "k":#left
-            self.p2d = 1
-            newSpace = self.nextSpace(self.p2, self.p2d)
-            if not self.isCollision(newSpace):
-                self.p2 = newSpace
-                if self.isPortal(self.p2):
-                    self.p2 = self.teleport(self.p2)
-        elif char == "l":#down
-            self.p2d = 2
-            newSpace = self.nextSpace(self.p2, self.p2d)
-            if not self.isCollision(newSpace):
-                self.p2 = newSpace
-                if self.isPortal(self.p2):
-                    self.p2 = self.teleport(self.p2)
-        elif char == ";":#right
-            self.p2d = 3
-            newSpace = self.nextSpace(self.p2, self.p2d)
-            if not self.isCollision(newSpace):
-                self.p2 = newSpace
-                if self.isPortal(self.p2):
-                    self.p2 = self.teleport(self.p2)
+        #PLAYER MOVES
+        if char in MOVES:
+            player, direction = MOVES[char]
+            tank = player - 1 # TANK1 or TANK2
+            entities = self.entities
+            entities.direction[tank] = direction
+            entities.position[tank] = self.move(entities.position[tank], \
+                direction)
 
         #IF FIRE KEY PRESSED
         elif char == 'f':
-            self.shoot(self.p1, self.p1d)
+            self.shoot(self.p1, self.p1d, 1)
         elif char == "'":
-            self.shoot(self.p2, self.p2d)
+            self.shoot(self.p2, self.p2d, 2)
 
         #IF BARREL KEY PRESSED
         elif char == 'r':
-            self.addBarrel(self.p1)
+            self.addBarrel(self.p1, 1)
         elif char == '[':
-            self.addBarrel(self.p2)
+            self.addBarrel(self.p2, 2)
+
+        #FIRE TICK (not a player key)
+        elif char == BURN:
+            self.burn()
+
+    def move(self, start, direction):
+        """
+        Returns where a tank moving from start ends up: one step in the
+        direction (through a portal if there is one), or start if blocked.
+
+            start -> int -> cell of the tank
+            direction -> int -> direction of movement (N-W-S-E) = (0-1-2-3)
+        """
+        space = self.steps[direction][start]
+        if space == NONE or space in self.walls:
+            return start
+        if space in self.portals:
+            return self.teleport(space)
+        return space
 
     def nextSpace(self, start, direction):
         """
         Returns the space that is one step in indicated direction.
 
-            start -> (r,c) tuple -> starting location
+            start -> int -> starting cell
             direction -> int -> direction of movement (N-W-S-E) = (0-1-2-3)
         """
-        if start != (-1,-1):
-            if direction == 0:
-                return (start[0] - 1, start[1])
-            elif direction == 1:
-                return (start[0], start[1] - 1)
-            elif direction == 2:
-                return (start[0] + 1, start[1])
-            elif direction == 3:
-                return (start[0], start[1] + 1)
+        if start != NONE:
+            return self.steps[direction][start]
         return start
 
-    def teleport(self, start):
+    def cell(self, r, c):
         """
-        Returns a portal location that is different from the start location.
+        Returns the cell id of a row and column (NONE if off the board).
 
-            start -> (r,c) tuple -> location of starting portal
+            r, c -> int -> row and column
         """
-        result = start
-        if len(self.portals) > 1:
-            while result == start:
-                result = self.listOfPortals[int(random.random() \
-                                            * len(self.portals))]
-        return result
+        if 0 <= r < self.size and 0 <= c < self.size:
+            return r * self.size + c
+        return NONE
 
-    def shoot(self, start, direction):
+    def coords(self, cell):
         """
-        Shoots a bullet. If it hits a wall or the edge of the board, it stops.
-        It if hits a barrel, the barrel explodes and the bullet stops.
-        If it hits a player, the player gets hit and the bullet stops.
+        Returns the (r,c) tuple of a cell id ((-1,-1) for NONE).
 
-            start -> (r,c) tuple -> location of bullet's start point
-            direction -> int -> direction of movement (N-E-W-S) = (0-1-2-3)
+            cell -> int -> cell id
         """
-        self.b = start
-        timeToPrint = True
+        if cell == NONE:
+            return (-1,-1)
+        return divmod(cell, self.size)
 
-        while not self.isCollision(self.b):
-            newSpace = self.nextSpace(self.b, direction)
+    def linkPortals(self, changed=None):
+        """
+        Precomputes where portals lead: one sorted list of portals per
+        channel, every portal leads to the others on its own. Two portals
+        with the same digit make a pair.
+
+            changed -> set of chars -> channels to link again, after
+                patch() (None links every portal)
+        """
+        channels = {}
+        for space in self.portals:
+            channel = self.portalChannels.get(space, "?")
+            if changed is None or channel in changed:
+                channels.setdefault(channel, []).append(space)
+        if changed is None:
+            self.portalLinks = {}
+        else:
+            for channel in changed:
+                self.portalLinks.pop(channel, None)
+        for channel, portals in channels.items():
+            self.portalLinks[channel] = tuple(sorted(portals))
 
-            if not self.isCollision(self.b):
-                self.b = newSpace
+    def exits(self, portal):
+        """
+        Returns the number of places a portal leads to.
 
-                if timeToPrint: #print half the time to lower lag
-                    self.refresh()
-                timeToPrint = not timeToPrint
+            portal -> int -> cell of the portal
+        """
+        return len(self.portalLinks.get(self.portalChannels.get(portal, \
+            "?"), ())) - 1
 
-                if self.isBarrel(self.b):
-                    self.explode(self.b)
+    def teleport(self, start):
+        """
+        Returns a destination of the portal at start (start itself if it
+        leads nowhere). One draw from the board's RNG, none for pairs.
+
+            start -> int -> cell of starting portal
+        """
+        portals = self.portalLinks.get(self.portalChannels.get(start, "?"), ())
+        if len(portals) < 2 or start not in self.portals:
+            return start
+        here = bisect.bisect_left(portals, start)
+        if len(portals) == 2:
+            return portals[1 - here]
+        there = int(self.rng.random() * (len(portals) - 1))
+        return portals[there + (there >= here)] # skips start
+
+    def ray(self, start, direction):
+        """
+        Returns the path of a bullet leaving start as a (cells, direction,
+        portal) tuple: the cells it enters in order, its direction after the
+        last one, and whether it stops at a portal with several destinations
+        (otherwise it ends in a wall, off the board or in an endless mirror
+        loop). Paths only depend on walls, mirrors and portals, so they're
+        cached. Portals with one destination are crossed without stopping.
+
+            start -> int -> cell the bullet leaves from
+            direction -> int -> direction of movement (N-W-S-E) = (0-1-2-3)
+        """
+        key = (start, direction)
+        if key in self.rays:
+            return self.rays[key]
+
+        cells = []
+        seen = set()
+        space = start
+        portal = False
+        while (space, direction) not in seen:
+            seen.add((space, direction))
+            space = self.nextSpace(space, direction)
+            cells.append(space)
+            if self.isCollision(space):
+                break
+            if self.isPortal(space):
+                if self.exits(space) > 1:
+                    portal = True
                     break
+                space = self.teleport(space)
+            if self.isMirror(space):
+                direction = self.reflect(direction, self.isTopLeftMirror(space))
 
-                if self.isPlayer1(self.b) or self.isPlayer2(self.b):
-                    if self.isPlayer1(self.b) and self.isPlayer2(self.b):
-                        self.hitBothPlayers()
-                        break
-                    if self.isPlayer1(self.b):
-                        self.hit(1)
-                        break
-                    else:
-                        self.isPlayer2(self.b)
-                        self.hit(2)
-                        break
+        if self.chunks and len(self.rays) >= terrain.RAYS:
+            self.rays.clear() # bounded memory on huge maps
+        self.rays[key] = (tuple(cells), direction, portal)
+        return self.rays[key]
 
-                if self.isPortal(self.b): #teleporting bullets
-                    self.b = self.teleport(self.b)
+    def shoot(self, start, direction, owner=0):
+        """
+        Shoots a bullet. If it hits a wall or the edge of the board, it stops.
+        It if hits a barrel, the barrel explodes and the bullet stops.
+        If it hits a player, the player gets hit and the bullet stops.
+        The bullet follows cached rays, so only barrels and players are
+        checked on the way.
 
-                if self.isMirror(self.b):
-                    direction = self.reflect(direction, self.isTopLeftMirror(self.b))
+            start -> int -> cell of bullet's start point
+            direction -> int -> direction of movement (N-E-W-S) = (0-1-2-3)
+            owner -> int -> number of the player shooting (0 = nobody)
+        """
+        entities = self.entities
+        entities.owner[SHOT] = owner
+        entities.lifetime[SHOT] = 4 * self.size * self.size # portal loops
+            # end eventually
+        space = start
+        while True:
+            cells, direction, portal = self.ray(space, direction)
+            entities.direction[SHOT] = direction
+            for cell in cells:
+                entities.position[SHOT] = cell
+                self.refresh(False) #skipped if the terminal is lagging
+                if self.bulletHits(cell):
+                    self.resetBullet()
+                    return
+            entities.lifetime[SHOT] -= len(cells)
+            if not portal or entities.lifetime[SHOT] <= 0:
+                break
+            space = self.teleport(cells[-1]) #teleporting bullets
 
         self.resetBullet()
 
+    def bulletHits(self, space):
+        """
+        Explodes a barrel or hits players at the bullet's location. Returns
+        true if the bullet stops there.
+
+            space -> int -> cell of the bullet
+        """
+        if self.isBarrel(space):
+            self.explode(space)
+            return True
+
+        if self.isPlayer1(space) or self.isPlayer2(space):
+            if self.isPlayer1(space) and self.isPlayer2(space):
+                self.hitBothPlayers()
+            elif self.isPlayer1(space):
+                self.hit(1)
+            else:
+                self.hit(2)
+            return True
+        return False
+
     def reflect(self, direction, mirrorType):
         """
         Given a direction and mirrorType, produces a new direction.
@@ -385,23 +786,30 @@ class Board():
         except there's 9 of them, spreading in a cross of length two.
         Note: queue structure avoid issues with recursion. 
 
-            start -> (r,c) tuple -> location of original barrel/explosion
+            start -> int -> cell of original barrel/explosion
         """
 
-        self.curBarrels.remove(start)
+        barrels = self.entities.places[BARREL]
+        self.entities.remove(barrels[start])
+        self.zobrist ^= self.keys[2][start]
         explosions = list([start])
 
         while explosions != []:
 
             cur = explosions.pop(0)
-            self.flameOut(cur)
-
-            for f in self.f:
-                if self.isBarrel(f):
+            flames = self.flameOut(cur)
+            if self.burnTime:
+                self.ignite(self.f)
+
+            position = self.entities.position
+            tanks = (position[TANK1], position[TANK2])
+            for f in flames: #in a fixed order, nearest first
+                if f in barrels:
                     explosions.append(f)
-                    self.curBarrels.remove(f)
+                    self.entities.remove(barrels[f])
+                    self.zobrist ^= self.keys[2][f]
 
-                if self.isPlayer1(f) or self.isPlayer2(f):
+                if f in tanks:
                     if self.isPlayer1(f) and self.isPlayer2(f):
                         self.hitBothPlayers()
                         explosions = []
@@ -415,103 +823,219 @@ class Board():
                         explosions = []
                         break
 
-            self.refresh()
+            self.refresh(explosions == []) #last step of the chain is final
             self.resetFlames()
                     
-    def flameOut(self, start):
+    def ignite(self, cells):
         """
-        Moves the position of the flames (for use in explode).
+        Sets cells on fire for burnTime ticks (see burn). Only the newest
+        fire bitboard changes, so only its part of fireKey is hashed again.
 
-            start -> (r,c) tuple -> location of original barrel/explosion
+            cells -> collection of ints -> cells to set on fire (a few,
+                e.g. an explosion's flames)
         """
-        self.f = [None] * 9
+        top = self.fire[-1]
+        lit = top | bitboard.fewCells(cells, self.size) & self.openBits
+        if lit != top:
+            level = len(self.fire) - 1
+            self.fireKey ^= zobrist.layerKey(level, top) ^ \
+                zobrist.layerKey(level, lit)
+            self.fire[-1] = lit
+        self.burning.update(cell for cell in cells if cell != NONE)
+
+    def burn(self):
+        """
+        Advances fire by one tick, as a cellular automaton over the whole
+        board: fire with 3+ ticks left spreads to its open neighbours with 2
+        ticks less, then every fire loses a tick. Barrels in fire explode
+        and players in fire get hit.
+        """
+        if not self.burning:
+            return
+        fire = self.fire
+        allFire = 0
+        for layer in fire:
+            allFire |= layer
+        for k in range(2, len(fire)):
+            if fire[k]:
+                fire[k - 2] |= bitboard.dilate(fire[k], self.size) & \
+                    self.openBits & ~allFire
+        fire.pop(0)
+        fire.append(0)
+
+        allFire = 0
+        for layer in fire:
+            allFire |= layer
+        self.burning = set(bitboard.toCells(allFire, self.size))
+        self.fireKey = zobrist.fireKey(self.fire)
+
+        entities = self.entities
+        rows = entities.within(self.burning) # barrels and tanks in fire
+        health = (self.p1h, self.p2h)
+        for barrel in sorted(entities.position[row] for row in rows \
+                if entities.kind[row] == BARREL):
+            if (self.p1h, self.p2h) != health:
+                return # somebody got hit, the board was reset
+            if self.isBarrel(barrel):
+                self.explode(barrel)
+        if (self.p1h, self.p2h) != health:
+            return
+
+        if TANK1 in rows and TANK2 in rows: # rows of tanks never move
+            self.hitBothPlayers()
+        elif TANK1 in rows:
+            self.hit(1)
+        elif TANK2 in rows:
+            self.hit(2)
+
+    def resetFire(self):
+        """
+        Puts out all fire.
+        """
+        self.fire = [0] * self.burnTime
+        self.burning = set()
+        self.fireKey = 0
 
-        self.f[0] = start
-        self.f[1] = self.nextSpace(start, 0)
-        self.f[2] = self.nextSpace(start, 1)
-        self.f[3] = self.nextSpace(start, 2)
-        self.f[4] = self.nextSpace(start, 3)
-        
+    def flameOut(self, start):
+        """
+        Moves the position of the flames (for use in explode). Returns them
+        as a list, nearest first (start, then one and two cells out N-W-S-E).
+
+            start -> int -> cell of original barrel/explosion
+        """
+        flames = [start] + [step[start] for step in self.steps]
         for i in range(5):
-            if self.isCollision(self.f[i]):
-                self.f[i] = (-1,-1)
+            if self.isCollision(flames[i]):
+                flames[i] = NONE
 
-        self.f[5] = self.nextSpace(self.f[1], 0)
-        self.f[6] = self.nextSpace(self.f[2], 1)
-        self.f[7] = self.nextSpace(self.f[3], 2)
-        self.f[8] = self.nextSpace(self.f[4], 3)
-        
+        for i, step in enumerate(self.steps, 1):
+            space = flames[i]
+            flames.append(step[space] if space != NONE else NONE)
         for i in range(5,9):
-            if self.isCollision(self.f[i]):
-                self.f[i] = (-1,-1)
+            if self.isCollision(flames[i]):
+                flames[i] = NONE
 
-        self.f = set(self.f)
+        self.f = set(flames)
+        return flames
         
     def resetFlames(self):
         """
         Resets all flames to their default position.
         """
-        self.f = [None] * 9
-        for i in range(9):
-            self.f[i] = (-1,-1)
+        self.f = [NONE] * 9
 
     def resetBullet(self):
         """
         Resets the bullet to its default position.
         """
-        self.b = [-1,-1]
+        self.entities.position[SHOT] = NONE
 
     def resetPlayers(self):
         """
         Resets players to spawn points. If spawns are invalid, places randomly.
+        Tanks don't start in each other's danger maps (see danger.py) unless
+        there's no other choice; chunked maps, too big for bitboards, skip
+        that. Call it after the barrels are reset.
         """
+        checked = self.chunks is None
         if len(self.spawns) >= 2:
-            self.p1 = self.spawns[int(random.random() * len(self.spawns))]
-            self.p2 = self.spawns[int(random.random() * len(self.spawns))]
+            self.p1 = self.spawns[int(self.rng.random() * len(self.spawns))]
+            self.p2 = self.spawns[int(self.rng.random() * len(self.spawns))]
             while self.p1 == self.p2:
-                self.p2 = self.spawns[int(random.random() * len(self.spawns))]
+                self.p2 = self.spawns[int(self.rng.random() * len(self.spawns))]
+            if checked:
+                barrels, chains, threat = self.spawnDanger()
+                if not danger.safe(self, self.p1, self.p2, barrels, chains, \
+                        threat):
+                    safe = [spawn for spawn in self.spawns if spawn != \
+                        self.p1 and danger.safe(self, self.p1, spawn, \
+                        barrels, chains, threat)]
+                    if safe:
+                        self.p2 = safe[int(self.rng.random() * len(safe))]
 
         else: #Places in two random unoccupied spaces
+            self.p1 = self.randomSpace()
+            if checked:
+                barrels, chains, threat = self.spawnDanger()
+            tries = 0
             while True:
-                self.p1 = (int(random.random() * self.size), \
-                int(random.random() * self.size))
-                self.p2 = (int(random.random() * self.size), \
-                int(random.random() * self.size))
-                
-                if self.p1 not in self.allOccupiedSpaces and self.p2 not in \
-                self.allOccupiedSpaces and not self.isPlayer1(self.p2):
+                self.p2 = self.randomSpace()
+                if self.p2 == self.p1:
+                    continue
+                tries += 1
+                if not checked or tries > SPAWN_TRIES or danger.safe(self, \
+                        self.p1, self.p2, barrels, chains, threat):
                     break
 
+    def spawnDanger(self):
+        """
+        Returns (barrels, chains, threat of p1), made once per reset for
+        the danger.safe() checks of every place tried for p2.
+        """
+        barrels = bitboard.fromCells(self.curBarrels, self.size)
+        chains = danger.chains(self, barrels)
+        return barrels, chains, danger.threat(self, self.p1, barrels, chains)
+
+    def randomSpace(self):
+        """
+        Returns a random unoccupied space.
+        """
+        while True:
+            space = int(self.rng.random() * self.size) * self.size + \
+                int(self.rng.random() * self.size)
+            if space not in self.allOccupiedSpaces:
+                return space
+
     def resetBarrels(self):
         """
         Resets barrels to their original positions.
         """
-        self.curBarrels = set(self.barrels)
+        self.setBarrels(self.barrels)
         self.barrelLimit = 5
 
-    def addBarrel(self, space):
+    def setBarrels(self, spaces):
+        """
+        Makes the live barrels exactly those on some spaces. Barrels that
+        stay keep their entities.
+
+            spaces -> set of ints -> cells that should have barrels
+        """
+        barrels = self.entities.places[BARREL]
+        for space in [space for space in barrels if space not in spaces]:
+            self.entities.remove(barrels[space])
+        self.entities.extend(BARREL, [space for space in spaces \
+            if space not in barrels])
+
+    def addBarrel(self, space, owner=0):
         """
         Adds a barrel to a board space.
+
+            space -> int -> cell to put it on
+            owner -> int -> number of the player laying it (0 = the map)
         """
         if self.barrelLimit > 0:
             if space not in self.allOccupiedSpaces:
-                self.curBarrels.add(space)
+                if space not in self.entities.places[BARREL]:
+                    self.entities.add(BARREL, space, owner=owner)
+                    self.zobrist ^= self.keys[2][space]
+                self.zobrist ^= zobrist.key(zobrist.BARREL_LIMIT, \
+                    self.barrelLimit) ^ zobrist.key(zobrist.BARREL_LIMIT, \
+                    self.barrelLimit - 1)
                 self.barrelLimit -= 1
         
     def isCollision(self, space):
         """
         Returns true if a space is not inside board and doesn't hit a wall.
 
-            space -> (r,c) tuple -> location to investigate
+            space -> int -> cell to investigate
         """
-        return not (space[0] >= 0 and space[1] >= 0 and space[0] < self.size \
-            and space[1] < self.size and not space in self.walls)
+        return space == NONE or space in self.walls
 
     def isPortal(self, space):
         """
         Returns true if a space is a portal.
 
-            space -> (r,c) tuple -> location to investigate
+            space -> int -> cell to investigate
         """
         return space in self.portals
 
@@ -519,7 +1043,7 @@ class Board():
         """
         Returns true if a space is a mirror.
 
-            space -> (r,c) tuple -> location to investigate
+            space -> int -> cell to investigate
         """
         return space in self.topLeftMirrors or space in self.topRightMirrors
 
@@ -527,7 +1051,7 @@ class Board():
         """
         Returns true if a space is a topLeftMirror.
 
-            space -> (r,c) tuple -> location to investigate
+            space -> int -> cell to investigate
         """
         return space in self.topLeftMirrors
 
@@ -535,31 +1059,32 @@ class Board():
         """
         Returns true if a space is an active barrel.
 
-            space -> (r,c) tuple -> location to investigate
+            space -> int -> cell to investigate
         """
-        return space in self.curBarrels
+        return space in self.entities.places[BARREL]
 
     def isPlayer1(self, space):
         """
         Returns true if a space has player 1.
 
-            space -> (r,c) tuple -> location to investigate
+            space -> int -> cell to investigate
         """
-        return space == self.p1
+        return space == self.entities.position[TANK1]
 
     def isPlayer2(self, space):
         """
         Returns true if a space has player 2.
 
-            space -> (r,c) tuple -> location to investigate
+            space -> int -> cell to investigate
         """
-        return space == self.p2
+        return space == self.entities.position[TANK2]
 
     def gameOver(self):
         """
         Returns true if a player has won.
         """
-        return self.p1h <= 0 or self.p2h <= 0
+        health = self.entities.health
+        return health[TANK1] <= 0 or health[TANK2] <= 0
 
     def winner(self):
         """
@@ -581,12 +1106,12 @@ class Board():
         self.refresh()
 
         if player == 1:
-            os.system("title " + "Tanks --- Player 1 sucks!")
-            input("\nPlayer one hit! (enter to continue)")
+            self.renderer.title("Tanks --- Player 1 sucks!")
+            self.renderer.pause("\nPlayer one hit! (enter to continue)")
             self.p1h -= 1
         elif player == 2:
-            os.system("title " + "Tanks --- Player 2 sucks!")
-            input("\nPlayer two hit! (enter to continue)")
+            self.renderer.title("Tanks --- Player 2 sucks!")
+            self.renderer.pause("\nPlayer two hit! (enter to continue)")
             self.p2h -= 1
 
         self.reset()
@@ -597,35 +1122,144 @@ class Board():
         """
         self.refresh()
 
-        os.system("title " + "Tanks --- Both players suck!")
-        input("\nBoth players hit! (enter to continue)")
+        self.renderer.title("Tanks --- Both players suck!")
+        self.renderer.pause("\nBoth players hit! (enter to continue)")
         self.p1h -= 1
         self.p2h -= 1
         self.reset()
 
+    def snapshot(self):
+        """
+        Returns everything that changes during a match as a flat tuple of
+        small values. Map data is left out, so restoring only works on the
+        board the snapshot came from (or one loaded from the same map).
+        Barrel owners are kept but not hashed: they don't change the game.
+        Changing the layout needs a new replay log version (replay.py keeps
+        keyframes).
+        """
+        entities = self.entities
+        position, direction, health = entities.position, \
+            entities.direction, entities.health
+        owners = entities.owners[BARREL]
+        return (position[TANK1], direction[TANK1], health[TANK1], \
+            position[TANK2], direction[TANK2], health[TANK2], \
+            position[SHOT], frozenset(self.f), \
+            frozenset(entities.places[BARREL]), \
+            frozenset(owners.items()) if owners else NO_OWNERS, \
+            self.barrelLimit, tuple(self.fire), frozenset(self.burning), \
+            self.zobrist, self.fireKey, self.rng.state)
+
+    def restore(self, snapshot):
+        """
+        Puts the board back into the state it had when snapshot() was called.
+
+            snapshot -> tuple -> value returned by snapshot()
+        """
+        entities = self.entities
+        (entities.position[TANK1], entities.direction[TANK1], \
+            entities.health[TANK1], entities.position[TANK2], \
+            entities.direction[TANK2], entities.health[TANK2], b, f, \
+            curBarrels, owners, self.barrelLimit, fire, burning, \
+            self.zobrist, self.fireKey, self.rng.state) = snapshot
+        entities.position[SHOT] = b
+        self.f = set(f)
+        if entities.places[BARREL].keys() != curBarrels:
+            self.setBarrels(curBarrels)
+        if (owners or entities.owners[BARREL]) and \
+                entities.owners[BARREL].items() != owners:
+            entities.setOwners(BARREL, owners)
+        self.fire = list(fire)
+        self.burning = set(burning)
+
+    def newMatch(self):
+        """
+        Starts a new match on the board: full health, tanks facing north,
+        and everything else as reset() leaves it.
+        """
+        self.p1h = self.p2h = self.maxHealth
+        self.p1d = self.p2d = 0
+        self.reset()
+
     def reset(self):
         """
-        Resets all aspect of the board.
+        Resets all aspect of the board (health aside, see newMatch()).
         """
-        self.resetPlayers()
         self.resetBullet()
         self.resetFlames()
+        self.resetFire()
         self.resetBarrels()
+        self.resetPlayers() # away from danger, which depends on the rest
+        self.rehash()
+
+    def rehash(self):
+        """
+        Recomputes the barrel and fire hashes from scratch (after reset();
+        otherwise they're updated as barrels and fire change).
+        """
+        h = zobrist.key(zobrist.BARREL_LIMIT, self.barrelLimit)
+        barrelKeys = self.keys[2]
+        for barrel in self.curBarrels:
+            h ^= barrelKeys[barrel]
+        self.zobrist = h
+        self.fireKey = zobrist.fireKey(self.fire)
+
+    def hash(self):
+        """
+        Returns a 64-bit hash of the board's state, in constant time. Equal
+        states (as snapshot() would see them between moves) hash the same.
+        Barrels and fire are hashed incrementally; players, health and the
+        RNG are a few fixed values, so their keys are looked up here rather
+        than on every move.
+        """
+        position, direction, health = self.entities.position, \
+            self.entities.direction, self.entities.health
+        return self.snapshotHash((position[TANK1], direction[TANK1], \
+            health[TANK1], position[TANK2], direction[TANK2], health[TANK2], \
+            self.zobrist, self.fireKey, self.rng.state))
+
+    def snapshotHash(self, snapshot):
+        """
+        Returns hash() of the board a snapshot was taken from, at that time.
 
-    def refresh(self):
+            snapshot -> tuple -> value returned by snapshot()
+        """
+        p1Keys, p2Keys = self.keys[0], self.keys[1]
+        return (p1Keys[snapshot[0]] if snapshot[0] != NONE else 0) ^ \
+            (p2Keys[snapshot[3]] if snapshot[3] != NONE else 0) ^ \
+            zobrist.DIRECTIONS[0][snapshot[1]] ^ \
+            zobrist.DIRECTIONS[1][snapshot[4]] ^ \
+            zobrist.key(zobrist.P1_HEALTH, snapshot[2]) ^ \
+            zobrist.key(zobrist.P2_HEALTH, snapshot[5]) ^ \
+            snapshot[-3] ^ snapshot[-2] ^ zobrist.key(zobrist.RNG, snapshot[-1])
+
+    def refresh(self, final=True):
         """
         Refreshes the game board. Call this after any movement.
+        Intermediate animation frames are paced to FRAME_TIME. If drawing
+        falls behind schedule or the terminal is still draining the last
+        frame, they are skipped (merged into a later frame). Final frames
+        are always drawn.
+
+            final -> boolean -> is this the last frame of an event?
         """
-        if _platform == "linux" or _platform == "linux2":
-            # linux
-            os.system('clear')
-        elif _platform == "darwin":
-            # OS X
-            pass
-        elif _platform == "win32":
-            os.system('cls')
+        if not final:
+            if not self.renderer.animate:
+                return #headless, nobody will see this frame
+            now = self.renderer.clock()
+            if self.frameDue == 0: #first frame of an animation
+                self.frameDue = now
+            due = self.frameDue
+            self.frameDue += FRAME_TIME
+            if now < due:
+                self.renderer.sleep(due - now)
+            elif now - due > FRAME_TIME:
+                return #behind schedule, skip this frame
+            if self.renderer.backlog() > 0:
+                return #terminal hasn't caught up yet, skip this frame
+        else:
+            self.frameDue = 0
 
-        print(self)
+        self.renderer.draw(self)
 
 class _Getch:
     """
@@ -633,7 +1267,10 @@ class _Getch:
     screen.
     """
     def __init__(self):
-        self.impl = _GetchWindows()
+        try:
+            self.impl = _GetchWindows()
+        except ImportError:
+            self.impl = _GetchUnix()
 
     def __call__(self): return self.impl()
 
@@ -645,30 +1282,70 @@ class _GetchWindows:
         import msvcrt
         return msvcrt.getch()
 
+class _GetchUnix:
+    def __init__(self):
+        import tty, termios
+
+    def __call__(self):
+        import tty, termios
+        fd = sys.stdin.fileno()
+        old_settings = termios.tcgetattr(fd)
+        try:
+            tty.setraw(fd)
+            return os.read(fd, 1) # bytes, like msvcrt.getch()
+        finally:
+            termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
+
 class InputThread(threading.Thread):
     """
     Thread to receive input.
     Limits each player's input to prevent lag, and "filters" input, 
     preventing invalid keystrokes from causing refreshes.
+    Moves are queued as (char, arrival time) tuples. Enter sets an event
+    instead, for renderers waiting on a message.
     """
-    __slots__ = ("get", "p1moves", "p2moves", "turn")
+    __slots__ = ("get", "p1moves", "p2moves", "turn", "stats", "enter")
 
-    def run(self):
-        self.get = _Getch()
+    def __init__(self, stats=None):
+        """
+            stats -> LatencyStats -> where to report key timings (optional)
+        """
+        threading.Thread.__init__(self)
         self.p1moves = []
         self.p2moves = []
+        self.stats = stats
+        self.enter = threading.Event()
+
+    def run(self):
+        self.get = _Getch()
         #self.turn = False
         if random.randrange(0,2) == 1: #picks initial turn randomly
             self.turn = True
 
         while True:
-            char = str(self.get())[-2] #get char from user
+            raw = self.get() #get char from user
+            if raw in (b"\r", b"\n"):
+                self.enter.set()
+                continue
+            char = str(raw)[-2]
+            arrived = time.perf_counter()
             if char in "wasdfr": #p1 moveset
                 if len(self.p1moves) < 2: #limits to 2 moves at a time
-                    self.p1moves.append(char)
+                    self.p1moves.append((char, arrived))
+                elif self.stats:
+                    self.stats.keyDropped(1)
             elif char in "okl;'[": #p2 moveset
                 if len(self.p2moves) < 3: #limits to 2 moves at a time
-                    self.p2moves.append(char)
+                    self.p2moves.append((char, arrived))
+                elif self.stats:
+                    self.stats.keyDropped(2)
+
+    def waitEnter(self):
+        """
+        Blocks until enter is pressed, ignoring any pressed before the call.
+        """
+        self.enter.clear()
+        self.enter.wait()
 
     def getMove(self):
         """
@@ -678,64 +1355,231 @@ class InputThread(threading.Thread):
         if self.turn: #checks p1 first if turn = true
             if self.p1moves != []:
                 self.turn = False
-                return self.p1moves.pop(0)
+                return self.take(1, self.p1moves)
             elif self.p2moves != []:
-                return self.p2moves.pop(0)
+                return self.take(2, self.p2moves)
         else:
             if self.p2moves != []:
                 self.turn = True
-                return self.p2moves.pop(0)
+                return self.take(2, self.p2moves)
             elif self.p1moves != []:
-                return self.p1moves.pop(0)
+                return self.take(1, self.p1moves)
         return None
 
-def splash():
+    def take(self, player, moves):
+        """
+        Removes and returns the oldest move of a player.
+
+            player -> int -> number of the player (1 or 2)
+            moves -> list -> the player's queue
+        """
+        char, arrived = moves.pop(0)
+        if self.stats:
+            self.stats.keyTaken(player, arrived)
+        return char
+
+def splash(library):
+    """
+    Prints the map menu.
+
+        library -> MapLibrary -> maps to list by number
+    """
     print("Welcome to tanks! Open a map file?\n")
     print("\033[1;33mF for <fortress>")
     print("\033[1;32mB for <barricade>")
     print("\033[1;35mP for <portals>")
     print("\033[1;31mW for <warzone>\033[1;0m")
+    maps = library.maps()
+    if maps:
+        print("\nMap library:")
+        for number, (name, entry) in enumerate(maps, 1):
+            print("%3d: %s" % (number, describe(entry)))
     print("\nOr, enter a custom map file name: (leave blank for default)\n")
 
+def chooseMap(library, choice):
+    """
+    Turns a menu choice into something Board() accepts: library numbers
+    become paths, anything else is passed through.
+
+        library -> MapLibrary -> maps listed by splash()
+        choice -> string -> what the user typed
+    """
+    maps = library.maps()
+    if choice.strip().isdigit() and 1 <= int(choice) <= len(maps):
+        return library.path(maps[int(choice) - 1][0])
+    return choice
+
 def main():
     """
     Call this to run the game.
     """
-    os.system("title " + "Tanks")
-    splash()
-
-    filename = input()
-    board = Board(filename)
-
-    board.refresh()
-
-    charGetter = InputThread()
-    charGetter.daemon = True 
-    charGetter.start()
-    charGetter.turn = False
-
-    keepGoing = True
-    while keepGoing:
-
-        move = charGetter.getMove()
-
-        if move != None:
-            board.turn(move)
-            board.refresh()
-
-            if board.gameOver():
-                keepGoing = False
-
-    if board.winner() == 1:
-        os.system("title " + "Player 1 wins!")
-        print("\nPlayer 1 wins!")
-    elif board.winner() == 2:
-        os.system("title " + "Player 2 wins!")
-        print("\nPlayer 2 wins!")
-    else:
-        os.system("title " + "Nobody wins!")
-        print("\nNobody wins!")
-
-    input("\nEnter to close...")
-
-main()
+    parser = argparse.ArgumentParser(description="Console-based tank game.")
+    parser.add_argument("--renderer", choices=sorted(RENDERERS), \
+        default="ansi", help="output backend (default: ansi)")
+    parser.add_argument("--seed", type=int, help="RNG seed (default: random)")
+    parser.add_argument("--log", metavar="FILE", \
+        help="write a replay log of the match")
+    parser.add_argument("--keyframes", type=int, default=KEYFRAME_INTERVAL, \
+        metavar="N", help="moves between keyframes of the replay log, " \
+        "0 for none (default: %(default)s)")
+    parser.add_argument("--record", metavar="FILE", \
+        help="stream the match to an asciicast v2 file")
+    parser.add_argument("--latency", metavar="FILE", help="measure input " \
+        "latency, report to FILE on exit and on SIGUSR1 (- for stderr)")
+    parser.add_argument("--fog", action="store_true", \
+        help="fog of war: only draw what the tanks can see")
+    parser.add_argument("--maps", metavar="DIR", \
+        default=os.path.dirname(os.path.abspath(__file__)), \
+        help="map library directory (default: the game's directory)")
+    parser.add_argument("--bot", type=int, choices=(1, 2), \
+        help="let the computer play this player")
+    parser.add_argument("--bot-time", type=float, default=BUDGET, \
+        metavar="S", help="bot's thinking time per move (default: %s)" % BUDGET)
+    parser.add_argument("--bot-workers", type=int, default=0, metavar="N", \
+        help="processes the bot searches with (default: 0, one thread)")
+    parser.add_argument("--results", metavar="DB", \
+        help="record the result in a SQLite database (see results.py)")
+    parser.add_argument("--names", default="Player 1,Player 2", \
+        help="players' names for --results (default: %(default)s)")
+    parser.add_argument("--chunks", type=int, default=0, metavar="N", \
+        help="read a huge map in chunks, at most N in memory (see terrain.py)")
+    parser.add_argument("--watch", action="store_true", help="patch the map " \
+        "into the match whenever its file is saved (see hotreload.py)")
+    args = parser.parse_args()
+    if args.watch and (args.chunks or args.log or args.bot_workers):
+        parser.error("--watch can't be used with --chunks, --log or " \
+            "--bot-workers")
+
+    renderer = RENDERERS[args.renderer]()
+    renderer.title("Tanks")
+    library = MapLibrary(args.maps)
+    splash(library)
+
+    filename = chooseMap(library, input())
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    board = Board(filename, renderer, seed, chunks=args.chunks)
+    if args.fog:
+        board.setFog((1, 2))
+    watcher = text = None
+    if args.watch and filename:
+        watcher = hotreload.MapWatcher(mapFile(filename))
+        text = hotreload.MapText(mapFile(filename))
+
+    try:
+        renderer.start()
+    except Exception as e: # e.g. no curses on this platform
+        print("Can't start the " + args.renderer + " renderer (" + str(e) + \
+            "), falling back to ansi.")
+        renderer.stop()
+        renderer = AnsiRenderer()
+    if args.record:
+        renderer = CastRecorder(args.record, renderer)
+        renderer.start()
+    stats = None
+    if args.latency:
+        stats = LatencyStats()
+        renderer = LatencyProbe(renderer, stats)
+        if hasattr(signal, "SIGUSR1"): # not on Windows
+            signal.signal(signal.SIGUSR1, lambda n, f: stats.dump(args.latency))
+    board.renderer = renderer
+    log = ReplayWriter(args.log, filename, seed, args.keyframes) \
+        if args.log else None
+    bot = None
+    if args.bot:
+        bot = BotPlayer(args.bot, filename, None, seed, args.bot_time, \
+            args.bot_workers)
+    results = ResultStore(args.results) if args.results else None
+    pressed = dict.fromkeys(PLAYER_KEYS[1] + PLAYER_KEYS[2], 0) # key -> times
+    started = time.perf_counter()
+
+    try:
+        board.refresh()
+
+        charGetter = InputThread(stats)
+        charGetter.daemon = True 
+        charGetter.start()
+        charGetter.turn = False
+        renderer.listen(charGetter)
+
+        nextBurn = renderer.clock() + FIRE_TICK
+        keepGoing = True
+        while keepGoing:
+
+            move = charGetter.getMove()
+
+            if watcher and watcher.changed():
+                changes = text.diff()
+                if changes is None:
+                    renderer.title("Restart to apply the map's new settings")
+                elif changes:
+                    board.patch(changes)
+                    if bot:
+                        bot.patch(changes)
+                    board.refresh()
+
+            if bot:
+                if move != None and move in PLAYER_KEYS[bot.player]:
+                    move = None # the bot's player ignores the keyboard
+                if move == None:
+                    move = bot.poll(board)
+                    if move == None:
+                        time.sleep(0.002) # don't starve the bot's thread
+
+            if move == None and board.burning and renderer.clock() >= nextBurn:
+                move = BURN # fire keeps its own time, between player moves
+            if not board.burning:
+                nextBurn = renderer.clock() + FIRE_TICK
+            elif move == BURN:
+                nextBurn += FIRE_TICK
+
+            if move != None:
+                if log:
+                    log.record(move, board.hash(), board)
+                if move in pressed:
+                    pressed[move] += 1
+                board.turn(move)
+                board.refresh()
+
+                if board.gameOver():
+                    keepGoing = False
+
+        if results:
+            names = (args.names.split(",") + ["Player 2"])[:2]
+            if bot:
+                names[bot.player - 1] = "bot"
+            players = []
+            for player, health in ((1, board.p1h), (2, board.p2h)):
+                keys = PLAYER_KEYS[player] # moves..., fire, barrel
+                players.append((names[player - 1], health, \
+                    sum(pressed[key] for key in keys), pressed[keys[4]], \
+                    pressed[keys[5]]))
+            results.record(filename, seed, board.winner(), \
+                time.perf_counter() - started, tuple(players))
+
+        if board.winner() == 1:
+            renderer.title("Player 1 wins!")
+            renderer.pause("\nPlayer 1 wins!\n\nEnter to close...")
+        elif board.winner() == 2:
+            renderer.title("Player 2 wins!")
+            renderer.pause("\nPlayer 2 wins!\n\nEnter to close...")
+        else:
+            renderer.title("Nobody wins!")
+            renderer.pause("\nNobody wins!\n\nEnter to close...")
+    finally:
+        if watcher:
+            watcher.close()
+        if log:
+            log.close()
+        renderer.stop()
+        if stats:
+            stats.dump(args.latency)
+        if bot:
+            bot.close()
+            print(bot.report())
+        if results:
+            results.close()
+
+if __name__ == "__main__":
+    init() #allows color printing
+    sys.stdout = sys.stderr #avoids buffering output
+    main()
@@ -0,0 +1,355 @@
+"""
+file: terrain.py
+description: chunked terrain for huge maps. Walls and mirrors, the bulk of a
+map, are kept in CHUNK x CHUNK chunks that are read from the map file the
+first time a cell in them is looked at. Only chunks with something in them
+take memory (a byte per cell), and past the budget the least recently used
+chunk is dropped (read again if it's needed again), except chunks around the
+tanks. Barrels, portals and spawns are few, so they're read up front like on
+any board.
+
+A Board made with chunks (see Board()) uses TileSets instead of sets for
+its walls and mirrors: they answer "space in board.walls" through the
+chunks, so collision, bullet and drawing code doesn't change. Iterating a
+TileSet (fog of war, fire on the map, env.py) goes through every chunk.
+
+usage:
+    python terrain.py [--size N] [--chunks N] [--moves N]
+        (writes a huge random map, plays random moves on it, prints memory)
+"""
+
+import argparse
+import os
+import random
+import re
+import tempfile
+import time
+from array import array
+from collections import OrderedDict
+
+CHUNK = 64 # cells per side of a chunk
+BUDGET = 1024 # chunks kept in memory by default, CHUNK * CHUNK bytes each
+RAYS = 4096 # most bullet paths (see Board.ray()) a chunked board caches
+EMPTY, WALL, TOP_LEFT, TOP_RIGHT = range(4) # tile codes in a chunk
+CODES = bytes(b"#/\\".find(bytes((c,))) + 1 for c in range(256)) # map char
+    # -> tile code, for bytes.translate()
+SPARSE = re.compile(rb"[O?S0-9]") # map characters read up front
+UNKNOWN, BLANK, LOADED = range(3) # what is known about a chunk
+NONE = -1 # cell id of nowhere, as in tanks.py
+
+class Terrain():
+    """
+    Walls and mirrors of a map file, a chunk at a time.
+        path: the map file <- string
+        size: length of rows/columns <- int
+        settings: SIZE, MAXHEALTH and FIRE lines, e.g. {"SIZE": 4096}
+            <- {string: int} dict
+        barrels, portals: their cells <- sets of ints
+        portalChannels: channel of each digit portal <- {int: char} dict
+        spawns: spawn cells <- list of ints
+        offsets, lengths: where each map row starts in the file, and its
+            length in bytes <- arrays
+        across: chunks per row of chunks <- int
+        states: UNKNOWN, BLANK (nothing in it) or LOADED, per chunk
+            <- bytearray
+        chunks: loaded chunks, least recently used first <- OrderedDict
+        budget: most chunks kept <- int
+        near: returns the cells whose chunks (and the chunks around them)
+            are never dropped <- function
+        last, lastChunk: chunk looked at last, skips the LRU bookkeeping
+            while lookups stay in one chunk <- int, bytearray
+        loads, evictions: chunks read and dropped so far <- ints
+    """
+    __slots__ = ("path", "size", "settings", "barrels", "portals", \
+        "portalChannels", "spawns", "offsets", "lengths", "across", "states", \
+        "chunks", "budget", "near", "last", "lastChunk", "loads", "evictions")
+
+    def __init__(self, path, budget=BUDGET, near=None):
+        """
+        Reads the header and the barrels, portals and spawns of a map.
+
+            path -> string -> map file
+            budget -> int -> most chunks kept in memory
+            near -> function -> returns cells to keep the chunks around
+                (e.g. the tanks'), None for none
+        """
+        self.path = path
+        self.settings = {}
+        self.barrels = set()
+        self.portals = set()
+        self.portalChannels = {}
+        self.spawns = []
+        self.offsets = array("q")
+        self.lengths = array("i")
+        self.size = 15
+        isMap = False
+        offset = 0
+        with open(path, "rb") as text:
+            for line in text:
+                if isMap:
+                    r = len(self.offsets)
+                    if r < self.size:
+                        self.offsets.append(offset)
+                        self.lengths.append(min(len(line.rstrip(b"\r\n")), \
+                            self.size))
+                        for tile in SPARSE.finditer(line, 0, self.size):
+                            self.addSparse(r * self.size + tile.start(), \
+                                tile.group().decode())
+                elif line.split():
+                    words = line.split()
+                    if words[0] == b"MAP":
+                        isMap = True
+                    elif words[0] in (b"SIZE", b"MAXHEALTH", b"FIRE"):
+                        self.settings[words[0].decode()] = int(words[1])
+                        if words[0] == b"SIZE":
+                            self.size = int(words[1])
+                offset += len(line)
+        self.across = -(-self.size // CHUNK)
+        self.states = bytearray(self.across * self.across)
+        self.chunks = OrderedDict()
+        self.budget = max(1, budget)
+        self.near = near
+        self.last = -1
+        self.lastChunk = None
+        self.loads = 0
+        self.evictions = 0
+
+    def addSparse(self, cell, char):
+        """
+        Records a barrel, portal or spawn found while reading the map.
+        """
+        if char == "O":
+            self.barrels.add(cell)
+        elif char == "?":
+            self.portals.add(cell)
+        elif char == "S":
+            self.spawns.append(cell)
+        else: #portal on a numbered channel
+            self.portals.add(cell)
+            self.portalChannels[cell] = char
+
+    def tile(self, cell):
+        """
+        Returns the tile code on a cell (EMPTY off the board).
+
+            cell -> int -> cell id
+        """
+        if not 0 <= cell < self.size * self.size:
+            return EMPTY
+        r, c = divmod(cell, self.size)
+        index = r // CHUNK * self.across + c // CHUNK
+        if index != self.last:
+            self.lastChunk = self.chunk(index)
+            self.last = index
+        if self.lastChunk is None:
+            return EMPTY
+        return self.lastChunk[r % CHUNK * CHUNK + c % CHUNK]
+
+    def chunk(self, index):
+        """
+        Returns a chunk's tiles, None if it has none. Reads it if needed.
+
+            index -> int -> chunk number, row of chunks * across + column
+        """
+        state = self.states[index]
+        if state == LOADED:
+            self.chunks.move_to_end(index)
+            return self.chunks[index]
+        if state == BLANK:
+            return None
+        return self.load(index)
+
+    def load(self, index):
+        """
+        Reads a chunk from the map file, then drops chunks over budget.
+
+            index -> int -> chunk number
+        """
+        top = index // self.across * CHUNK
+        left = index % self.across * CHUNK
+        tiles = None
+        with open(self.path, "rb") as text:
+            for r in range(top, min(top + CHUNK, len(self.offsets))):
+                width = min(CHUNK, self.lengths[r] - left)
+                if width <= 0:
+                    continue
+                text.seek(self.offsets[r] + left)
+                codes = text.read(width).translate(CODES)
+                if codes.count(0) == width:
+                    continue
+                if tiles is None:
+                    tiles = bytearray(CHUNK * CHUNK)
+                start = (r - top) * CHUNK
+                tiles[start:start + width] = codes
+        self.loads += 1
+        if tiles is None:
+            self.states[index] = BLANK
+            return None
+        self.states[index] = LOADED
+        self.chunks[index] = tiles
+        if len(self.chunks) > self.budget:
+            self.evict(index)
+        return tiles
+
+    def evict(self, loading):
+        """
+        Drops the least recently used chunks until the budget is met, if
+        there are enough chunks away from the cells near() returns.
+
+            loading -> int -> chunk being loaded, kept
+        """
+        kept = set((loading,))
+        for cell in (self.near() if self.near else ()):
+            if 0 <= cell < self.size * self.size:
+                r, c = divmod(cell, self.size)
+                r, c = r // CHUNK, c // CHUNK
+                kept.update((r + dr) * self.across + c + dc \
+                    for dr in (-1, 0, 1) for dc in (-1, 0, 1))
+        for index in [index for index in self.chunks if index not in kept][ \
+                :len(self.chunks) - self.budget]:
+            del self.chunks[index]
+            self.states[index] = UNKNOWN
+            self.evictions += 1
+        self.last = -1 # the last chunk may be gone
+
+    def cells(self, codes):
+        """
+        Yields every cell with one of some tile codes, a chunk at a time.
+
+            codes -> collection of ints -> tile codes to look for
+        """
+        for index in range(self.across * self.across):
+            tiles = self.chunk(index)
+            if tiles is None:
+                continue
+            top = index // self.across * CHUNK
+            left = index % self.across * CHUNK
+            for i, code in enumerate(tiles):
+                if code in codes:
+                    yield (top + i // CHUNK) * self.size + left + i % CHUNK
+
+class TileSet():
+    """
+    Set-like view of the cells with some tile codes, plus some extra cells
+    (e.g. portals for Board.allOccupiedSpaces).
+        terrain: chunks to look in <- Terrain
+        codes: tile codes in the set <- tuple of ints
+        extra: sets of cells also in it <- tuple of sets
+    """
+    __slots__ = ("terrain", "codes", "extra")
+
+    def __init__(self, terrain, codes, extra=()):
+        self.terrain = terrain
+        self.codes = codes
+        self.extra = extra
+
+    def __contains__(self, cell):
+        for cells in self.extra:
+            if cell in cells:
+                return True
+        return self.terrain.tile(cell) in self.codes
+
+    def __iter__(self):
+        seen = set()
+        for cells in self.extra:
+            for cell in cells:
+                if cell not in seen:
+                    seen.add(cell)
+                    yield cell
+        for cell in self.terrain.cells(self.codes):
+            if cell not in seen:
+                yield cell
+
+class Neighbors():
+    """
+    One direction of a neighbour table (see tanks.neighbors()), computed on
+    lookup instead of stored, for boards too big to store one.
+        size: length of rows/columns <- int
+        direction: N-W-S-E = 0-1-2-3 <- int
+    """
+    __slots__ = ("size", "direction")
+
+    def __init__(self, size, direction):
+        self.size = size
+        self.direction = direction
+
+    def __getitem__(self, cell):
+        size = self.size
+        if self.direction == 0:
+            return cell - size if cell >= size else NONE
+        if self.direction == 1:
+            return cell - 1 if cell % size else NONE
+        if self.direction == 2:
+            return cell + size if cell < size * (size - 1) else NONE
+        return cell + 1 if cell % size != size - 1 else NONE
+
+    def __len__(self):
+        return self.size * self.size
+
+def neighbors(size):
+    """
+    Returns the neighbour tables of a board size, computed on lookup.
+
+        size -> int -> length of rows/columns
+    """
+    return tuple(Neighbors(size, direction) for direction in range(4))
+
+def writeMap(path, size, rng, walls=0.02, mirrors=0.002):
+    """
+    Writes a random map with a spawn in each corner.
+
+        path -> string -> map file to write
+        size -> int -> length of rows/columns
+        rng -> random.Random -> where the map comes from
+        walls, mirrors -> float -> share of cells with them
+    """
+    choices = "#/\\"
+    weights = (walls, mirrors / 2, mirrors / 2)
+    with open(path, "w") as out:
+        out.write("SIZE %d\nMAP\n" % size)
+        for r in range(size):
+            row = [" "] * size
+            for _ in range(int(size * (walls + mirrors))):
+                row[rng.randrange(size)] = rng.choices(choices, weights)[0]
+            if r in (1, size - 2):
+                row[1] = row[size - 2] = "S"
+            out.write("".join(row).rstrip() + "\n")
+
+def main():
+    from tanks import Board
+    from renderers import NullRenderer
+    from server import memoryKB
+    parser = argparse.ArgumentParser(description="Benchmarks chunked maps.")
+    parser.add_argument("--size", type=int, default=4096, \
+        help="length of rows/columns (default: %(default)s)")
+    parser.add_argument("--chunks", type=int, default=BUDGET, \
+        help="chunks kept in memory (default: %(default)s)")
+    parser.add_argument("--moves", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    handle, path = tempfile.mkstemp(suffix=".txt")
+    os.close(handle)
+    try:
+        writeMap(path, args.size, rng)
+        before = memoryKB()
+        start = time.perf_counter()
+        board = Board(path, NullRenderer(), args.seed, chunks=args.chunks)
+        loaded = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(args.moves):
+            board.turn(rng.choice("wasdfokl;'"))
+        played = time.perf_counter() - start
+        terrain = board.chunks
+        print("%dx%d map (%.0f MB): opened in %.2f s, %d moves/s" % \
+            (args.size, args.size, os.path.getsize(path) / 2 ** 20, loaded, \
+            args.moves / played))
+        print("chunks: %d loaded, %d in memory (budget %d), %d evicted, " \
+            "board memory %d KB" % (terrain.loads, len(terrain.chunks), \
+            terrain.budget, terrain.evictions, memoryKB() - before))
+    finally:
+        os.remove(path)
+
+if __name__ == "__main__":
+    main()
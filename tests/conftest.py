@@ -0,0 +1,18 @@
+"""
+file: conftest.py
+description: Puts the game's modules on the path and runs every test from
+    the repository, where the builtin maps are.
+usage: python -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture(autouse=True)
+def repository(monkeypatch):
+    monkeypatch.chdir(ROOT)
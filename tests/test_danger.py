@@ -0,0 +1,81 @@
+"""
+file: test_danger.py
+description: A danger map must hold every cell a shot can reach on the
+    board: where the bullet flies and every flame of the barrels it sets
+    off. Where portals lead to one place, it must hold nothing else.
+usage: python -m pytest tests/test_danger.py
+"""
+
+import random
+
+import pytest
+
+import bitboard
+import danger
+from renderers import NullRenderer
+from tanks import Board, NONE
+
+TRIALS = 200
+
+class TracedBoard(Board):
+    """
+    Board that remembers where bullets and flames went.
+        traced: cells bullets entered and flames burnt <- set of ints
+    """
+    __slots__ = ("traced",)
+
+    def bulletHits(self, space):
+        self.traced.add(space)
+        return Board.bulletHits(self, space)
+
+    def flameOut(self, start):
+        flames = Board.flameOut(self, start)
+        self.traced.update(flames)
+        return flames
+
+def shot(board, initial, cell, direction, state):
+    """
+    Returns the cells a bullet shot from a cell reaches, simulated.
+    """
+    board.restore(initial)
+    board.rng.state = state # picks the exit of portals with several
+    board.traced = set()
+    board.shoot(cell, direction)
+    board.traced.discard(NONE)
+    return board.traced
+
+@pytest.mark.parametrize("filename", ["", "w", "f", "b", "p", \
+    "portalAndBarrels.txt", "chainReaction.txt", "haters.txt"])
+def test_danger_matches_shots(filename):
+    board = TracedBoard(filename, NullRenderer(), 1)
+    size = board.size
+    initial = board.snapshot()
+    several = any(len(exits) > 2 for exits in board.portalLinks.values())
+    rng = random.Random(1)
+    for _ in range(TRIALS):
+        board.restore(initial)
+        cell = rng.randrange(size * size)
+        if cell in board.allOccupiedSpaces:
+            continue
+        direction = rng.randrange(4)
+        cells = set(bitboard.toCells(danger.dangerMap(board, cell, \
+            (direction,), tanks=0), size))
+        if {board.p1, board.p2} & cells:
+            continue # the shot would hit a tank and reset the board
+        if several:
+            for state in range(0, 20 * 7919, 7919):
+                assert shot(board, initial, cell, direction, state) <= cells
+        else:
+            assert shot(board, initial, cell, direction, 0) == cells
+
+def test_line_of_fire_follows_rays():
+    board = Board("", NullRenderer(), 1)
+    size = board.size
+    for cell in range(size * size):
+        if cell in board.allOccupiedSpaces:
+            continue
+        for direction in range(4):
+            path = set(board.ray(cell, direction)[0]) - {NONE}
+            cells, struck = danger.lineOfFire(board, cell, (direction,), \
+                barrels=0, tanks=0)
+            assert path <= set(bitboard.toCells(cells, size))
@@ -0,0 +1,80 @@
+"""
+file: test_hotreload.py
+description: A board patched with the changes of an edited map file must be
+    the board a fresh load of the file gives, caches included.
+usage: python -m pytest tests/test_hotreload.py
+"""
+
+import random
+import shutil
+
+import pytest
+
+import danger
+from fov import FieldOfView
+from hotreload import MapText
+from renderers import NullRenderer
+from tanks import Board
+
+SEED = 5
+EDITS = 5
+TILES = " #/\\O?12S"
+MAP = ("walls", "barrels", "portals", "topLeftMirrors", "topRightMirrors", \
+    "allOccupiedSpaces", "spawns", "portalChannels", "portalLinks", \
+    "openBits")
+LAYERS = ("walls", "topLeftMirrors", "topRightMirrors", "portals", \
+    "channels", "fixed")
+
+def edit(path, size, rng):
+    """
+    Overwrites a few random cells of a map file.
+    """
+    lines = open(path).read().split("\n")
+    start = [line.split()[:1] for line in lines].index(["MAP"]) + 1
+    for _ in range(rng.randrange(1, 30)):
+        r = start + rng.randrange(size)
+        if r >= len(lines):
+            continue
+        row = lines[r].ljust(size)
+        c = rng.randrange(size)
+        lines[r] = row[:c] + rng.choice(TILES) + row[c + 1:]
+    open(path, "w").write("\n".join(lines))
+
+@pytest.mark.parametrize("filename", ["warzone.txt", "fortress.txt", \
+    "barricade.txt", "portals.txt", "portalAndBarrels.txt", \
+    "chainReaction.txt"])
+def test_patch_matches_load(tmp_path, filename):
+    path = str(tmp_path / filename)
+    shutil.copy(filename, path)
+    board = Board(path, NullRenderer(), SEED)
+    text = MapText(path)
+    size = board.size
+    board.setFog((1, 2))
+    board.visibleSpaces() # fill the caches patch() has to fix
+    danger.layers(board)
+    for cell in range(size * size):
+        for direction in range(4):
+            board.ray(cell, direction)
+    rng = random.Random(SEED)
+    for _ in range(EDITS):
+        edit(path, size, rng)
+        board.patch(text.diff())
+        hashes = board.zobrist, board.fireKey
+        board.rehash()
+        assert (board.zobrist, board.fireKey) == hashes
+
+        fresh = Board(path, NullRenderer(), SEED)
+        for name in MAP:
+            assert getattr(board, name) == getattr(fresh, name), name
+        for cell in range(size * size):
+            for direction in range(4):
+                assert board.ray(cell, direction) == \
+                    fresh.ray(cell, direction)
+        patched, loaded = danger.layers(board), danger.Layers(fresh)
+        for name in LAYERS:
+            assert getattr(patched, name) == getattr(loaded, name), name
+        view = FieldOfView(fresh)
+        for cell in range(0, size * size, 3):
+            assert board.sight.view(cell, cell % 4) == \
+                view.view(cell, cell % 4)
+        assert set(board.curBarrels) <= board.barrels
@@ -0,0 +1,66 @@
+"""
+file: test_replay.py
+description: Seeking in a replay log must give the board that playing the
+    moves from the start gives.
+usage: python -m pytest tests/test_replay.py
+"""
+
+import random
+
+import pytest
+
+from bot import KEYS
+from renderers import NullRenderer
+from replay import ReplayReader, ReplayWriter
+from tanks import Board, BURN
+
+SEED = 7
+MOVES = 300
+
+def play(filename, path, interval):
+    """
+    Plays random moves and logs them. Returns the snapshot before each move
+    and after the last one.
+    """
+    rng = random.Random(SEED)
+    board = Board(filename, NullRenderer(), SEED)
+    log = ReplayWriter(path, filename, SEED, interval)
+    keys = KEYS[1] + KEYS[2] + BURN
+    snapshots = [board.snapshot()]
+    for _ in range(MOVES):
+        if board.gameOver():
+            break
+        key = rng.choice(keys)
+        log.record(key, board.hash(), board)
+        board.turn(key)
+        snapshots.append(board.snapshot())
+    log.close()
+    return snapshots
+
+@pytest.mark.parametrize("filename", ["", "p", "chainReaction.txt"])
+@pytest.mark.parametrize("interval", [0, 16])
+def test_seek_matches_simulation(tmp_path, filename, interval):
+    path = str(tmp_path / "match.log")
+    snapshots = play(filename, path, interval)
+    reader = ReplayReader(path)
+    try:
+        assert reader.moves == len(snapshots) - 1
+        assert bool(reader.keyframes) == bool(interval)
+        order = list(range(len(snapshots)))
+        random.Random(SEED).shuffle(order) # backwards seeks too
+        for move in order:
+            board = reader.seek(move)
+            assert board.snapshot() == snapshots[move]
+            assert board.hash() == board.snapshotHash(snapshots[move])
+    finally:
+        reader.close()
+
+def test_seek_out_of_range(tmp_path):
+    path = str(tmp_path / "match.log")
+    snapshots = play("", path, 16)
+    reader = ReplayReader(path)
+    try:
+        with pytest.raises(ValueError):
+            reader.seek(len(snapshots))
+    finally:
+        reader.close()
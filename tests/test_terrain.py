@@ -0,0 +1,66 @@
+"""
+file: test_terrain.py
+description: A board reading its map in chunks must play like the same map
+    read up front, even when chunks are dropped and read again.
+usage: python -m pytest tests/test_terrain.py
+"""
+
+import random
+
+import pytest
+
+from bot import KEYS
+from renderers import NullRenderer
+from tanks import Board, BURN
+from terrain import writeMap
+
+SEED = 3
+MOVES = 500
+
+def boards(path, budget):
+    """
+    Returns the map read up front and read in chunks.
+    """
+    return Board(path, NullRenderer(), SEED), \
+        Board(path, NullRenderer(), SEED, chunks=budget)
+
+@pytest.fixture
+def huge(tmp_path):
+    path = str(tmp_path / "huge.txt")
+    writeMap(path, 300, random.Random(SEED), walls=0.05, mirrors=0.02)
+    return path
+
+@pytest.mark.parametrize("filename", ["warzone.txt", "portals.txt", \
+    "chainReaction.txt"])
+def test_tiles_match(filename):
+    memory, chunked = boards(filename, 1)
+    assert chunked.size == memory.size
+    assert chunked.barrels == memory.barrels
+    assert chunked.portals == memory.portals
+    assert chunked.spawns == memory.spawns
+    for name in ("walls", "topLeftMirrors", "topRightMirrors"):
+        assert set(getattr(chunked, name)) == getattr(memory, name)
+        for cell in range(memory.size * memory.size):
+            assert (cell in getattr(chunked, name)) == \
+                (cell in getattr(memory, name))
+
+def test_rays_match(huge):
+    memory, chunked = boards(huge, 2)
+    rng = random.Random(SEED)
+    for _ in range(2000):
+        cell = rng.randrange(memory.size * memory.size)
+        direction = rng.randrange(4)
+        assert chunked.ray(cell, direction) == memory.ray(cell, direction)
+    assert chunked.chunks.evictions > 0
+
+@pytest.mark.parametrize("budget", [2, 64])
+def test_play_matches(huge, budget):
+    memory, chunked = boards(huge, budget)
+    rng = random.Random(SEED)
+    keys = KEYS[1] + KEYS[2] + BURN
+    for _ in range(MOVES):
+        key = rng.choice(keys)
+        memory.turn(key)
+        chunked.turn(key)
+        assert chunked.snapshot() == memory.snapshot()
+        assert chunked.hash() == memory.hash()
@@ -0,0 +1,116 @@
+"""
+file: zobrist.py
+description: Zobrist hashing of board state. Every (feature, value) pair,
+like "player 1 is on cell 40" or "a barrel is on cell 7", has a fixed
+pseudo-random 64-bit key, and a state's hash is the XOR of the keys of
+everything in it. Changing one thing updates the hash with two XORs.
+Keys are computed from the feature and value (not drawn from an RNG), so
+every process and every network peer agrees on them.
+"""
+
+import hashlib
+
+MASK64 = (1 << 64) - 1
+GOLDEN = 0x9E3779B97F4A7C15
+STORED = 1 << 16 # most cells of a board whose cell keys are stored
+
+# features
+P1, P2, BARREL, P1_DIRECTION, P2_DIRECTION, P1_HEALTH, P2_HEALTH, \
+    BARREL_LIMIT, FIRE, RNG = range(1, 11)
+
+def mix64(x):
+    """
+    Returns x scrambled into a well-spread 64-bit int (splitmix64's
+    finalizer, a bijection on 64-bit ints).
+
+        x -> int -> value to scramble
+    """
+    z = x & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+def key(feature, value):
+    """
+    Returns the key of a feature having a value.
+
+        feature -> int -> one of the features above
+        value -> int -> cell, direction, health, ...
+    """
+    return mix64(feature * GOLDEN + value)
+
+DIRECTIONS = (tuple(key(P1_DIRECTION, d) for d in range(4)), \
+    tuple(key(P2_DIRECTION, d) for d in range(4))) # per player, per direction
+
+_cells = {} # size -> cellKeys(size), cached
+
+def cellKeys(size):
+    """
+    Returns the keys of player 1, player 2 and a barrel on each cell, as a
+    tuple of 3 tuples indexed by cell id. Boards of the same size share them.
+    Boards of more than STORED cells get lazyCellKeys() instead, which don't
+    take seconds to make.
+
+        size -> int -> length of rows/columns
+    """
+    if size * size > STORED:
+        return lazyCellKeys(size)
+    if size not in _cells:
+        _cells[size] = tuple(tuple(key(feature, cell) for cell in \
+            range(size * size)) for feature in (P1, P2, BARREL))
+    return _cells[size]
+
+class CellKeys():
+    """
+    Keys of a feature on each cell, computed on lookup instead of stored,
+    for boards too big to store cellKeys().
+        feature: P1, P2 or BARREL <- int
+        cells: number of cells of the board <- int
+    """
+    __slots__ = ("feature", "cells")
+
+    def __init__(self, feature, cells):
+        self.feature = feature
+        self.cells = cells
+
+    def __getitem__(self, cell):
+        if cell < 0:
+            cell += self.cells # as a tuple would
+        return key(self.feature, cell)
+
+def lazyCellKeys(size):
+    """
+    Returns the same keys as cellKeys(size), computed on lookup.
+
+        size -> int -> length of rows/columns
+    """
+    return tuple(CellKeys(feature, size * size) for feature in \
+        (P1, P2, BARREL))
+
+def fireKey(fire):
+    """
+    Returns the hash of fire bitboards (see Board.fire), 0 if there are none:
+    the XOR of their layerKey()s, so changing one bitboard only needs that
+    one hashed again.
+
+        fire -> list of ints -> bitboards, one per ticks left
+    """
+    result = 0
+    for level, bits in enumerate(fire):
+        result ^= layerKey(level, bits)
+    return result
+
+def layerKey(level, bits):
+    """
+    Returns the part of fireKey() that comes from one fire bitboard, 0 if
+    it's empty. The bitboard is hashed as bytes in one go (blake2b), in time
+    linear in the board's area.
+
+        level -> int -> index of the bitboard in Board.fire
+        bits -> int -> the bitboard
+    """
+    if not bits:
+        return 0
+    digest = hashlib.blake2b(bits.to_bytes((bits.bit_length() + 7) // 8, \
+        "little"), digest_size=8).digest()
+    return mix64(key(FIRE, level) ^ int.from_bytes(digest, "little"))